@@ -0,0 +1,135 @@
+import math
+from statistics import NormalDist, median
+
+def quantile_interval(sorted_values, q, confidence=0.95):
+    # Distribution-free confidence interval for the q-quantile: the bounds are
+    # order statistics whose ranks come from the binomial (normal approximation),
+    # so no assumption is made about the shape of the latency distribution.
+    n = len(sorted_values)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    spread = z * math.sqrt(n * q * (1 - q))
+    lower = max(0, math.floor(n * q - spread) - 1)
+    upper = min(n - 1, math.ceil(n * q + spread) - 1)
+    return sorted_values[lower], sorted_values[upper]
+
+def mad(values):
+    center = median(values)
+    return median(abs(value - center) for value in values)
+
+class AdaptiveSampler:
+    # Decides how many probes each message length needs. A length is sampled
+    # until the confidence intervals of the tracked quantiles are narrow
+    # relative to the median; lengths on either side of a step in the curve
+    # are then topped up so the step itself is measured precisely. The first
+    # probes of a length are dropped when they stand far outside the rest
+    # (route discovery, ECDH/key setup on the first send).
+
+    def __init__(self, min_samples=5, max_samples=20, quantiles=(0.5, 0.95), tolerance=0.05,
+                 confidence=0.95, warmup=2, outlier_mads=6.0, step_factor=3.0, step_samples=None, value=None):
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.quantiles = quantiles
+        self.tolerance = tolerance
+        self.confidence = confidence
+        self.warmup = warmup
+        self.outlier_mads = outlier_mads
+        self.step_factor = step_factor
+        # Lengths next to a step get more than the usual cap, or refining them would add nothing
+        self.step_samples = step_samples if step_samples is not None else 2 * max_samples
+        if self.step_samples <= max_samples:
+            raise ValueError(f"step_samples ({self.step_samples}) must exceed max_samples ({max_samples})")
+        self.value = value or (lambda result: result['total_latency'])
+
+        self.samples = {}    # length -> kept results, in probe order
+        self.discarded = {}  # length -> warm-up results that were dropped
+        self.attempts = {}   # length -> probes sent, including failures
+        self.refined = set()  # lengths topped up because they border a step
+
+    def _values(self, length):
+        return [self.value(result) for result in self.samples.get(length, [])]
+
+    def _drop_warmup(self, length):
+        # Runs once per length, as soon as there are enough later probes to
+        # judge the leading ones against
+        results = self.samples[length]
+        if length in self.discarded or len(results) < self.min_samples:
+            return
+        rest = [self.value(result) for result in results[self.warmup:]]
+        if len(rest) < 3:
+            return
+        center = median(rest)
+        limit = center + self.outlier_mads * max(mad(rest), 0.01 * abs(center))
+        leading = results[:self.warmup]
+        self.discarded[length] = [result for result in leading if self.value(result) > limit]
+        results[:self.warmup] = [result for result in leading if self.value(result) <= limit]
+
+    def converged(self, length):
+        values = sorted(self._values(length))
+        if len(values) < self.min_samples:
+            return False
+        center = median(values)
+        if center <= 0:
+            return True
+        for q in self.quantiles:
+            lower, upper = quantile_interval(values, q, self.confidence)
+            if (upper - lower) / 2 > self.tolerance * center:
+                return False
+        return True
+
+    def sample(self, length, measure, target):
+        # Probes one length until it converges or has been tried `target` times
+        results = self.samples.setdefault(length, [])
+        while self.attempts.get(length, 0) < target:
+            if len(results) >= self.min_samples and self.converged(length):
+                break
+            self.attempts[length] = self.attempts.get(length, 0) + 1
+            result = measure(length)
+            if result is not None:
+                results.append(result)
+                self._drop_warmup(length)
+        return results
+
+    def find_steps(self, lengths):
+        # A step is a jump between neighbouring lengths that is several times the
+        # usual length-to-length change and clears both median intervals, e.g. an
+        # AES block boundary or the payload starting to span another mesh packet
+        measured = [length for length in lengths if len(self.samples.get(length, [])) >= self.min_samples]
+        if len(measured) < 3:
+            return []
+        medians = [median(self._values(length)) for length in measured]
+        jumps = [abs(after - before) for before, after in zip(medians, medians[1:])]
+        typical = median(jumps)
+        steps = []
+        for index, jump in enumerate(jumps):
+            if jump <= self.step_factor * typical:
+                continue
+            before, after = measured[index], measured[index + 1]
+            low_before, high_before = quantile_interval(sorted(self._values(before)), 0.5, self.confidence)
+            low_after, high_after = quantile_interval(sorted(self._values(after)), 0.5, self.confidence)
+            if low_after > high_before or high_after < low_before:
+                steps.append((before, after))
+        return steps
+
+    def sweep(self, lengths, measure, on_length=None):
+        lengths = list(lengths)
+        for length in lengths:
+            self.sample(length, measure, self.max_samples)
+            if on_length is not None:
+                on_length(length, self.samples[length])
+
+        steps = self.find_steps(lengths)
+        self.refined = {length for step in steps for length in step}
+        if self.refined:
+            print(f"Steps detected between lengths {', '.join(f'{a}-{b}' for a, b in steps)}; refining {len(self.refined)} lengths")
+        for length in sorted(self.refined):
+            # Keep sampling past convergence so both sides of the step are pinned down
+            results = self.samples[length]
+            while self.attempts[length] < self.step_samples + self.max_samples and len(results) < self.step_samples:
+                self.attempts[length] += 1
+                result = measure(length)
+                if result is not None:
+                    results.append(result)
+        return {length: results for length, results in self.samples.items() if results}
+
+    def total_attempts(self):
+        return sum(self.attempts.values())
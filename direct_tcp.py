@@ -1,57 +1,141 @@
-import socket
+import asyncio
 import json
 import time
+from serial_reader import format_timestamp, current_milli_time
+from mesh_tap import MeshTap, TopologyGraph
 
-def listen_for_painlessmesh_tcp(node_id, port=5555, timeout=300):
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind(('', port))
-    server_socket.listen(5)  # Listen for incoming connections
+# PainlessMesh default port
+PAINLESSMESH_PORT = 5555
+
+# painlessMesh frames are JSON objects terminated by a NUL byte; a peer that
+# sends this much without one is not speaking the protocol
+MAX_FRAME_LENGTH = 64 * 1024
+
+class FrameSplitter:
+    def __init__(self, max_frame_length=MAX_FRAME_LENGTH):
+        self.buffer = bytearray()
+        self.max_frame_length = max_frame_length
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        end = buffer.rfind(b'\0')
+        if end < 0:
+            if len(buffer) > self.max_frame_length:
+                raise ValueError(f"No frame delimiter in {len(buffer)} bytes")
+            return []
+        frames = [frame for frame in bytes(buffer[:end]).split(b'\0') if frame]
+        del buffer[:end + 1]
+        return frames
+
+def decode_frame(frame):
+    # Each frame is decoded as soon as its delimiter arrives; undecodable ones
+    # are passed on as raw bytes rather than dropped
+    try:
+        return json.loads(frame)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return frame
+
+async def mesh_messages(port=PAINLESSMESH_PORT, host='', max_connections=1024, queue_size=10000, on_connection=None):
+    # Async generator of (peer, timestamp_ns, message) for every frame any
+    # connected node sends. Connections stay open for as long as the peer
+    # keeps them; each is a task reading whatever has arrived, so hundreds can
+    # be held at once. When the consumer falls behind, the bounded queue stops
+    # the readers and TCP flow control pushes back on the senders.
+    # on_connection(peer, connected) is called as peers come and go.
+    queue = asyncio.Queue(queue_size)
+    connections = set()
+
+    async def serve(reader, writer):
+        peer = '%s:%d' % writer.get_extra_info('peername')[:2]
+        if len(connections) >= max_connections:
+            print(f"[{current_milli_time()}][{peer}] Refused, {len(connections)} connections open")
+            writer.close()
+            return
+        connections.add(writer)
+        if on_connection is not None:
+            on_connection(peer, True)
+        splitter = FrameSplitter()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                timestamp = time.perf_counter_ns()
+                for frame in splitter.feed(data):
+                    await queue.put((peer, timestamp, decode_frame(frame)))
+        except (ConnectionError, ValueError) as e:
+            print(f"[{current_milli_time()}][{peer}] Connection dropped: {e}")
+        finally:
+            connections.discard(writer)
+            writer.close()
+            if on_connection is not None:
+                on_connection(peer, False)
+
+    server = await asyncio.start_server(serve, host or None, port, reuse_address=True, backlog=max_connections)
+    try:
+        while True:
+            yield await queue.get()
+    finally:
+        server.close()
+        for writer in list(connections):
+            writer.close()
+        await server.wait_closed()
 
+async def listen(node_id, port=PAINLESSMESH_PORT, timeout=300):
     print(f"Listening for PainlessMesh TCP connections on port {port}")
     print(f"Looking for node ID: {node_id}")
     print(f"Will listen for {timeout} seconds. Press Ctrl+C to stop earlier.")
 
-    start_time = time.time()
+    def on_connection(peer, connected):
+        print(f"[{current_milli_time()}][{peer}] {'Accepted connection' if connected else 'Connection closed'}")
+
+    # painlessMesh puts node IDs in messages as decimal uint32s; a hex string is the chip ID form
+    node = int(node_id, 16) if isinstance(node_id, str) else node_id
+
+    def on_topology(graph):
+        hops = {other: distance for other, distance in graph.distances(node).items() if other != node}
+        print(f"[{current_milli_time()}] Topology v{graph.version}: {len(graph.nodes())} nodes, "
+              f"node {node} reaches {len(hops)} of them" + (f" in up to {max(hops.values())} hops" if hops else ""))
+
+    def on_node_message(peer, timestamp, message):
+        print(f"Found node ID {node_id} in message!")
+
+    tap = MeshTap(topology=TopologyGraph(on_topology))
+    tap.subscribe(on_node_message, nodes=[node])
+
+    received = 0
+    messages = mesh_messages(port, on_connection=on_connection)
+
+    async def consume():
+        nonlocal received
+        async for peer, timestamp, message in messages:
+            received += 1
+            if isinstance(message, bytes):
+                print(f"[{format_timestamp(timestamp)}][{peer} IN] Unable to decode as JSON. Raw data: {message.hex()}")
+                continue
+            print(f"[{format_timestamp(timestamp)}][{peer} IN] {json.dumps(message, separators=(',', ':'))}")
+            tap.add(peer, timestamp, message)
 
     try:
-        while time.time() - start_time < timeout:
-            try:
-                client_socket, addr = server_socket.accept()
-                print(f"Accepted connection from {addr}")
-                data = client_socket.recv(1024)
-                
-                print(f"Received message from {addr}:")
-                
-                try:
-                    json_data = json.loads(data.decode('utf-8'))
-                    print(f"Decoded JSON: {json.dumps(json_data, indent=2)}")
-                    
-                    # Check if the node ID is in the JSON data
-                    if str(node_id) in str(json_data):
-                        print(f"Found node ID {node_id} in message!")
-                except json.JSONDecodeError:
-                    print("Unable to decode as JSON. Raw data:")
-                    print(data.hex())
-                
-                print("-" * 40)
-                client_socket.close()
-
-            except socket.timeout:
-                # This is expected, just continue
-                pass
-            except Exception as e:
-                print(f"Error receiving data: {e}")
+        await asyncio.wait_for(consume(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await messages.aclose()
+        print(f"{received} messages received")
 
+def listen_for_painlessmesh_tcp(node_id, port=PAINLESSMESH_PORT, timeout=300):
+    try:
+        asyncio.run(listen(node_id, port, timeout))
     except KeyboardInterrupt:
         print("Listening stopped by user.")
-    finally:
-        server_socket.close()
 
-# The node ID you're looking for
-node_id = "1ca6272d"
+def main():
+    # The node ID you're looking for
+    node_id = "1ca6272d"
 
-# PainlessMesh default port
-painlessmesh_port = 5555
+    listen_for_painlessmesh_tcp(node_id, PAINLESSMESH_PORT)
 
-listen_for_painlessmesh_tcp(node_id, painlessmesh_port)
+if __name__ == "__main__":
+    main()
@@ -1,212 +1,204 @@
-import serial
-import time
+import asyncio
+import json
 import random
 import string
-import matplotlib.pyplot as plt
-import threading
-import queue
-from datetime import datetime, timedelta
 import numpy as np
-from statistics import mean, median
-
-def current_milli_time():
-    return datetime.now().strftime('%H:%M:%S.%f')[:-3]
-
-def read_from_port(ser, message_queue, stop_event):
-    while not stop_event.is_set():
-        if ser.in_waiting:
-            response = ser.readline().decode().strip()
-            timestamp = current_milli_time()
-            print(f"[{timestamp}][{ser.port} IN] {response}")
-            message_queue.put((ser.port, timestamp, response))
-
-def send_and_receive(ser, plaintext, message_queue, timeout=10):
-    command = f"hirg -e {plaintext}\n"
-    timestamp = current_milli_time()
-    print(f"[{timestamp}][{ser.port} OUT] {command.strip()}")
-    ser.write(command.encode())
-
-    encryption_time = None
-    decryption_time = None
-    events = []
-
-    start_time = datetime.now()
-    while (datetime.now() - start_time) < timedelta(seconds=timeout):
+from datetime import datetime
+from serial_reader import current_milli_time
+from serial_engine import SerialEngine
+from firmware_events import DECRYPTION_TIME, ENCRYPTION_TIME, LOCAL_ENCRYPTED, TEST_KEY, classify
+from firmware_crypto import check_batch
+from log_sink import LogSink, LINES
+from stats import format_stat_lines, summarize_groups, variance_components
+import plotting
+
+# performLocalEncryptionTest prints each of these once per test; the decryption time comes last
+TEST_LINES = (r'Test Key: ', r'Encryption time /us: \d+', r'Encrypted: ', r'Decryption time /us: \d+')
+
+async def local_test(engine, node, plaintext, timeout=10):
+    # All four waiters are armed before the command goes out
+    replies = [engine.expect(node, pattern) for pattern in TEST_LINES]
+    try:
+        await engine.send(node, f"hirg -e {plaintext}")
+    except BaseException:
+        for reply in replies:
+            reply.cancel()
+        raise
+    events = {}
+    for reply in await asyncio.gather(*(engine.wait(reply, timeout) for reply in replies)):
+        if reply is not None:
+            event = classify(*reply)
+            events[event.kind] = event
+    if ENCRYPTION_TIME not in events or DECRYPTION_TIME not in events:
+        print(f"[{current_milli_time()}][{node['port']}] Timeout reached or incomplete data")
+        return None
+    return {
+        'port': node['port'],
+        'encryption_time': events[ENCRYPTION_TIME].value / 1000,  # Convert to ms
+        'decryption_time': events[DECRYPTION_TIME].value / 1000,
+        'key': events[TEST_KEY].payload if TEST_KEY in events else None,
+        'content': events[LOCAL_ENCRYPTED].payload if LOCAL_ENCRYPTED in events else None,
+        'plaintext': plaintext,
+    }
+
+async def run_board(engine, node, work, all_results, timeout, test_gap):
+    # Local AES tests touch nothing outside the board, so every board works
+    # through the shared matrix at its own pace
+    while True:
         try:
-            port, timestamp, message = message_queue.get(timeout=0.1)
-            events.append((port, timestamp, message))
-
-            if "Encryption time /us:" in message:
-                encryption_time = int(message.split("Encryption time /us:")[1].strip()) / 1000  # Convert to ms
-            elif "Decryption time /us:" in message:
-                decryption_time = int(message.split("Decryption time /us:")[1].strip()) / 1000  # Convert to ms
-
-            if encryption_time is not None and decryption_time is not None:
-                return {
-                    'encryption_time': encryption_time,
-                    'decryption_time': decryption_time,
-                }, True
-
-        except queue.Empty:
-            continue
-
-    timestamp = current_milli_time()
-    print(f"[{timestamp}] Timeout reached or incomplete data")
-    return None, False
-
-def run_tests(ser, message_queue, payload_length, num_iterations, timeout=10):
-    results = []
-    for _ in range(num_iterations):
-        plaintext = ''.join(random.choices(string.ascii_letters + string.digits, k=payload_length))
-        result, success = send_and_receive(ser, plaintext, message_queue, timeout)
-        if success:
-            results.append(result)
-        time.sleep(0.1)  # Add delay between tests
-    return results
-
-def plot_results(all_results, length_increment, tests_per_length):
+            length = work.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        plaintext = ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+        result = await local_test(engine, node, plaintext, timeout)
+        if result is not None:
+            all_results.setdefault(length, []).append(result)
+        if test_gap:
+            await asyncio.sleep(test_gap)
+
+async def benchmark(nodes, lengths, tests_per_length, timeout=10, test_gap=0.0, echo=True):
+    cells = [length for length in lengths for _ in range(tests_per_length)]
+    random.shuffle(cells)  # Each length lands on every board, spread over the run
+    work = asyncio.Queue()
+    for cell in cells:
+        work.put_nowait(cell)
+
+    all_results = {}
+    print(f"[{current_milli_time()}] {len(cells)} encryption tests over {len(nodes)} board(s)")
+    async with SerialEngine(nodes, echo=echo) as engine:
+        await asyncio.gather(*(run_board(engine, node, work, all_results, timeout, test_gap) for node in nodes))
+    return all_results
+
+def verify_ciphertexts(all_results, processes=None):
+    # Re-encrypts every test on the host with the key and IV the board printed
+    # and compares ciphertexts, so a wrong result is caught, not just timed
+    tests = [result for results in all_results.values() for result in results
+             if result.get('key') and result.get('content')]
+    if not tests:
+        print("No ciphertexts captured to verify")
+        return
+    checks = check_batch([{'key': result['key'], 'content': result['content'], 'plaintext': result['plaintext']}
+                          for result in tests], processes)
+    for result, checked in zip(tests, checks):
+        result['verified'] = checked['valid']
+    failed = [(result, checked) for result, checked in zip(tests, checks) if not checked['valid']]
+    print(f"Ciphertexts verified on the host: {len(tests) - len(failed)}/{len(tests)} match")
+    for result, checked in failed:
+        reason = " (key has a NUL byte; the board's effective key is undefined past it)" if checked['key_truncated'] else ""
+        print(f"  Mismatch on {result['port']} for '{result['plaintext']}' with key {result['key']}{reason}")
+
+def board_report(all_results):
+    # Chip-to-chip differences: each board's cost model and, per length, how
+    # much of the spread in times is between boards rather than within them
+    boards = sorted({result['port'] for results in all_results.values() for result in results})
+    report = {'boards': {}, 'lengths': {}}
+    summary = "Boards:\n"
+    for port in boards:
+        tests = [(length, result) for length, results in all_results.items() for result in results if result['port'] == port]
+        blocks = np.array([length // 16 + 1 for length, _ in tests], dtype=np.float64)  # PKCS7 blocks per test
+        model = {'tests': len(tests)}
+        for operation in ('encryption', 'decryption'):
+            times = np.array([result[f'{operation}_time'] * 1000 for _, result in tests])
+            if np.unique(blocks).size >= 2:
+                per_block, fixed = np.polyfit(blocks, times, 1)
+                model[operation] = {'fixed_us': float(fixed), 'per_block_us': float(per_block)}
+        report['boards'][port] = model
+        summary += f"  {port}: {len(tests)} tests"
+        for operation in ('encryption', 'decryption'):
+            if operation in model:
+                summary += (f", {operation} {model[operation]['fixed_us']:.1f} us + "
+                            f"{model[operation]['per_block_us']:.1f} us/block")
+        summary += "\n"
+
+    if len(boards) >= 2:
+        summary += "Between boards (spread of board means, share of variance due to the board):\n"
+        for length in sorted(all_results):
+            report['lengths'][length] = {}
+            line = f"  Length {length}:"
+            for operation in ('encryption', 'decryption'):
+                by_board = {}
+                for result in all_results[length]:
+                    by_board.setdefault(result['port'], []).append(result[f'{operation}_time'])
+                components = variance_components(by_board)
+                report['lengths'][length][operation] = components
+                if components is not None:
+                    line += f" {operation} {components['spread']:.3f} ms, {components['eta_squared'] * 100:.0f}%;"
+            summary += line.rstrip(';') + "\n"
+    print(summary)
+    return report, summary
+
+def plot_results(all_results, filename):
     lengths = sorted(all_results.keys())
-    
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
-    bar_width = 0.35
-    colors = ['lightblue', 'lightgreen']
-    
-    # Calculate overall maximum y-value
-    all_times = [result[f'{op}_time'] for length in lengths for result in all_results[length] for op in ['encryption', 'decryption']]
-    y_max = max(all_times) * 1.1  # Add 10% headroom
-    
-    for idx, (ax, operation) in enumerate([(ax1, 'encryption'), (ax2, 'decryption')]):
-        all_times = [result[f'{operation}_time'] for length in lengths for result in all_results[length]]
-        positions = np.arange(len(all_times))
-        
-        # Plot individual results as bars
-        ax.bar(positions, all_times, bar_width, color=colors[idx], alpha=1)
-        
-        # Add vertical lines to separate different length iterations
-        for i in range(1, len(lengths)):
-            ax.axvline(x=i*tests_per_length - 0.5, color='gray', linestyle='--', alpha=0.5)
-        
-        # Calculate and plot median and average lines
-        medians = [median([r[f'{operation}_time'] for r in all_results[length]]) for length in lengths]
-        averages = [mean([r[f'{operation}_time'] for r in all_results[length]]) for length in lengths]
-        
-        median_positions = [np.mean(positions[i*tests_per_length:(i+1)*tests_per_length]) for i in range(len(lengths))]
-        
-        median_line, = ax.plot(median_positions, medians, 'ro-', linewidth=2, label='Median')
-        avg_line, = ax.plot(median_positions, averages, 'go-', linewidth=2, label='Average')
-        
-        # Add value labels to the side of the data points
-        for x, y_med, y_avg in zip(median_positions, medians, averages):
-            ax.annotate(f'{y_med:.2f}', (x, y_med), xytext=(5, 5), textcoords='offset points', 
-                        ha='left', va='center', color=median_line.get_color())
-            ax.annotate(f'{y_avg:.2f}', (x, y_avg), xytext=(-5, -5), textcoords='offset points', 
-                        ha='right', va='center', color=avg_line.get_color())
-        
-        ax.set_xlabel('Plaintext Length (bytes)')
-        ax.set_ylabel('Time (ms)')
-        ax.set_title(f'{operation.capitalize()} Test versus Plaintext Length')
-        ax.legend()
-        
-        # Set x-axis ticks to show payload lengths
-        ax.set_xticks(median_positions)
-        ax.set_xticklabels(lengths)
-        
-        # Set y-axis limit to the overall maximum
-        ax.set_ylim(0, y_max)
-        
-    plt.tight_layout()
-    filename = datetime.now().strftime('%Y%m%d_%H%M%S')
-    plt.savefig(f'{filename}_encryption_decryption_times.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    encryption_times = [[result['encryption_time'] for result in all_results[length]] for length in lengths]
+    decryption_times = [[result['decryption_time'] for result in all_results[length]] for length in lengths]
+    stats = {
+        'encryption': summarize_groups(all_results, lambda result: result['encryption_time']),
+        'decryption': summarize_groups(all_results, lambda result: result['decryption_time']),
+    }
+
+    plotting.submit(plotting.encryption_times, f'{filename}_encryption_decryption_times.png',
+                    lengths, encryption_times, decryption_times, stats)
+
+    boards = sorted({result['port'] for results in all_results.values() for result in results})
+    if len(boards) >= 2:
+        means = {port: [float(np.mean([result['encryption_time'] for result in all_results[length]
+                                       if result['port'] == port] or [np.nan])) for length in lengths]
+                 for port in boards}
+        plotting.submit(plotting.board_comparison, f'{filename}_encryption_by_board.png', lengths, means)
 
     # Summary statistics
     summary = "Summary:\n"
     for length in lengths:
-        encryption_times = [result['encryption_time'] for result in all_results[length]]
-        decryption_times = [result['decryption_time'] for result in all_results[length]]
-        
         summary += f"Length {length}:\n"
         summary += f"  Encryption:\n"
-        summary += f"    Min: {min(encryption_times):.3f} ms\n"
-        summary += f"    Median: {median(encryption_times):.3f} ms\n"
-        summary += f"    Avg: {mean(encryption_times):.3f} ms\n"
-        summary += f"    Max: {max(encryption_times):.3f} ms\n"
+        summary += format_stat_lines(stats['encryption'][length], indent='    ', precision=3)
         summary += f"  Decryption:\n"
-        summary += f"    Min: {min(decryption_times):.3f} ms\n"
-        summary += f"    Median: {median(decryption_times):.3f} ms\n"
-        summary += f"    Avg: {mean(decryption_times):.3f} ms\n"
-        summary += f"    Max: {max(decryption_times):.3f} ms\n"
-        summary += f"  Iterations: {len(encryption_times)}\n\n"
+        summary += format_stat_lines(stats['decryption'][length], indent='    ', precision=3)
+        summary += f"  Iterations: {stats['encryption'][length]['count']}\n\n"
 
     print(summary)
-    
-    with open(f'{filename}_summary.txt', 'w') as f:
-        f.write(summary)
+    return summary
 
 def main():
-    port = 'COM5'
+    nodes = [
+        {'port': 'COM13', 'node_id': 480652657},
+        {'port': 'COM5', 'node_id': 2385360021},
+    ]
     min_length = 10
     max_length = 100
     length_increment = 5
     tests_per_length = 10
     timeout = 5
+    test_gap = 0.0  # Seconds between tests on one board
+    verbosity = LINES  # SUMMARY prints only results, COMMANDS adds the commands sent; the log file gets everything
 
+    filename = datetime.now().strftime('%Y%m%d_%H%M%S')
+    lengths = range(min_length, max_length + 1, length_increment)
+    log = LogSink(f"{filename}_serial", verbosity).start()
     try:
-        ser = serial.Serial(port, 115200, timeout=1)
-    except serial.SerialException as e:
-        print(f"Error opening serial port {port}: {e}")
+        all_results = asyncio.run(benchmark(nodes, lengths, tests_per_length, timeout, test_gap, echo=log))
+    except KeyboardInterrupt:
+        print("\nBenchmark interrupted")
         return
+    finally:
+        log.stop()
 
-    message_queue = queue.Queue()
-    stop_event = threading.Event()
-
-    thread = threading.Thread(target=read_from_port, args=(ser, message_queue, stop_event))
-    thread.start()
-
-    all_results = {}
+    if not all_results:
+        print("No results to plot.")
+        return
 
+    verify_ciphertexts(all_results)
+    report, board_summary = board_report(all_results)
     try:
-        for length in range(min_length, max_length + 1, length_increment):
-            print(f"\n--- Testing message length: {length} ---")
-            results = run_tests(ser, message_queue, length, tests_per_length, timeout)
-            
-            if results:
-                all_results[length] = results
-                encryption_times = [r['encryption_time'] for r in results]
-                decryption_times = [r['decryption_time'] for r in results]
-                print(f"Statistics for length {length}:")
-                print(f"  Encryption:")
-                print(f"    Min: {min(encryption_times):.3f} ms")
-                print(f"    Median: {median(encryption_times):.3f} ms")
-                print(f"    Avg: {mean(encryption_times):.3f} ms")
-                print(f"    Max: {max(encryption_times):.3f} ms")
-                print(f"  Decryption:")
-                print(f"    Min: {min(decryption_times):.3f} ms")
-                print(f"    Median: {median(decryption_times):.3f} ms")
-                print(f"    Avg: {mean(decryption_times):.3f} ms")
-                print(f"    Max: {max(decryption_times):.3f} ms")
-            else:
-                print(f"No valid results for length {length}, skipping...")
+        summary = plot_results(all_results, filename)
     except Exception as e:
-        print(f"An error occurred during testing: {e}")
-
-    finally:
-        stop_event.set()
-        thread.join()
+        print(f"Error during plotting: {e}")
+        summary = ""
 
-        try:
-            ser.close()
-        except:
-            pass
-        print("\nSerial port closed")
-
-    if all_results:
-        try:
-            plot_results(all_results, length_increment, tests_per_length)
-        except Exception as e:
-            print(f"Error during plotting: {e}")
-    else:
-        print("No results to plot.")
+    with open(f'{filename}_summary.txt', 'w') as f:
+        f.write(summary + board_summary)
+    with open(f'{filename}_encryption.json', 'w') as f:
+        json.dump({'results': all_results, 'boards': report}, f, indent=2)
 
 if __name__ == "__main__":
     main()
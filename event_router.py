@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+from firmware_events import classify
+
+class Deadline:
+    def __init__(self, timeout):
+        self.expires = time.perf_counter() + timeout
+
+    def remaining(self):
+        return max(0.0, self.expires - time.perf_counter())
+
+    def expired(self):
+        return time.perf_counter() >= self.expires
+
+class Subscription:
+    def __init__(self, router, ports, prefixes, kinds, callback=None):
+        self.router = router
+        self.ports = tuple(ports)
+        self.prefixes = tuple(prefixes)
+        self.kinds = tuple(kinds)
+        self.callback = callback
+        self.queue = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def deliver(self, event):
+        if self.callback is not None:
+            self.callback(event)
+        else:
+            self.queue.put(event)
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+    def until(self, deadline):
+        # Yields events as they are delivered and stops the moment the deadline
+        # passes; the blocking get wakes on delivery, so nothing is polled.
+        if not isinstance(deadline, Deadline):
+            deadline = Deadline(deadline)
+        while True:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                return
+            try:
+                yield self.queue.get(timeout=remaining)
+            except queue.Empty:
+                return
+
+    def close(self):
+        self.router.unsubscribe(self)
+
+class EventRouter:
+    # Routes (port, timestamp, line) events to the subscriptions interested in
+    # that port and line prefix, or in that kind of firmware event. Prefix
+    # subscribers receive the raw tuple; kind subscribers receive the line's
+    # FirmwareEvent, classified once no matter how many subscribers want it.
+    # put() matches the message_queue interface, so a router can be handed to
+    # read_from_port in place of a queue.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        # port -> (distinct prefix lengths, {prefix: (subscription, ...)}, {kind: (subscription, ...)})
+        # Rebuilt on every (un)subscribe and swapped in whole, so put() never locks.
+        self.routes = {}
+
+    def subscribe(self, ports, prefixes=(), kinds=(), callback=None):
+        if isinstance(ports, str):
+            ports = [ports]
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        if isinstance(kinds, str):
+            kinds = [kinds]
+        if not prefixes and not kinds:
+            prefixes = ['']
+        subscription = Subscription(self, ports, prefixes, kinds, callback)
+        with self.lock:
+            self.subscriptions.append(subscription)
+            self._rebuild()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+                self._rebuild()
+
+    def _rebuild(self):
+        routes = {}
+        for subscription in self.subscriptions:
+            for port in subscription.ports:
+                prefix_table, kind_table = routes.setdefault(port, ({}, {}))
+                for prefix in subscription.prefixes:
+                    prefix_table.setdefault(prefix, []).append(subscription)
+                for kind in subscription.kinds:
+                    kind_table.setdefault(kind, []).append(subscription)
+        self.routes = {
+            port: (tuple(sorted({len(prefix) for prefix in prefix_table})),
+                   {prefix: tuple(subscriptions) for prefix, subscriptions in prefix_table.items()},
+                   {kind: tuple(subscriptions) for kind, subscriptions in kind_table.items()})
+            for port, (prefix_table, kind_table) in routes.items()
+        }
+
+    def put(self, event):
+        port, timestamp, line = event
+        route = self.routes.get(port)
+        if route is None:
+            return
+        lengths, prefix_table, kind_table = route
+
+        if kind_table:
+            record = classify(port, timestamp, line)
+            for subscription in kind_table.get(record.kind, ()):
+                subscription.deliver(record)
+
+        # One dict lookup per distinct prefix length, independent of subscriber count
+        matched = None
+        for length in lengths:
+            subscriptions = prefix_table.get(line[:length])
+            if subscriptions:
+                matched = subscriptions if matched is None else matched + subscriptions
+        if matched is None:
+            return
+        if len(matched) > 1:
+            matched = dict.fromkeys(matched)
+        for subscription in matched:
+            subscription.deliver(event)
@@ -0,0 +1,328 @@
+import functools
+import json
+import multiprocessing
+
+# Host-side mirror of the firmware's encryptAES/decryptAES and ECDH key
+# derivation, for checking the ciphertexts boards print and decrypting
+# captured encryptedMessage traffic.
+#
+# What Hieroglossa_1_2_simple.ino actually does, bugs included:
+#  - Every 16-byte block is C = E(P ^ IV) ^ IV with the same IV, not CBC.
+#  - The plaintext is trim()med, then PKCS7-padded. Decryption strips
+#    padding without checking it.
+#  - The content is the IV's hex followed by the ciphertext's hex.
+#  - The key goes through String((char*)key), which ends at the first NUL byte.
+#  - Ciphertext bytes are appended as String((char)b), which drops NUL
+#    bytes. encrypt() retries with a new IV until none occur.
+#  - ECDH is secp160r1 (uECC). The AES key is the first 16 bytes of the
+#    shared x coordinate.
+#
+# AES comes from the cryptography package when it is installed, and from
+# the pure-Python implementation below when it is not.
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+BLOCK = 16
+
+# AES tables
+
+def _multiply(a, b):
+    product = 0
+    while b:
+        if b & 1:
+            product ^= a
+        a = ((a << 1) ^ 0x1B) & 0xFF if a & 0x80 else a << 1
+        b >>= 1
+    return product
+
+def _tables():
+    sbox = [0] * 256
+    p = q = 1
+    while True:
+        # p walks the multiplicative group by 3, q by its inverse, so q = 1/p
+        p = p ^ ((p << 1) & 0xFF) ^ (0x1B if p & 0x80 else 0)
+        q ^= q << 1
+        q ^= q << 2
+        q ^= q << 4
+        q &= 0xFF
+        if q & 0x80:
+            q ^= 0x09
+        affine = q
+        for shift in range(1, 5):
+            affine ^= ((q << shift) | (q >> (8 - shift))) & 0xFF
+        sbox[p] = affine ^ 0x63
+        if p == 1:
+            break
+    sbox[0] = 0x63
+    inverse = [0] * 256
+    for index, value in enumerate(sbox):
+        inverse[value] = index
+
+    def rotations(word):
+        return [word, (word >> 8) | ((word & 0xFF) << 24), (word >> 16) | ((word & 0xFFFF) << 16),
+                (word >> 24) | ((word & 0xFFFFFF) << 8)]
+
+    encrypt = [[0] * 256 for _ in range(4)]
+    decrypt = [[0] * 256 for _ in range(4)]
+    for x in range(256):
+        s, i = sbox[x], inverse[x]
+        for table, word in zip(encrypt, rotations((_multiply(s, 2) << 24) | (s << 16) | (s << 8) | _multiply(s, 3))):
+            table[x] = word
+        for table, word in zip(decrypt, rotations((_multiply(i, 14) << 24) | (_multiply(i, 9) << 16)
+                                                  | (_multiply(i, 13) << 8) | _multiply(i, 11))):
+            table[x] = word
+    return sbox, inverse, encrypt, decrypt
+
+SBOX, INVERSE_SBOX, (TE0, TE1, TE2, TE3), (TD0, TD1, TD2, TD3) = _tables()
+
+class PurePythonAES:
+    # AES-128 on 32-bit table lookups; some 30k blocks/s per process
+    def __init__(self, key):
+        words = [int.from_bytes(key[i:i + 4], 'big') for i in range(0, 16, 4)]
+        rcon = 1
+        for i in range(4, 44):
+            word = words[i - 1]
+            if i % 4 == 0:
+                word = ((SBOX[(word >> 16) & 0xFF] << 24) | (SBOX[(word >> 8) & 0xFF] << 16)
+                        | (SBOX[word & 0xFF] << 8) | SBOX[word >> 24]) ^ (rcon << 24)
+                rcon = _multiply(rcon, 2)
+            words.append(words[i - 4] ^ word)
+        self.encryption_keys = words
+        # The equivalent inverse cipher's schedule: rounds reversed, InvMixColumns on the middle ones
+        decryption_keys = list(words[40:44])
+        for round_number in range(9, 0, -1):
+            for word in words[4 * round_number:4 * round_number + 4]:
+                decryption_keys.append(TD0[SBOX[word >> 24]] ^ TD1[SBOX[(word >> 16) & 0xFF]]
+                                       ^ TD2[SBOX[(word >> 8) & 0xFF]] ^ TD3[SBOX[word & 0xFF]])
+        decryption_keys.extend(words[0:4])
+        self.decryption_keys = decryption_keys
+
+    def encrypt_block(self, block):
+        k = self.encryption_keys
+        s0, s1, s2, s3 = (int.from_bytes(block[i:i + 4], 'big') ^ k[i // 4] for i in range(0, 16, 4))
+        for r in range(4, 40, 4):
+            s0, s1, s2, s3 = (
+                TE0[s0 >> 24] ^ TE1[(s1 >> 16) & 0xFF] ^ TE2[(s2 >> 8) & 0xFF] ^ TE3[s3 & 0xFF] ^ k[r],
+                TE0[s1 >> 24] ^ TE1[(s2 >> 16) & 0xFF] ^ TE2[(s3 >> 8) & 0xFF] ^ TE3[s0 & 0xFF] ^ k[r + 1],
+                TE0[s2 >> 24] ^ TE1[(s3 >> 16) & 0xFF] ^ TE2[(s0 >> 8) & 0xFF] ^ TE3[s1 & 0xFF] ^ k[r + 2],
+                TE0[s3 >> 24] ^ TE1[(s0 >> 16) & 0xFF] ^ TE2[(s1 >> 8) & 0xFF] ^ TE3[s2 & 0xFF] ^ k[r + 3])
+        s = SBOX
+        return b''.join(word.to_bytes(4, 'big') for word in (
+            ((s[s0 >> 24] << 24) | (s[(s1 >> 16) & 0xFF] << 16) | (s[(s2 >> 8) & 0xFF] << 8) | s[s3 & 0xFF]) ^ k[40],
+            ((s[s1 >> 24] << 24) | (s[(s2 >> 16) & 0xFF] << 16) | (s[(s3 >> 8) & 0xFF] << 8) | s[s0 & 0xFF]) ^ k[41],
+            ((s[s2 >> 24] << 24) | (s[(s3 >> 16) & 0xFF] << 16) | (s[(s0 >> 8) & 0xFF] << 8) | s[s1 & 0xFF]) ^ k[42],
+            ((s[s3 >> 24] << 24) | (s[(s0 >> 16) & 0xFF] << 16) | (s[(s1 >> 8) & 0xFF] << 8) | s[s2 & 0xFF]) ^ k[43]))
+
+    def decrypt_block(self, block):
+        k = self.decryption_keys
+        s0, s1, s2, s3 = (int.from_bytes(block[i:i + 4], 'big') ^ k[i // 4] for i in range(0, 16, 4))
+        for r in range(4, 40, 4):
+            s0, s1, s2, s3 = (
+                TD0[s0 >> 24] ^ TD1[(s3 >> 16) & 0xFF] ^ TD2[(s2 >> 8) & 0xFF] ^ TD3[s1 & 0xFF] ^ k[r],
+                TD0[s1 >> 24] ^ TD1[(s0 >> 16) & 0xFF] ^ TD2[(s3 >> 8) & 0xFF] ^ TD3[s2 & 0xFF] ^ k[r + 1],
+                TD0[s2 >> 24] ^ TD1[(s1 >> 16) & 0xFF] ^ TD2[(s0 >> 8) & 0xFF] ^ TD3[s3 & 0xFF] ^ k[r + 2],
+                TD0[s3 >> 24] ^ TD1[(s2 >> 16) & 0xFF] ^ TD2[(s1 >> 8) & 0xFF] ^ TD3[s0 & 0xFF] ^ k[r + 3])
+        s = INVERSE_SBOX
+        return b''.join(word.to_bytes(4, 'big') for word in (
+            ((s[s0 >> 24] << 24) | (s[(s3 >> 16) & 0xFF] << 16) | (s[(s2 >> 8) & 0xFF] << 8) | s[s1 & 0xFF]) ^ k[40],
+            ((s[s1 >> 24] << 24) | (s[(s0 >> 16) & 0xFF] << 16) | (s[(s3 >> 8) & 0xFF] << 8) | s[s2 & 0xFF]) ^ k[41],
+            ((s[s2 >> 24] << 24) | (s[(s1 >> 16) & 0xFF] << 16) | (s[(s0 >> 8) & 0xFF] << 8) | s[s3 & 0xFF]) ^ k[42],
+            ((s[s3 >> 24] << 24) | (s[(s2 >> 16) & 0xFF] << 16) | (s[(s1 >> 8) & 0xFF] << 8) | s[s0 & 0xFF]) ^ k[43]))
+
+    def encrypt(self, data):
+        return b''.join(self.encrypt_block(data[i:i + BLOCK]) for i in range(0, len(data), BLOCK))
+
+    def decrypt(self, data):
+        return b''.join(self.decrypt_block(data[i:i + BLOCK]) for i in range(0, len(data), BLOCK))
+
+class LibraryAES:
+    # The same interface over cryptography's AES; ECB because the firmware's
+    # blocks are independent once the IV is XORed in
+    def __init__(self, key):
+        self.cipher = Cipher(algorithms.AES(key), modes.ECB())
+
+    def encrypt(self, data):
+        encryptor = self.cipher.encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+
+    def decrypt(self, data):
+        decryptor = self.cipher.decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+@functools.lru_cache(maxsize=256)
+def aes(key):
+    # One key schedule per key, however many messages it protects
+    return LibraryAES(key) if Cipher is not None else PurePythonAES(key)
+
+# The firmware's scheme
+
+def key_bytes(key):
+    return bytes.fromhex(key) if isinstance(key, str) else bytes(key)
+
+def firmware_key(key):
+    # The 16 bytes setKey() sees, and whether a NUL cut the key short. After the
+    # NUL it reads the String's terminator and then whatever the heap held;
+    # that is modelled as zeros, so such keys may not match the board.
+    key = key_bytes(key)[:BLOCK]
+    end = key.find(b'\0')
+    if end < 0:
+        return key, False
+    return key[:end].ljust(BLOCK, b'\0'), True
+
+def string_key(text):
+    # A key held as text (v0.2's hex ECDH key, the default key String): setKey reads its first 16 characters
+    return text.encode()[:BLOCK].ljust(BLOCK, b'\0')
+
+def _xor_iv(data, iv):
+    stream = iv * (len(data) // BLOCK)
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(stream, 'big')).to_bytes(len(data), 'big')
+
+def pkcs7_pad(data):
+    length = BLOCK - len(data) % BLOCK
+    return data + bytes([length]) * length
+
+def encrypt(plaintext, key, iv):
+    # encryptAES with a given IV: the content hex (IV then ciphertext, upper
+    # case), or None when a ciphertext byte is 0 and the firmware would have
+    # drawn another IV
+    if isinstance(plaintext, str):
+        plaintext = plaintext.encode()
+    iv = key_bytes(iv)
+    cipher = aes(firmware_key(key)[0])
+    ciphertext = _xor_iv(cipher.encrypt(_xor_iv(pkcs7_pad(plaintext.strip()), iv)), iv)
+    if 0 in ciphertext:
+        return None
+    return (iv + ciphertext).hex().upper()
+
+def decrypt_bytes(content, key):
+    # The padded plaintext, before anything is stripped
+    data = bytes.fromhex(content)
+    iv, ciphertext = data[:BLOCK], data[BLOCK:]
+    ciphertext = ciphertext[:len(ciphertext) - len(ciphertext) % BLOCK]
+    return _xor_iv(aes(firmware_key(key)[0]).decrypt(_xor_iv(ciphertext, iv)), iv)
+
+def decrypt(content, key, strict=False):
+    # decryptAES. By default this is what the board would print: NUL bytes
+    # dropped, then as many bytes removed as the last one says. With strict,
+    # it returns None unless the PKCS7 padding is intact.
+    padded = decrypt_bytes(content, key)
+    if strict:
+        length = padded[-1] if padded else 0
+        if not 1 <= length <= BLOCK or padded[-length:] != bytes([length]) * length:
+            return None
+        return padded[:-length].decode('utf-8', errors='replace')
+    padded = padded.replace(b'\0', b'')
+    length = padded[-1] if padded else 0
+    return padded[:len(padded) - length].decode('utf-8', errors='replace')
+
+# ECDH on secp160r1 (SEC 2), as uECC_secp160r1() defines it; keys are big-endian bytes
+
+P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF7FFFFFFF
+A = P - 3
+B = 0x1C97BEFC54BD7A8B65ACF89F81D4D4ADC565FA45
+G = (0x4A96B5688EF573284664698968C38BB913CBFC82, 0x23A628553168947D59DCC912042351377AC5FB32)
+N = 0x0100000000000000000001F4C8F927AED3CA752257
+COORDINATE_BYTES = 20
+
+def on_curve(point):
+    x, y = point
+    return (y * y - (x * x * x + A * x + B)) % P == 0
+
+def _add(p1, p2):
+    if p1 is None:
+        return p2
+    if p2 is None:
+        return p1
+    (x1, y1), (x2, y2) = p1, p2
+    if x1 == x2:
+        if (y1 + y2) % P == 0:
+            return None
+        slope = (3 * x1 * x1 + A) * pow(2 * y1, -1, P) % P
+    else:
+        slope = (y2 - y1) * pow(x2 - x1, -1, P) % P
+    x3 = (slope * slope - x1 - x2) % P
+    return x3, (slope * (x1 - x3) - y1) % P
+
+def multiply(scalar, point):
+    result = None
+    while scalar:
+        if scalar & 1:
+            result = _add(result, point)
+        point = _add(point, point)
+        scalar >>= 1
+    return result
+
+def public_key(private):
+    # uECC_make_key's public half for a private key: x || y, 40 bytes
+    x, y = multiply(int.from_bytes(key_bytes(private), 'big'), G)
+    return x.to_bytes(COORDINATE_BYTES, 'big') + y.to_bytes(COORDINATE_BYTES, 'big')
+
+def shared_secret(private, public):
+    # uECC_shared_secret: the x coordinate of private * public. The firmware
+    # prints its 42-byte public key buffer, so anything past 40 bytes is ignored.
+    public = key_bytes(public)[:2 * COORDINATE_BYTES]
+    point = (int.from_bytes(public[:COORDINATE_BYTES], 'big'), int.from_bytes(public[COORDINATE_BYTES:], 'big'))
+    if not on_curve(point):
+        raise ValueError("Public key is not a secp160r1 point")
+    x, _ = multiply(int.from_bytes(key_bytes(private), 'big'), point)
+    return x.to_bytes(COORDINATE_BYTES, 'big')
+
+def ecdh_key(private, public):
+    # handleKeyExchange: the AES key saved for the peer, as hex
+    return shared_secret(private, public)[:BLOCK].hex()
+
+# Batches
+
+def check(record):
+    # record: {'key': hex, 'content': IV + ciphertext hex, 'plaintext': optional}.
+    # With a plaintext, the firmware's output must be exactly what encrypt()
+    # gives for that IV; without one, the content must decrypt with intact padding.
+    key, content = record['key'], record['content']
+    _, truncated = firmware_key(key)
+    result = {'key_truncated': truncated}
+    plaintext = record.get('plaintext')
+    try:
+        if plaintext is not None and encrypt(plaintext, key, content[:2 * BLOCK]) == content.upper():
+            result.update(valid=True, decrypted=plaintext.strip())
+            return result
+        decrypted = decrypt(content, key, strict=True)
+    except ValueError as e:
+        result.update(valid=False, error=str(e))
+        return result
+    result.update(valid=plaintext is None and decrypted is not None, decrypted=decrypted)
+    return result
+
+def check_batch(records, processes=None, chunksize=256):
+    # check() over every record, in order. Large batches are spread over a
+    # process pool (spawned, like the plot renderer) so they keep up with
+    # capture rates; small ones are not worth starting it for.
+    records = list(records)
+    if processes == 1 or len(records) <= chunksize:
+        return [check(record) for record in records]
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        return pool.map(check, records, chunksize)
+
+def encrypted_content(msg):
+    # The content of an encryptedMessage as carried in a mesh message, or None
+    try:
+        document = json.loads(msg)
+    except ValueError:
+        return None
+    if isinstance(document, dict) and document.get('type') == 'encryptedMessage':
+        return document.get('content')
+    return None
+
+def message_records(messages, keys):
+    # Check records for captured (sender, recipient, msg) traffic. keys maps
+    # frozenset({a, b}) to the pair's key hex (ECDH keys are symmetric).
+    # Messages that are not encryptedMessage, or whose pair has no key, are skipped.
+    records = []
+    for sender, recipient, msg in messages:
+        content = encrypted_content(msg)
+        key = keys.get(frozenset((sender, recipient)))
+        if content is not None and key is not None:
+            records.append({'key': key, 'content': content, 'sender': sender, 'recipient': recipient})
+    return records
@@ -0,0 +1,198 @@
+import re
+
+# Event kinds, one per line format printed by Hieroglossa_1_2_simple.ino and Hieroglossa_0_2.ino
+BANNER = 'banner'
+STATUS = 'status'
+ERROR = 'error'
+NODE_ID = 'node_id'
+RECEIVED = 'received'
+RAW_RECEIVED = 'raw_received'
+MESSAGE_JSON = 'message_json'
+OUTBOUND = 'outbound'
+INBOUND = 'inbound'
+LATENCY_PROBE = 'latency_probe'
+LATENCY_REFLECTED = 'latency_reflected'
+LATENCY_REFLECTION = 'latency_reflection'
+LATENCY_SENT = 'latency_sent'
+LATENCY_TIMEOUT = 'latency_timeout'
+ROUND_TRIP = 'round_trip'
+DECRYPTED = 'decrypted'
+UNKNOWN_TYPE = 'unknown_type'
+UNTYPED_MESSAGE = 'untyped_message'
+THROUGHPUT_START = 'throughput_start'
+THROUGHPUT_SENT = 'throughput_sent'
+THROUGHPUT_PROGRESS = 'throughput_progress'
+THROUGHPUT_DONE = 'throughput_done'
+THROUGHPUT_FREQUENCY = 'throughput_frequency'
+THROUGHPUT_RECEIVED = 'throughput_received'
+NEW_CONNECTION = 'new_connection'
+CHANGED_CONNECTIONS = 'changed_connections'
+TOPOLOGY = 'topology'
+ENCRYPTION_TIME = 'encryption_time'
+DECRYPTION_TIME = 'decryption_time'
+PLAINTEXT_LENGTH = 'plaintext_length'
+CIPHERTEXT_LENGTH = 'ciphertext_length'
+IV = 'iv'
+CIPHERTEXT = 'ciphertext'
+DECRYPTION_RESULT = 'decryption_result'
+TEST_KEY = 'test_key'
+LOCAL_ENCRYPTED = 'local_encrypted'
+LOCAL_DECRYPTED = 'local_decrypted'
+PUBLIC_KEY = 'public_key'
+PRIVATE_KEY = 'private_key'
+SECURE_SENT = 'secure_sent'
+KEY_ACQUIRED = 'key_acquired'
+SECURE_CHANNEL = 'secure_channel'
+KEY_SAVED = 'key_saved'
+CREDENTIALS = 'credentials'
+QUEUED = 'queued'
+STACK_USAGE = 'stack_usage'
+OTHER = 'other'
+
+class FirmwareEvent:
+    __slots__ = ('kind', 'port', 'timestamp', 'node', 'number', 'value', 'payload')
+
+    def __init__(self, kind, port, timestamp, node=None, number=None, value=None, payload=None):
+        self.kind = kind
+        self.port = port
+        self.timestamp = timestamp
+        self.node = node
+        self.number = number
+        self.value = value
+        self.payload = payload
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__
+                           if getattr(self, name) is not None)
+        return f'FirmwareEvent({fields})'
+
+# (kind, pattern, fields) where fields names the slot each capture group fills.
+# Every pattern starts with a literal first word, which is what classify() dispatches on.
+RULES = [
+    (BANNER, r'Hieroglossa Development Project v\.?(\S+)', ('payload',)),
+    (STATUS, r'(Configuring (?:Mesh|FreeRTOS))', ('payload',)),
+    (STATUS, r'(Generating (?:ECDH keys|ECC Key\.))', ('payload',)),
+    (STATUS, r'(Generated ECC key pair:)', ('payload',)),
+    (STATUS, r'(Finished Setup\.)', ('payload',)),
+    (STATUS, r'(Starting (?:throughput test task|latency test|local encryption test|AES Test \**))', ('payload',)),
+    (STATUS, r'(Throughput test task created)', ('payload',)),
+    (STATUS, r'(Sending (?:plaintext|secure) message)', ('payload',)),
+    (STATUS, r'(Encryption/Decryption successful)', ('payload',)),
+    (STATUS, r'(ECDH (?:keys generated|Exchange Successful\.))', ('payload',)),
+    (STATUS, r'(Processing Message\.)', ('payload',)),
+    (STATUS, r'(Finishing ECDH Exchange\.)', ('payload',)),
+    (STATUS, r'(Initiate ECDH Exchange\.)', ('payload',)),
+    (STATUS, r'(Not a match\.)', ('payload',)),
+    (STATUS, r'(Message ignored\.)', ('payload',)),
+    (STATUS, r'(Node is a (?:friend|stranger)\.)', ('payload',)),
+    (NODE_ID, r'Node ID: (\d+)', ('node',)),
+    (KEY_ACQUIRED, r'Node ID (\d+): AES key acquired via ECDH: (\S*)', ('node', 'payload')),
+    (RECEIVED, r'Received from (\d+) msg=(.*)', ('node', 'payload')),
+    (RAW_RECEIVED, r'Received Raw: (.*)', ('payload',)),
+    (LATENCY_PROBE, r'Received latency test message', ()),
+    (LATENCY_REFLECTION, r'Received latency test reflection', ()),
+    (THROUGHPUT_RECEIVED, r'Received throughput test message (-?\d+): (.*)', ('number', 'payload')),
+    (UNTYPED_MESSAGE, r'Received message without type: (.*)', ('payload',)),
+    (LATENCY_REFLECTED, r'Reflecting latency test message', ()),
+    (OUTBOUND, r'OUTBOUND', ()),
+    (INBOUND, r'INBOUND', ()),
+    (DECRYPTED, r'Decrypted message(?: from (\d+))?: (.*)', ('node', 'payload')),
+    (LOCAL_DECRYPTED, r'Decrypted: (.*)', ('payload',)),
+    (LOCAL_ENCRYPTED, r'Encrypted: (.*)', ('payload',)),
+    (UNKNOWN_TYPE, r'Unknown message type: (.*)', ('payload',)),
+    (ERROR, r'(Unknown command\..*)', ('payload',)),
+    (ERROR, r'(Invalid command format\..*)', ('payload',)),
+    (ERROR, r'(Failed to parse (?:received|decrypted|key exchange) message)', ('payload',)),
+    (ERROR, r'(Failed to generate (?:ECDH keys|shared secret))', ('payload',)),
+    (ERROR, r'(Failed to send (?:latency test|secure) message to node (\d+))', ('payload', 'node')),
+    (ERROR, r'(No shared key found for node (\d+))', ('payload', 'node')),
+    (ERROR, r'(Error: No key found for node (\d+))', ('payload', 'node')),
+    (ERROR, r'(Error: .*)', ('payload',)),
+    (ERROR, r'(Encryption failed\.)', ('payload',)),
+    (NEW_CONNECTION, r'New connection, nodeId = (\d+)', ('node',)),
+    (NEW_CONNECTION, r'Connected with node: (\d+)', ('node',)),
+    (CHANGED_CONNECTIONS, r'(Changed connections)', ('payload',)),
+    (CHANGED_CONNECTIONS, r'(Connection Changed\.)', ('payload',)),
+    (CHANGED_CONNECTIONS, r'(Current mesh topology:)', ('payload',)),
+    (THROUGHPUT_START, r"Starting throughput test: recipient=(-?\d+), payload='(.*)', freq=(-?\d+) Hz, iterations=(-?\d+)",
+     ('node', 'payload', 'value', 'number')),
+    (THROUGHPUT_SENT, r'Sent message (-?\d+) at (\d+) ms: (.*)', ('number', 'value', 'payload')),
+    (THROUGHPUT_PROGRESS, r'Completed (-?\d+) iterations at (\d+) ms', ('number', 'value')),
+    (THROUGHPUT_DONE, r'Throughput test completed in (\d+) ms', ('value',)),
+    (THROUGHPUT_FREQUENCY, r'Actual frequency: (\S+) Hz', ('value',)),
+    (LATENCY_SENT, r'Latency test message sent to node (\d+)', ('node',)),
+    (LATENCY_TIMEOUT, r'Latency test timed out', ()),
+    (ROUND_TRIP, r'Round-trip latency /us: (\d+)', ('value',)),
+    (TEST_KEY, r'Test Key: ([0-9A-Fa-f]*)', ('payload',)),
+    (IV, r'Initialization Vector shuffled: ([0-9A-Fa-f]*)', ('payload',)),
+    (IV, r'IV: ([0-9A-Fa-f]*)', ('payload',)),
+    (CIPHERTEXT, r'Cipher: ([0-9A-Fa-f]*)', ('payload',)),
+    (PLAINTEXT_LENGTH, r'Plaintext Length: (\d+)', ('value',)),
+    (CIPHERTEXT_LENGTH, r'Ciphertext Length: (\d+)', ('value',)),
+    (ENCRYPTION_TIME, r'Encryption time /us: (\d+)', ('value',)),
+    (DECRYPTION_TIME, r'Decryption time /us: (\d+)', ('value',)),
+    (DECRYPTION_RESULT, r'Decryption result: (.*)', ('payload',)),
+    (PUBLIC_KEY, r'Public Key: ([0-9A-Fa-f]*)', ('payload',)),
+    (PRIVATE_KEY, r'Private Key: ([0-9A-Fa-f]*)', ('payload',)),
+    (PUBLIC_KEY, r'ECC Public: ([0-9A-Fa-f]*)', ('payload',)),
+    (PRIVATE_KEY, r'ECC Private: ([0-9A-Fa-f]*)', ('payload',)),
+    (SECURE_SENT, r'Secure message sent to node (\d+)', ('node',)),
+    (SECURE_CHANNEL, r'Secure channel established with Node (\d+)', ('node',)),
+    (KEY_SAVED, r'Key (\S*) saved to keyring for Node (\d+)', ('payload', 'node')),
+    (CREDENTIALS, r'Saved Credentials: (.*)', ('payload',)),
+    (QUEUED, r'Message Queued\. Total Messages: (\d+)', ('value',)),
+    (STACK_USAGE, r'Task stack usage: (\d+) bytes remaining\.', ('value',)),
+]
+
+def _first_word(pattern):
+    word = re.match(r'[\w\-/.]+:?', pattern.lstrip('(')).group()
+    return word.replace('\\', '')
+
+def _compile_rules(rules):
+    table = {}
+    for kind, pattern, fields in rules:
+        table.setdefault(_first_word(pattern), []).append((kind, re.compile(pattern + r'\Z'), fields))
+    return {word: tuple(entries) for word, entries in table.items()}
+
+DISPATCH = _compile_rules(RULES)
+
+TOPOLOGY_RE = re.compile(r'\{"nodeId":(\d+)')
+HEX_RE = re.compile(r'(?:[0-9A-F]{2})+\Z')
+# The firmware prints send progress markers without a newline (">" and "]" in v1.2,
+# "Pinging" and ")" in v0.2), so they end up glued to the front of the next line.
+NOISE_RE = re.compile(r'(?:Pinging|[>\])])+')
+
+def _convert(name, text):
+    if text is None or name == 'payload':
+        return text
+    if name == 'node':
+        # %d of a uint32 node id prints negative past 2^31
+        return int(text) & 0xFFFFFFFF
+    if name == 'value' and not text.lstrip('-').isdigit():
+        return float(text)  # "Actual frequency: %.2f Hz"
+    return int(text)
+
+def classify(port, timestamp, line):
+    noise = NOISE_RE.match(line)
+    if noise:
+        line = line[noise.end():]
+
+    if line.startswith('{'):
+        topology = TOPOLOGY_RE.match(line)
+        if topology:
+            return FirmwareEvent(TOPOLOGY, port, timestamp, node=int(topology.group(1)), payload=line)
+        return FirmwareEvent(MESSAGE_JSON, port, timestamp, payload=line)
+
+    space = line.find(' ')
+    word = line if space < 0 else line[:space]
+    for kind, regex, fields in DISPATCH.get(word, ()):
+        match = regex.match(line)
+        if match:
+            event = FirmwareEvent(kind, port, timestamp)
+            for name, text in zip(fields, match.groups()):
+                setattr(event, name, _convert(name, text))
+            return event
+
+    if HEX_RE.match(line):
+        return FirmwareEvent(CIPHERTEXT, port, timestamp, payload=line)
+    return FirmwareEvent(OTHER, port, timestamp, payload=line)
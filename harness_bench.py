@@ -0,0 +1,371 @@
+import json
+import multiprocessing
+import os
+import platform
+import pty
+import re
+import resource
+import sys
+import threading
+import time
+import tty
+import serial
+import numpy as np
+from datetime import datetime
+from event_router import EventRouter
+from firmware_events import RECEIVED, MESSAGE_JSON
+from serial_reader import read_from_port, current_milli_time
+from stats import summarize
+
+# Measures how fast the host side can take in firmware output: synthetic lines
+# are fed through a pty at rising rates into the same read_from_port ->
+# EventRouter -> classify -> callback path the test scripts use. Unix only
+# (pty). Each feeder runs in its own process so its cost is not charged to
+# the harness.
+#
+# Regressions are judged on throughput and CPU per line divided by a
+# calibration loop run in the same process, so runners of different speed (or
+# one runner on a busy day) compare fairly. Core count, OS, interpreter and
+# the benchmark settings still change the ratios, so a baseline taken with
+# different ones is refused rather than compared. In CI the baseline is
+# measured from the merge base on the same runner, in the same job
+# (.github/workflows/harness-bench.yml); harness_bench_baseline.json is the
+# fallback and the reference for local runs.
+
+NODE_ID = 480652657
+LINES_PER_MESSAGE = 3  # "Received from ... msg=", "INBOUND", raw JSON, as receivedCallback prints them
+
+def feeder(connection, payload_length):
+    # Child process: owns the pty master and writes receiver-side output for
+    # each (rate, duration) it is sent, replying with the number of lines written
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    connection.send(os.ttyname(slave))
+    padding = 'x' * payload_length
+    number = 0
+    while True:
+        step = connection.recv()
+        if step is None:
+            break
+        rate, duration = step
+        messages_per_second = rate / LINES_PER_MESSAGE
+        start = time.perf_counter()
+        end = start + duration
+        sent = 0
+        while True:
+            now = time.perf_counter()
+            if now >= end:
+                break
+            due = int((now - start) * messages_per_second) - sent
+            if due <= 0:
+                time.sleep(0.0005)
+                continue
+            # One stamp per batch; a blocking write is the backpressure a slow reader exerts
+            stamp = time.perf_counter_ns()
+            chunk = []
+            for _ in range(min(due, 1000)):
+                number += 1
+                message = f'{{"message_number":{number},"sent":{stamp},"payload":"{padding}"}}'
+                chunk.append(f"Received from {NODE_ID} msg={message}\r\nINBOUND\r\n{message}\r\n")
+            os.write(master, ''.join(chunk).encode())
+            sent += len(chunk)
+        connection.send(sent * LINES_PER_MESSAGE)
+    os.close(master)
+    os.close(slave)
+
+class PortProbe:
+    # The "test logic" stage for one port: parses each message like the
+    # scripts do and records how long after the write it got here
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lines = 0
+        self.messages = 0
+        self.latencies = []
+
+    def on_line(self, event):
+        self.lines += 1
+
+    def on_message(self, record):
+        # Both the "Received from X msg=" line and the raw JSON line carry the message
+        try:
+            document = json.loads(record.payload)
+        except ValueError:
+            return
+        self.messages += 1
+        self.latencies.append(time.perf_counter_ns() - document['sent'])
+
+def thread_cpu_time(thread):
+    # CPU seconds of one reader thread, which also runs routing, classify and callbacks
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    except (AttributeError, OSError):
+        return None
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # ru_maxrss is a peak, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def run_step(ports, rate, duration, drain_timeout):
+    for port in ports:
+        port['probe'].reset()
+    cpu_before = [thread_cpu_time(port['thread']) for port in ports]
+    process_before = time.process_time()
+    start = time.perf_counter()
+    for port in ports:
+        port['connection'].send((rate, duration))
+    written = [port['connection'].recv() for port in ports]
+    # Whatever is still in flight when the feeders stop gets drain_timeout to arrive
+    deadline = time.perf_counter() + drain_timeout
+    while time.perf_counter() < deadline and any(port['probe'].lines < count for port, count in zip(ports, written)):
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    process_cpu = time.process_time() - process_before
+
+    received = sum(port['probe'].lines for port in ports)
+    latencies = [latency / 1_000_000 for port in ports for latency in port['probe'].latencies]
+    cpu = []
+    for port, before in zip(ports, cpu_before):
+        after = thread_cpu_time(port['thread'])
+        cpu.append(after - before if before is not None and after is not None else process_cpu / len(ports))
+    return {
+        'rate': rate,
+        'offered': rate * duration * len(ports),
+        'written': sum(written),
+        'received': received,
+        'lines_per_second': received / elapsed,
+        'latency': summarize(latencies),
+        'cpu_per_port': [seconds / elapsed * 100 for seconds in cpu],
+        'cpu_us_per_line': sum(cpu) / received * 1_000_000 if received else None,
+        'rss': rss_bytes(),
+    }
+
+def sustained(result, latency_limit):
+    # The feeders could write at the offered rate, every line made it through,
+    # and the queueing delay did not run away
+    return (result['written'] >= 0.95 * result['offered']
+            and result['received'] >= result['written']
+            and result['latency'] is not None
+            and result['latency']['p99'] <= latency_limit)
+
+def calibrate(repeats=5, lines=5000, payload_length=50):
+    # Machine speed in a unit that does not depend on this repo's code: lines
+    # per CPU second through a stdlib-only loop shaped like ingest (regex,
+    # JSON decode), one rate per repeat. Shared runners run in bursts of fast
+    # and slow seconds, so benchmark() takes a few of these between every step
+    # and averages them over the whole run.
+    message = '{"message_number":1,"sent":1,"payload":"%s"}' % ('x' * payload_length)
+    batch = [f"Received from {NODE_ID} msg={message}"] * 1000
+    pattern = re.compile(r'Received from (\d+) msg=(.*)')
+    rates = []
+    for _ in range(repeats):
+        start = time.process_time()
+        for _ in range(lines // len(batch)):
+            for line in batch:
+                match = pattern.match(line.strip())
+                if match:
+                    json.loads(match.group(2))
+        rates.append(lines // len(batch) * len(batch) / (time.process_time() - start))
+    return rates
+
+def host_fingerprint():
+    # What the normalized numbers still depend on; the hostname is kept for
+    # reference only, since CI runners get a new one every job
+    return {
+        'system': platform.system(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'python': f"{platform.python_implementation()} {'.'.join(platform.python_version_tuple()[:2])}",
+    }
+
+def benchmark(port_count=1, start_rate=1000, max_rate=1_000_000, growth=1.5, duration=3.0,
+              drain_timeout=1.0, latency_limit=50.0, payload_length=50, echo=False, resolution=1.05):
+    context = multiprocessing.get_context('spawn')
+    router = EventRouter()
+    stop_event = threading.Event()
+    ports = []
+    for _ in range(port_count):
+        parent, child = context.Pipe()
+        process = context.Process(target=feeder, args=(child, payload_length), daemon=True)
+        process.start()
+        path = parent.recv()
+        ser = serial.Serial(path, 115200, timeout=1)
+        probe = PortProbe()
+        router.subscribe(path, callback=probe.on_line)
+        router.subscribe(path, kinds=(RECEIVED, MESSAGE_JSON), callback=probe.on_message)
+        thread = threading.Thread(target=read_from_port, args=(ser, router, stop_event, None, echo), daemon=True)
+        thread.start()
+        ports.append({'path': path, 'process': process, 'connection': parent, 'serial': ser,
+                      'probe': probe, 'thread': thread})
+
+    calibration = calibrate(payload_length=payload_length)
+
+    def step(rate):
+        result = run_step(ports, rate, duration, drain_timeout)
+        calibration.extend(calibrate(payload_length=payload_length))
+        result['sustained'] = sustained(result, latency_limit)
+        results.append(result)
+        latency = result['latency']
+        print(f"[{current_milli_time()}] {rate:>9.0f} lines/s/port: got {result['lines_per_second']:>9.0f} lines/s, "
+              f"{result['received']}/{result['written']} lines, "
+              + (f"latency p50 {latency['p50']:.2f} / p99 {latency['p99']:.2f} ms, " if latency else "no latency, ")
+              + f"CPU {', '.join(f'{cpu:.0f}%' for cpu in result['cpu_per_port'])}, "
+              + f"RSS {result['rss'] / 1e6:.1f} MB" + ("" if result['sustained'] else "  <- not sustained"))
+        return result['sustained']
+
+    results = []
+    rss_start = rss_bytes()
+    try:
+        # Ramp by `growth` until a rate fails, then bisect (geometrically) between
+        # the last rate that held and the first that did not, so the ceiling is
+        # known to within `resolution` rather than to a whole growth step
+        rate, passed_rate, failed_rate = start_rate, None, None
+        while rate <= max_rate:
+            if not step(rate):
+                failed_rate = rate
+                break
+            passed_rate = rate
+            rate *= growth
+        while passed_rate is not None and failed_rate is not None and failed_rate / passed_rate > resolution:
+            rate = (passed_rate * failed_rate) ** 0.5
+            if step(rate):
+                passed_rate = rate
+            else:
+                failed_rate = rate
+    finally:
+        # Readers first, so they are not left reading a pty whose master has gone
+        stop_event.set()
+        for port in ports:
+            port['thread'].join(timeout=2)
+            port['serial'].close()
+        for port in ports:
+            port['connection'].send(None)
+            port['process'].join(timeout=2)
+
+    passed = [result for result in results if result['sustained']]
+    reference = results[0] if results else None
+    return {
+        'ports': port_count,
+        'settings': {'payload_length': payload_length, 'latency_limit': latency_limit, 'duration': duration,
+                     'start_rate': start_rate, 'echo': bool(echo)},
+        'max_sustained_lines_per_second': max((result['lines_per_second'] for result in passed), default=0.0),
+        'reference_rate': reference['rate'] if reference else None,
+        'reference_p50_ms': reference['latency']['p50'] if reference and reference['latency'] else None,
+        'reference_p99_ms': reference['latency']['p99'] if reference and reference['latency'] else None,
+        'reference_cpu_us_per_line': reference['cpu_us_per_line'] if reference else None,
+        'memory_growth_mb': (max((result['rss'] for result in results), default=rss_start) - rss_start) / 1e6,
+        'calibration_lines_per_second': float(np.mean(calibration)),
+        'steps': results,
+    }
+
+# (metric, True if higher is better). Both are divided by the calibration rate;
+# latency at the reference rate is reported but not gated, as at a few thousand
+# lines/s it is mostly scheduler wake-up jitter.
+REGRESSION_METRICS = [
+    ('normalized_max_sustained', True),
+    ('normalized_cpu_per_line', False),
+]
+
+def normalize(summary):
+    # Max sustained as a fraction of the calibration rate, CPU per line in calibration-loop lines
+    calibration = summary['calibration_lines_per_second']
+    summary['normalized_max_sustained'] = summary['max_sustained_lines_per_second'] / calibration
+    cpu = summary['reference_cpu_us_per_line']
+    summary['normalized_cpu_per_line'] = cpu * calibration / 1_000_000 if cpu is not None else None
+    summary['host'] = host_fingerprint()
+    summary['hostname'] = platform.node()
+    return summary
+
+def incomparable(summary, baseline):
+    # Reasons the ratios cannot be compared at all
+    reasons = []
+    for key in ('ports', 'settings', 'host'):
+        if baseline.get(key) != summary.get(key):
+            reasons.append(f"{key}: baseline {baseline.get(key)}, this run {summary.get(key)}")
+    return reasons
+
+def check_regressions(summary, baseline, tolerance):
+    failures = []
+    for metric, higher_is_better in REGRESSION_METRICS:
+        current, expected = summary.get(metric), baseline.get(metric)
+        if current is None or expected is None:
+            continue
+        if higher_is_better and current < expected * (1 - tolerance):
+            failures.append(f"{metric}: {current:.4f} < baseline {expected:.4f}")
+        if not higher_is_better and current > expected * (1 + tolerance):
+            failures.append(f"{metric}: {current:.4f} > baseline {expected:.4f}")
+    memory_limit = baseline.get('memory_growth_mb')
+    if memory_limit is not None and summary['memory_growth_mb'] > max(memory_limit * (1 + tolerance), memory_limit + 10):
+        failures.append(f"memory_growth_mb: {summary['memory_growth_mb']:.1f} > baseline {memory_limit:.1f}")
+    return failures
+
+def main():
+    port_count = 2
+    start_rate = 1000  # Lines per second per port
+    max_rate = 1_000_000
+    growth = 1.5  # Rate multiplier between steps
+    resolution = 1.05  # The ceiling is then bisected to within this ratio
+    duration = 3.0  # Seconds per step
+    latency_limit = 50.0  # p99 ms from write to callback above which a rate counts as not sustained
+    payload_length = 50
+    echo = False  # True includes the cost of printing every line
+    # The committed baseline sits next to this script; CI points HARNESS_BENCH_BASELINE at one it
+    # measured from the merge base on the same runner
+    baseline_file = (os.environ.get('HARNESS_BENCH_BASELINE')
+                     or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'harness_bench_baseline.json'))
+    tolerance = 0.25  # Allowed fractional regression against the baseline
+    update_baseline = os.environ.get('HARNESS_BENCH_UPDATE') == '1'  # Writes baseline_file from this run instead of checking
+
+    summary = normalize(benchmark(port_count, start_rate, max_rate, growth, duration, latency_limit=latency_limit,
+                                  payload_length=payload_length, echo=echo, resolution=resolution))
+
+    print(f"\nHarness ingest benchmark ({port_count} ports):")
+    print(f"  Max sustained: {summary['max_sustained_lines_per_second']:.0f} lines/s")
+    if summary['reference_p50_ms'] is not None:
+        print(f"  Added latency at {summary['reference_rate']:.0f} lines/s/port: "
+              f"p50 {summary['reference_p50_ms']:.3f} ms, p99 {summary['reference_p99_ms']:.3f} ms")
+    if summary['reference_cpu_us_per_line'] is not None:
+        print(f"  CPU per line: {summary['reference_cpu_us_per_line']:.1f} us")
+    print(f"  Memory growth: {summary['memory_growth_mb']:.1f} MB")
+    print(f"  Calibration: {summary['calibration_lines_per_second']:.0f} lines/s; normalized max sustained {summary['normalized_max_sustained']:.4f}"
+          + (f", CPU per line {summary['normalized_cpu_per_line']:.4f}" if summary['normalized_cpu_per_line'] is not None else ""))
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    with open(f"{timestamp}_harness_bench.json", 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    if update_baseline:
+        with open(baseline_file, 'w') as f:
+            json.dump({key: value for key, value in summary.items() if key != 'steps'}, f, indent=2)
+            f.write('\n')
+        print(f"Baseline saved to {baseline_file}")
+        return
+    if not os.path.exists(baseline_file):
+        # Without a baseline nothing can regress; fail rather than pass unchecked
+        print(f"No baseline at {baseline_file}; run with HARNESS_BENCH_UPDATE=1 on the CI machine and commit it")
+        sys.exit(1)
+
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    reasons = incomparable(summary, baseline)
+    if reasons:
+        print(f"Baseline {baseline_file} was measured under different conditions; not comparing:")
+        for reason in reasons:
+            print(f"  {reason}")
+        sys.exit(1)
+    failures = check_regressions(summary, baseline, tolerance)
+    if failures:
+        print("Regressions against baseline:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
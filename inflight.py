@@ -0,0 +1,105 @@
+import time
+
+MATCHED = 'matched'
+LATE = 'late'
+DUPLICATE = 'duplicate'
+UNEXPECTED = 'unexpected'
+
+class InFlightTracker:
+    # Tracks outstanding messages by key (payload or sequence number) with a
+    # deadline each. Deadlines live on a hashed timer wheel: a slot holds every
+    # entry whose deadline tick maps to it, so adding, matching and expiring are
+    # all O(1) per message no matter how many are in flight.
+
+    def __init__(self, timeout, tick=0.01, slots=1024, history=65536):
+        self.timeout_ns = int(timeout * 1_000_000_000)
+        self.tick_ns = int(tick * 1_000_000_000)
+        self.slots = [dict() for _ in range(slots)]
+        self.pending = {}     # key -> (sent_ns, deadline_tick)
+        self.expired = {}     # recently lost keys, to recognise late arrivals
+        self.completed = {}   # recently matched keys, to recognise duplicates
+        self.history = history
+        self.current_tick = None
+
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.late = 0
+        self.duplicates = 0
+        self.unexpected = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, key, now_ns=None):
+        if now_ns is None:
+            now_ns = time.perf_counter_ns()
+        if self.current_tick is None:
+            self.current_tick = now_ns // self.tick_ns
+        if key in self.pending:
+            self._unschedule(key)
+        deadline_tick = (now_ns + self.timeout_ns) // self.tick_ns
+        self.pending[key] = (now_ns, deadline_tick)
+        self.slots[deadline_tick % len(self.slots)][key] = deadline_tick
+        self.sent += 1
+
+    def match(self, key, now_ns=None):
+        # Returns (status, latency_ns); latency is None unless the key was in flight or late
+        if now_ns is None:
+            now_ns = time.perf_counter_ns()
+        entry = self.pending.pop(key, None)
+        if entry is not None:
+            sent_ns, deadline_tick = entry
+            del self.slots[deadline_tick % len(self.slots)][key]
+            self.received += 1
+            self._remember(self.completed, key, sent_ns)
+            return MATCHED, now_ns - sent_ns
+
+        if key in self.expired:
+            sent_ns = self.expired.pop(key)
+            self.late += 1
+            self._remember(self.completed, key, sent_ns)
+            return LATE, now_ns - sent_ns
+        if key in self.completed:
+            self.duplicates += 1
+            return DUPLICATE, None
+        self.unexpected += 1
+        return UNEXPECTED, None
+
+    def expire(self, now_ns=None):
+        # Advances the wheel to now and returns the keys whose deadline passed
+        if now_ns is None:
+            now_ns = time.perf_counter_ns()
+        if self.current_tick is None:
+            return []
+        now_tick = now_ns // self.tick_ns
+        lost = []
+        # Walking more than one full turn would only revisit the same slots
+        first_tick = max(self.current_tick, now_tick - len(self.slots) + 1)
+        for tick in range(first_tick, now_tick + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            due = [key for key, deadline_tick in slot.items() if deadline_tick <= now_tick]
+            for key in due:
+                del slot[key]
+                sent_ns, _ = self.pending.pop(key)
+                self._remember(self.expired, key, sent_ns)
+                lost.append(key)
+        self.current_tick = now_tick
+        self.lost += len(lost)
+        return lost
+
+    def _unschedule(self, key):
+        _, deadline_tick = self.pending.pop(key)
+        del self.slots[deadline_tick % len(self.slots)][key]
+        self.sent -= 1
+
+    def _remember(self, table, key, sent_ns):
+        table[key] = sent_ns
+        if len(table) > self.history:
+            del table[next(iter(table))]
+
+    def loss_rate(self):
+        # Late arrivals were already counted as lost when their deadline passed
+        return self.lost / self.sent * 100 if self.sent else 0.0
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import numpy as np
+import plotting
+from datetime import datetime
+from firmware_events import TOPOLOGY
+from latency_sweep import probe
+from log_sink import LogSink, LINES
+from mesh_tap import TopologyGraph
+from serial_engine import SerialEngine
+from serial_reader import current_milli_time
+from stats import format_stats, summarize
+
+# Latency as a function of mesh depth. changedConnectionCallback prints
+# subConnectionJson() on every change; those lines are folded into one
+# TopologyGraph as they stream in, and every round probes, from each board on
+# a serial port, receivers at each hop distance it can reach. A receiver needs
+# no serial port: receivedCallback reflects latency tests by itself.
+
+def watch_topology(engine, nodes, graph):
+    # Each printed tree is the reporting board's whole view of the mesh, so the latest one replaces the rest
+    def on_topology(event):
+        try:
+            graph.update(event.payload, source=event.node, complete=True)
+        except ValueError:
+            print(f"[{current_milli_time()}][{event.port}] Unreadable topology: {event.payload}")
+
+    return engine.router.subscribe([node['port'] for node in nodes], kinds=(TOPOLOGY,), callback=on_topology)
+
+def plan_pairs(graph, nodes, max_hops=None, receivers_per_hop=1):
+    # {hops: [(sender, receiver)]}: every attached board sends, to up to
+    # receivers_per_hop nodes at each distance it can reach, preferring
+    # receivers no other sender already has at that distance
+    by_id = {node['node_id']: node for node in nodes}
+    planned = set()
+    plan = {}
+    for sender in nodes:
+        by_distance = {}
+        for receiver_id, hops in graph.distances(sender['node_id']).items():
+            if hops and (max_hops is None or hops <= max_hops):
+                by_distance.setdefault(hops, []).append(receiver_id)
+        for hops, receivers in sorted(by_distance.items()):
+            receivers.sort(key=lambda receiver_id: ((hops, receiver_id) in planned, receiver_id))
+            for receiver_id in receivers[:receivers_per_hop]:
+                planned.add((hops, receiver_id))
+                plan.setdefault(hops, []).append((sender, by_id.get(receiver_id, {'node_id': receiver_id})))
+    return plan
+
+async def probe_from(engine, graph, probes, payload_length, timeout, samples, probe_gap):
+    for sender, receiver in probes:
+        # Tagged with the topology as it stood when the probe went out
+        version = graph.version
+        hops = graph.hops(sender['node_id'], receiver['node_id'])
+        latency = await probe(engine, sender, receiver, payload_length, timeout)
+        samples.append({
+            'sender': sender['node_id'],
+            'receiver': receiver['node_id'],
+            'hops': hops,
+            'topology_version': version,
+            'topology_changed': graph.version != version,  # The mesh changed while this probe was out
+            'latency': latency,
+            'timestamp': current_milli_time(),
+        })
+        if probe_gap:
+            await asyncio.sleep(probe_gap)
+
+async def measure(nodes, rounds, payload_length, max_hops=None, receivers_per_hop=1, timeout=10,
+                  topology_wait=30, probe_gap=0.05, echo=True):
+    topology_seen = asyncio.Event()
+    graph = TopologyGraph(on_change=lambda graph: topology_seen.set())
+    samples = []
+    async with SerialEngine(nodes, echo=echo) as engine:
+        watch_topology(engine, nodes, graph)
+        print(f"[{current_milli_time()}] Waiting up to {topology_wait} s for a topology report")
+        try:
+            await asyncio.wait_for(topology_seen.wait(), topology_wait)
+        except asyncio.TimeoutError:
+            print("No topology printed; reset a board or change a connection to make it report one")
+            return samples, graph
+
+        plan, planned_version = {}, None
+        for round_number in range(rounds):
+            if graph.version != planned_version:
+                plan = plan_pairs(graph, nodes, max_hops, receivers_per_hop)
+                planned_version = graph.version
+                print(f"[{current_milli_time()}] Topology v{graph.version}, {len(graph.nodes())} nodes: "
+                      + (', '.join(f"{hops} hop(s) x {len(pairs)}" for hops, pairs in sorted(plan.items()))
+                         or "no reachable receivers"))
+            # Each sender works through its own probes; different senders probe at once
+            by_sender = {}
+            for hops, pairs in sorted(plan.items()):
+                for sender, receiver in pairs:
+                    by_sender.setdefault(sender['port'], []).append((sender, receiver))
+            await asyncio.gather(*(probe_from(engine, graph, probes, payload_length, timeout, samples, probe_gap)
+                                   for probes in by_sender.values()))
+            print(f"[{current_milli_time()}] Round {round_number + 1}/{rounds} done, {len(samples)} probes")
+    return samples, graph
+
+def summarize_hops(samples):
+    by_hops = {}
+    for sample in samples:
+        by_hops.setdefault(sample['hops'], []).append(sample)
+    report = {}
+    for hops in sorted(hops for hops in by_hops if hops is not None):
+        group = by_hops[hops]
+        latencies = [sample['latency'] for sample in group if sample['latency'] is not None]
+        lost = len(group) - len(latencies)
+        report[hops] = {
+            'probes': len(group),
+            'lost': lost,
+            'loss_rate': lost / len(group) * 100,
+            'pairs': len({(sample['sender'], sample['receiver']) for sample in group}),
+            'topology_versions': sorted({sample['topology_version'] for sample in group}),
+            'latency': summarize(latencies),
+        }
+        print(f"{hops} hop(s): {len(group)} probes over {report[hops]['pairs']} pair(s), "
+              f"loss {report[hops]['loss_rate']:.1f}%")
+        if report[hops]['latency']:
+            print(f"  {format_stats(report[hops]['latency'])}")
+    if None in by_hops:
+        print(f"{len(by_hops[None])} probes went to nodes that were unreachable at the time")
+
+    measured = [(hops, result['latency']['p50']) for hops, result in report.items() if result['latency']]
+    if len(measured) >= 2:
+        slope, intercept = np.polyfit(*zip(*measured), 1)
+        print(f"Median one-way latency: {intercept:.2f} ms + {slope:.2f} ms per hop")
+    return report
+
+def main():
+    nodes = [
+        {'port': 'COM13', 'node_id': 480652657},
+        {'port': 'COM5', 'node_id': 2385360021},
+    ]
+    rounds = 20
+    payload_length = 50
+    max_hops = None  # None probes every distance the mesh has
+    receivers_per_hop = 2  # Per sender and distance
+    timeout = 10
+    topology_wait = 30  # Seconds to wait for the first topology report
+    probe_gap = 0.05
+    verbosity = LINES  # SUMMARY prints only results, COMMANDS adds the commands sent; the log file gets everything
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    log = LogSink(f"{timestamp}_serial", verbosity).start()
+    try:
+        samples, graph = asyncio.run(measure(nodes, rounds, payload_length, max_hops, receivers_per_hop,
+                                             timeout, topology_wait, probe_gap, echo=log))
+    except KeyboardInterrupt:
+        print("\nMeasurement interrupted")
+        return
+    finally:
+        log.stop()
+
+    if not samples:
+        print("No results.")
+        return
+    report = summarize_hops(samples)
+    with open(f"{timestamp}_latency_by_hops.json", 'w') as f:
+        json.dump({'samples': samples, 'report': report,
+                   'topology': sorted(graph.edge_counts), 'topology_version': graph.version}, f, indent=2)
+    if report:
+        hops = sorted(report)
+        plotting.submit(plotting.latency_by_hops, f"{timestamp}_latency_by_hops.png", hops,
+                        [[sample['latency'] for sample in samples if sample['hops'] == h and sample['latency'] is not None]
+                         for h in hops],
+                        [report[h]['loss_rate'] for h in hops])
+
+if __name__ == "__main__":
+    main()
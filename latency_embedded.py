@@ -2,47 +2,32 @@ import serial
 import time
 import random
 import string
-import matplotlib.pyplot as plt
 import threading
-import queue
-from datetime import datetime, timedelta
-import numpy as np
-from statistics import mean
-
-def current_milli_time():
-    return datetime.now().strftime('%H:%M:%S.%f')[:-3]
-
-def read_from_port(ser, message_queue, stop_event):
-    while not stop_event.is_set():
-        if ser.in_waiting:
-            response = ser.readline().decode().strip()
-            timestamp = current_milli_time()
-            print(f"[{timestamp}][{ser.port} IN] {response}")
-            message_queue.put((ser.port, timestamp, response))
-
-def send_and_receive(ser, node_id, length, message_queue, timeout=10):
+from datetime import datetime
+from serial_reader import current_milli_time, read_from_port
+from event_router import Deadline, EventRouter
+from firmware_events import ROUND_TRIP
+import plotting
+from stats import format_stat_lines, summarize, summarize_groups
+
+def send_and_receive(ser, node_id, length, router, timeout=10):
     command = f"hirg -r {node_id} -l {length}\n"
     timestamp = current_milli_time()
     print(f"[{timestamp}][{ser.port} OUT] {command.strip()}")
+    subscription = router.subscribe(ser.port, kinds=ROUND_TRIP)
     ser.write(command.encode())
 
     response_found = False
     events = []
 
-    start_time = datetime.now()
-    while (datetime.now() - start_time) < timedelta(seconds=timeout):
-        try:
-            port, timestamp, message = message_queue.get(timeout=0.1)
-            events.append((port, timestamp, message))
-
-            if "Round-trip latency /us:" in message:
-                latency_str = message.split("Round-trip latency /us:")[1].strip()
-                latency = int(latency_str.split()[0]) / 2000  # Convert to one-way latency in ms
-                response_found = True
-                break
+    for event in subscription.until(Deadline(timeout)):
+        events.append(event)
 
-        except queue.Empty:
-            continue
+        if event.kind == ROUND_TRIP:
+            latency = event.value / 2000  # Convert to one-way latency in ms
+            response_found = True
+            break
+    subscription.close()
 
     if response_found:
         return {
@@ -54,93 +39,32 @@ def send_and_receive(ser, node_id, length, message_queue, timeout=10):
     return None, False
 
 import time
-def run_tests(ser, node_id, message_queue, payload_length, num_iterations, timeout=10):
+def run_tests(ser, node_id, router, payload_length, num_iterations, timeout=10):
     results = []
     for _ in range(num_iterations):
-        result, success = send_and_receive(ser, node_id, payload_length, message_queue, timeout)
+        result, success = send_and_receive(ser, node_id, payload_length, router, timeout)
         if success:
             results.append(result)
         time.sleep(0.5)  # Add delay between tests
     return results
 
-import numpy as np
-import matplotlib.pyplot as plt
-from statistics import mean, median
-
 def plot_results(all_results, avg_results):
-    plt.figure(figsize=(20, 10))
-
     lengths = sorted(all_results.keys())
-    bar_width = 0.8
-    colors = ['b', 'g', 'r', 'c', 'm']
-    labels = ['Individual Tests', 'Min', 'Median', 'Avg', 'Max']
-
-    total_bars = sum(len(all_results[length]) for length in lengths)
-    bar_positions = np.arange(total_bars)
-
-    length_mapping = []
-    for length in lengths:
-        length_mapping.extend([length] * len(all_results[length]))
+    stats = summarize_groups(all_results, lambda result: result['total_latency'])
+    latencies = [[result['total_latency'] for result in all_results[length]] for length in lengths]
 
-    # Plot individual test results as bars
-    heights = [result['total_latency'] for length in lengths for result in all_results[length]]
-    plt.bar(bar_positions, heights, bar_width, color=colors[0], alpha=0.6, label=labels[0])
-
-    # Calculate and plot min, median, avg, and max lines
-    avg_positions = []
-    for length in lengths:
-        start = len(avg_positions)
-        avg_positions.extend(np.arange(start, start + len(all_results[length])))
-
-    for i, stat in enumerate(['min', 'median', 'avg', 'max']):
-        if stat == 'min':
-            values = [min(result['total_latency'] for result in all_results[length]) for length in lengths for _ in all_results[length]]
-        elif stat == 'median':
-            values = [median(result['total_latency'] for result in all_results[length]) for length in lengths for _ in all_results[length]]
-        elif stat == 'avg':
-            values = [avg_results[length]['total_latency'] for length in lengths for _ in all_results[length]]
-        else:  # max
-            values = [max(result['total_latency'] for result in all_results[length]) for length in lengths for _ in all_results[length]]
-        
-        plt.plot(avg_positions, values, color=colors[i+1], linewidth=2, label=f'{labels[i+1]} Latency')
-
-    plt.xlabel('Payload Length (bytes)')
-    plt.ylabel('Time (ms)')
-    plt.title('One-way Latency, Incremental Payload Length')
-    plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
-    plt.grid(True)
-
-    unique_positions = [np.mean(np.where(np.array(length_mapping) == length)[0]) for length in lengths]
-    plt.xticks(unique_positions[::5], lengths[::5])  # Show every 5th label to reduce clutter
-    plt.xlabel('Payload Length (bytes)')
-
-    filename = datetime.now().strftime('%Y%m%d_%H%M%S')
-    plt.savefig(f'{filename}_latency_statistics.png', dpi=300, bbox_inches='tight')
-    plt.tight_layout()
-    plt.show()
-
-    # Summary plot
-    plt.figure(figsize=(10, len(lengths) * 0.5))
     summary = "Summary:\n"
     for length in lengths:
-        latencies = [result['total_latency'] for result in all_results[length]]
         summary += f"Length {length}:\n"
-        summary += f"  Min: {min(latencies):.2f} ms\n"
-        summary += f"  Median: {median(latencies):.2f} ms\n"
-        summary += f"  Avg: {mean(latencies):.2f} ms\n"
-        summary += f"  Max: {max(latencies):.2f} ms\n"
-        summary += f"  Iterations: {len(latencies)}\n\n"
-
-    plt.text(0.05, 0.95, summary, verticalalignment='top', horizontalalignment='left', 
-             transform=plt.gca().transAxes, fontsize=10, family='monospace')
-    plt.axis('off')
-    plt.tight_layout()
+        summary += format_stat_lines(stats[length])
+        summary += f"  Iterations: {stats[length]['count']}\n\n"
 
-    plt.savefig(f'{filename}_summary.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    filename = datetime.now().strftime('%Y%m%d_%H%M%S')
+    plotting.submit(plotting.latency_statistics, f'{filename}_latency_statistics.png', lengths, latencies, stats)
+    plotting.submit(plotting.text_summary, f'{filename}_summary.png', summary)
 
     timestamp = current_milli_time()
-    print(f"[{timestamp}] Plots saved as '{filename}_latency_statistics.png' and '{filename}_summary.png'")
+    print(f"[{timestamp}] Rendering '{filename}_latency_statistics.png' and '{filename}_summary.png' in the background")
     print(summary)
 
 
@@ -158,10 +82,10 @@ def main():
         print(f"Error opening serial port {node['port']}: {e}")
         return
 
-    message_queue = queue.Queue()
+    router = EventRouter()
     stop_event = threading.Event()
 
-    thread = threading.Thread(target=read_from_port, args=(node['serial'], message_queue, stop_event))
+    thread = threading.Thread(target=read_from_port, args=(node['serial'], router, stop_event))
     thread.start()
 
     all_results = {}
@@ -170,19 +94,16 @@ def main():
     try:
         for length in range(min_length, max_length + 1, length_increment):
             print(f"\n--- Testing message length: {length} ---")
-            results = run_tests(node['serial'], node['node_id'], message_queue, length, tests_per_length, timeout)
+            results = run_tests(node['serial'], node['node_id'], router, length, tests_per_length, timeout)
             
             if results:
                 all_results[length] = results
-                latencies = [r['total_latency'] for r in results]
+                stats = summarize([r['total_latency'] for r in results])
                 avg_results[length] = {
-                    'total_latency': mean(latencies)
+                    'total_latency': stats['mean']
                 }
                 print(f"Statistics for length {length}:")
-                print(f"  Min: {min(latencies):.2f} ms")
-                print(f"  Median: {median(latencies):.2f} ms")
-                print(f"  Avg: {avg_results[length]['total_latency']:.2f} ms")
-                print(f"  Max: {max(latencies):.2f} ms")
+                print(format_stat_lines(stats), end='')
             else:
                 print(f"No valid results for length {length}, skipping...")
     except Exception as e:
@@ -2,55 +2,43 @@ import serial
 import time
 import random
 import string
-import matplotlib.pyplot as plt
-from statistics import mean
 import threading
-import queue
-from datetime import datetime, timedelta
-import numpy as np
+from datetime import datetime
+from serial_reader import current_milli_time, read_from_port
+from event_router import Deadline, EventRouter
+from firmware_events import DECRYPTED, DECRYPTION_TIME, ENCRYPTION_TIME, INBOUND, OUTBOUND
+from adaptive_sampling import AdaptiveSampler
+from stats import format_stat_lines, summarize, summarize_groups
+import plotting
 
-def current_milli_time():
-    return datetime.now().strftime('%H:%M:%S.%f')[:-3]
+LATENCY_EVENTS = (ENCRYPTION_TIME, DECRYPTION_TIME, OUTBOUND, INBOUND, DECRYPTED)
 
 def generate_payload(length):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
-def read_from_port(ser, message_queue, stop_event):
-    while not stop_event.is_set():
-        if ser.in_waiting:
-            response = ser.readline().decode().strip()
-            timestamp = current_milli_time()
-            print(f"[{timestamp}][{ser.port} IN] {response}")
-            message_queue.put((ser.port, timestamp, response))
-
-def parse_timestamp(timestamp_str):
-    return datetime.strptime(timestamp_str, '%H:%M:%S.%f')
-
-def send_and_receive(sender, receiver, payload, message_queue, encrypted=True, timeout=10):
+def send_and_receive(sender, receiver, payload, router, encrypted=True, timeout=10):
     command = f"hirg -r {receiver['node_id']} -{('s' if encrypted else 'p')} {payload}\n"
     timestamp = current_milli_time()
     print(f"[{timestamp}][{sender['port']} OUT] {command.strip()}")
+    subscription = router.subscribe([sender['port'], receiver['port']], kinds=LATENCY_EVENTS)
     sender['serial'].write(command.encode())
 
     response_found = False
-    expected_message = f"Decrypted message from {sender['node_id']}: {payload}"
-    prefix_pattern = f"Decrypted message from {sender['node_id']}:"
+    decrypted = False
 
     events = []
     
-    start_time = datetime.now()
-    while (datetime.now() - start_time) < timedelta(seconds=timeout):
-        try:
-            port, timestamp, message = message_queue.get(timeout=0.1)
-            events.append((port, timestamp, message))
-            
-            if port == receiver['port'] and message.startswith(prefix_pattern):
-                if message == expected_message:
-                    response_found = True
-                    break
-
-        except queue.Empty:
-            continue
+    for event in subscription.until(Deadline(timeout)):
+        events.append(event)
+        
+        if event.port == receiver['port'] and event.kind == DECRYPTED and event.node == sender['node_id']:
+            if event.payload == payload:
+                decrypted = True
+        elif decrypted and event.port == receiver['port'] and event.kind == INBOUND:
+            # receivedCallback prints INBOUND last, after the decrypted payload
+            response_found = True
+            break
+    subscription.close()
 
     if response_found:
         encryption_time = 0 if not encrypted else None
@@ -58,20 +46,20 @@ def send_and_receive(sender, receiver, payload, message_queue, encrypted=True, t
         outbound_time = None
         inbound_time = None
 
-        for port, timestamp, message in events:
-            if port == sender['port']:
-                if encrypted and "Encryption time /us:" in message:
-                    encryption_time = int(message.split(":")[1].strip()) / 1000  # Convert to ms
-                elif "OUTBOUND" in message:
-                    outbound_time = parse_timestamp(timestamp)
-            elif port == receiver['port']:
-                if "INBOUND" in message:
-                    inbound_time = parse_timestamp(timestamp)
-                elif encrypted and "Decryption time /us:" in message:
-                    decryption_time = int(message.split(":")[1].strip()) / 1000  # Convert to ms
+        for event in events:
+            if event.port == sender['port']:
+                if encrypted and event.kind == ENCRYPTION_TIME:
+                    encryption_time = event.value / 1000  # Convert to ms
+                elif event.kind == OUTBOUND:
+                    outbound_time = event.timestamp
+            elif event.port == receiver['port']:
+                if event.kind == INBOUND:
+                    inbound_time = event.timestamp
+                elif encrypted and event.kind == DECRYPTION_TIME:
+                    decryption_time = event.value / 1000  # Convert to ms
 
         if outbound_time is not None and inbound_time is not None:
-            air_time = (inbound_time - outbound_time).total_seconds() * 1000  # Convert to milliseconds
+            air_time = (inbound_time - outbound_time) / 1_000_000  # Nanoseconds to milliseconds
             
             if air_time < 0:
                 print(f"Warning: Negative air time detected ({air_time:.2f} ms). Setting to 0 ms.")
@@ -90,101 +78,39 @@ def send_and_receive(sender, receiver, payload, message_queue, encrypted=True, t
     print(f"[{timestamp}] Timeout reached or incomplete data")
     return None, False
 
-def run_tests(sender, receiver, message_queue, payload_length, num_iterations, encrypted=True, timeout=10):
+def run_tests(sender, receiver, router, payload_length, num_iterations, encrypted=True, timeout=10):
     results = []
     for _ in range(num_iterations):
         payload = generate_payload(payload_length)
-        result, success = send_and_receive(sender, receiver, payload, message_queue, encrypted, timeout)
+        result, success = send_and_receive(sender, receiver, payload, router, encrypted, timeout)
         if success:
             results.append(result)
     return results
 
 def plot_results(all_results, avg_results):
-    # Create the main plot
-    plt.figure(figsize=(20, 10))
-    
     lengths = sorted(all_results.keys())
-    bar_width = 0.8
-    colors = ['r', 'g', 'b']
-    components = ['encryption_time', 'air_time', 'decryption_time']
-    labels = ['Encryption', 'Transmission', 'Decryption']
-
-    # Calculate the total number of bars and their positions
-    total_bars = sum(len(all_results[length]) for length in lengths)
-    bar_positions = np.arange(total_bars)
-
-    # Create mapping from bar position to message length
-    length_mapping = []
-    for length in lengths:
-        length_mapping.extend([length] * len(all_results[length]))
-
-    # Plot individual bars
-    bottom = np.zeros(total_bars)
-    for i, component in enumerate(components):
-        heights = [result[component] for length in lengths for result in all_results[length]]
-        plt.bar(bar_positions, heights, bar_width, bottom=bottom, color=colors[i], alpha=0.6, label=labels[i])
-        bottom += heights
-
-    # Plot average lines
-    avg_positions = []
-    for length in lengths:
-        start = len(avg_positions)
-        avg_positions.extend(np.arange(start, start + len(all_results[length])))
+    components = {component: [[result[component] for result in all_results[length]] for length in lengths]
+                  for component in ('encryption_time', 'air_time', 'decryption_time')}
+    averages = {component: [avg_results[length][component] for length in lengths]
+                for component in ('encryption_time', 'air_time', 'decryption_time', 'total_latency')}
 
-    for i, component in enumerate(components):
-        avg_values = [avg_results[length][component] for length in lengths for _ in all_results[length]]
-        plt.plot(avg_positions, avg_values, color=colors[i], linewidth=2, label=f'Avg {labels[i]}')
-
-    # Plot total latency average line
-    total_avg_values = [avg_results[length]['total_latency'] for length in lengths for _ in all_results[length]]
-    plt.plot(avg_positions, total_avg_values, color='k', linewidth=2, label='Avg Total Latency')
-
-    plt.xlabel('Experiment Number')
-    plt.ylabel('Time (ms)')
-    plt.title('Latency Components for All Experiments')
-    plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
-    plt.grid(True)
-
-    # Create custom x-ticks to show message lengths
-    unique_positions = [np.mean(np.where(np.array(length_mapping) == length)[0]) for length in lengths]
-    plt.xticks(unique_positions, lengths)
-    plt.xlabel('Message Length')
-
-    # Add a second x-axis for experiment numbers
-    ax2 = plt.twiny()
-    ax2.set_xlim(plt.gca().get_xlim())
-    ax2.set_xticks(bar_positions)
-    ax2.set_xticklabels(range(1, total_bars + 1))
-    ax2.set_xlabel('Experiment Number')
-
-    # Save the main plot
-    filename = datetime.now().strftime('%Y%m%d_%H%M%S')
-    plt.savefig(f'{filename}_latency_components.png', dpi=300, bbox_inches='tight')
-    plt.tight_layout()
-    plt.show()
-
-    # Create a new figure for the summary
-    plt.figure(figsize=(10, len(lengths) * 0.5))
     summary = "Summary:\n"
+    total_stats = summarize_groups(all_results, lambda result: result['total_latency'])
     for length in lengths:
         summary += f"Length {length}:\n"
-        summary += f"  Avg Total: {avg_results[length]['total_latency']:.2f} ms\n"
+        summary += f"  Total:\n"
+        summary += format_stat_lines(total_stats[length], indent='    ')
         summary += f"  Avg Encryption: {avg_results[length]['encryption_time']:.2f} ms\n"
         summary += f"  Avg Transmission: {avg_results[length]['air_time']:.2f} ms\n"
         summary += f"  Avg Decryption: {avg_results[length]['decryption_time']:.2f} ms\n"
         summary += f"  Iterations: {len(all_results[length])}\n\n"
 
-    plt.text(0.05, 0.95, summary, verticalalignment='top', horizontalalignment='left', 
-             transform=plt.gca().transAxes, fontsize=10, family='monospace')
-    plt.axis('off')
-    plt.tight_layout()
-    
-    # Save the summary plot
-    plt.savefig(f'{filename}_summary.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    filename = datetime.now().strftime('%Y%m%d_%H%M%S')
+    plotting.submit(plotting.latency_components, f'{filename}_latency_components.png', lengths, components, averages)
+    plotting.submit(plotting.text_summary, f'{filename}_summary.png', summary)
 
     timestamp = current_milli_time()
-    print(f"[{timestamp}] Plots saved as '{filename}_latency_components.png' and '{filename}_summary.png'")
+    print(f"[{timestamp}] Rendering '{filename}_latency_components.png' and '{filename}_summary.png' in the background")
     print(summary)
 
 
@@ -196,7 +122,8 @@ def main():
     min_length = 5
     max_length = 100
     length_increment = 1
-    tests_per_length = 20
+    tests_per_length = 20  # Upper bound per length when adaptive
+    adaptive = True  # Stop sampling a length once its median/p95 intervals are tight
     encrypted = True  # Set this to True for encrypted tests, False for unencrypted
     timeout = 10  # Increased timeout
 
@@ -208,35 +135,54 @@ def main():
             print(f"Error opening serial port {node['port']}: {e}")
             return
 
-    message_queue = queue.Queue()
+    router = EventRouter()
     stop_event = threading.Event()
 
     # Start reading threads
     threads = []
     for node in nodes:
-        thread = threading.Thread(target=read_from_port, args=(node['serial'], message_queue, stop_event))
+        thread = threading.Thread(target=read_from_port, args=(node['serial'], router, stop_event))
         thread.start()
         threads.append(thread)
 
     all_results = {}
     avg_results = {}
 
+    def record(length, results):
+        if results:
+            all_results[length] = results
+            avg_results[length] = {
+                component: summarize([r[component] for r in results])['mean']
+                for component in ('encryption_time', 'air_time', 'decryption_time', 'total_latency')
+            }
+            print(f"Average latency for length {length}: {avg_results[length]['total_latency']:.2f} ms over {len(results)} tests")
+        else:
+            print(f"No valid results for length {length}, skipping...")
+
+    def measure(length):
+        print(f"\n--- Testing {'encrypted' if encrypted else 'unencrypted'} message length: {length} ---")
+        result, success = send_and_receive(nodes[0], nodes[1], generate_payload(length), router, encrypted, timeout)
+        return result if success else None
+
+    lengths = range(min_length, max_length + 1, length_increment)
     try:
-        for length in range(min_length, max_length + 1, length_increment):
-            print(f"\n--- Testing {'encrypted' if encrypted else 'unencrypted'} message length: {length} ---")
-            results = run_tests(nodes[0], nodes[1], message_queue, length, tests_per_length, encrypted, timeout)
-            
-            if results:
-                all_results[length] = results
-                avg_results[length] = {
-                    'encryption_time': mean([r['encryption_time'] for r in results]),
-                    'air_time': mean([r['air_time'] for r in results]),
-                    'decryption_time': mean([r['decryption_time'] for r in results]),
-                    'total_latency': mean([r['total_latency'] for r in results])
-                }
-                print(f"Average latency for length {length}: {avg_results[length]['total_latency']:.2f} ms")
-            else:
-                print(f"No valid results for length {length}, skipping...")
+        if adaptive:
+            sampler = AdaptiveSampler(max_samples=tests_per_length)
+            try:
+                sampler.sweep(lengths, measure, on_length=record)
+            finally:
+                # Lengths refined after a step gained samples since they were first recorded
+                for length, results in sampler.samples.items():
+                    if length in sampler.refined or length not in all_results:
+                        record(length, results)
+                for length, results in sampler.discarded.items():
+                    for result in results:
+                        print(f"Discarded warm-up outlier at length {length}: {result['total_latency']:.2f} ms")
+                print(f"Ran {sampler.total_attempts()} tests instead of {len(lengths) * tests_per_length}")
+        else:
+            for length in lengths:
+                print(f"\n--- Testing {'encrypted' if encrypted else 'unencrypted'} message length: {length} ---")
+                record(length, run_tests(nodes[0], nodes[1], router, length, tests_per_length, encrypted, timeout))
 
     except Exception as e:
         print(f"An error occurred during testing: {e}")
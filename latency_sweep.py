@@ -0,0 +1,111 @@
+import asyncio
+import random
+from serial_reader import current_milli_time
+from serial_engine import SerialEngine
+from firmware_events import LATENCY_TIMEOUT, ROUND_TRIP, classify
+from latency_embedded import plot_results
+from stats import format_stats, summarize_groups
+from log_sink import LogSink, LINES
+from datetime import datetime
+
+# Any of these ends a probe: the firmware blocks in performLatencyTest until one is printed
+PROBE_DONE = r'Round-trip latency /us: \d+|Latency test timed out|Failed to send latency test message'
+
+def make_pairs(nodes):
+    # Disjoint sender/receiver pairs, so no board is probing and reflecting for
+    # two pairs at once and every pair measures an otherwise idle link
+    return [(nodes[i], nodes[i + 1]) for i in range(0, len(nodes) - 1, 2)]
+
+async def probe(engine, sender, receiver, length, timeout):
+    reply = await engine.request(sender, f"hirg -r {receiver['node_id']} -l {length}", PROBE_DONE, timeout)
+    if reply is None:
+        print(f"[{current_milli_time()}][{sender['port']}] No reply for length {length}")
+        return None
+    event = classify(*reply)
+    if event.kind != ROUND_TRIP:
+        if event.kind == LATENCY_TIMEOUT:
+            print(f"[{current_milli_time()}][{sender['port']}] Latency test timed out for length {length}")
+        return None
+    return event.value / 2000  # Round trip in us to one-way latency in ms
+
+async def run_pair(engine, sender, receiver, work, all_results, timeout, probe_gap):
+    pair = f"{sender['port']}->{receiver['port']}"
+    while True:
+        try:
+            length, iteration = work.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        latency = await probe(engine, sender, receiver, length, timeout)
+        if latency is not None:
+            all_results.setdefault(length, []).append({'total_latency': latency, 'pair': pair})
+        if probe_gap:
+            await asyncio.sleep(probe_gap)
+
+async def sweep(nodes, lengths, tests_per_length, timeout=10, probe_gap=0.05, echo=True):
+    pairs = make_pairs(nodes)
+    if not pairs:
+        print("At least two nodes are needed for a latency sweep")
+        return {}
+
+    # The whole length x iteration matrix goes into one queue; every pair pulls the
+    # next cell as soon as its previous probe finishes, so fast links do more of the work
+    cells = [(length, iteration) for length in lengths for iteration in range(tests_per_length)]
+    random.shuffle(cells)  # Spread each length over all pairs and over the whole run
+    work = asyncio.Queue()
+    for cell in cells:
+        work.put_nowait(cell)
+
+    all_results = {}
+    print(f"[{current_milli_time()}] Sweeping {len(cells)} probes over {len(pairs)} pair(s)")
+    async with SerialEngine(nodes, echo=echo) as engine:
+        await asyncio.gather(*(run_pair(engine, sender, receiver, work, all_results, timeout, probe_gap)
+                               for sender, receiver in pairs))
+    return all_results
+
+def summarize_sweep(all_results):
+    avg_results = {}
+    stats = summarize_groups(all_results, lambda result: result['total_latency'])
+    for length in sorted(all_results):
+        avg_results[length] = {'total_latency': stats[length]['mean']}
+        by_pair = {}
+        for result in all_results[length]:
+            by_pair.setdefault(result['pair'], []).append(result['total_latency'])
+        print(f"Length {length}: {format_stats(stats[length])}")
+        for pair, pair_stats in sorted(summarize_groups(by_pair).items()):
+            print(f"  {pair}: median {pair_stats['p50']:.2f} ms over {pair_stats['count']}")
+    return avg_results
+
+def main():
+    nodes = [
+        {'port': 'COM13', 'node_id': 480652657},
+        {'port': 'COM5', 'node_id': 2385360021},
+    ]
+    min_length = 10
+    max_length = 100
+    length_increment = 1
+    tests_per_length = 10
+    timeout = 10
+    verbosity = LINES  # SUMMARY prints only results, COMMANDS adds the commands sent; the log file gets everything
+
+    lengths = range(min_length, max_length + 1, length_increment)
+    # Echo is formatted and written on the sink's thread instead of the event loop
+    log = LogSink(datetime.now().strftime('%Y%m%d_%H%M%S') + '_serial', verbosity).start()
+    try:
+        all_results = asyncio.run(sweep(nodes, lengths, tests_per_length, timeout, echo=log))
+    except KeyboardInterrupt:
+        print("\nSweep interrupted")
+        return
+    finally:
+        log.stop()
+
+    if all_results:
+        avg_results = summarize_sweep(all_results)
+        try:
+            plot_results(all_results, avg_results)
+        except Exception as e:
+            print(f"Error during plotting: {e}")
+    else:
+        print("No results to plot.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import collections
+import threading
+import time
+from serial_reader import current_milli_time
+from stats import summarize
+import plotting
+
+class RollingWindow:
+    # (timestamp_ns, value) pairs from the last `seconds`; old entries fall off
+    # the left as new ones arrive, so memory and scan cost track the window,
+    # not the length of the run
+
+    def __init__(self, seconds):
+        self.window_ns = int(seconds * 1_000_000_000)
+        self.items = collections.deque()
+
+    def add(self, value=1, now_ns=None):
+        self.items.append((now_ns if now_ns is not None else time.perf_counter_ns(), value))
+
+    def trim(self, now_ns):
+        cutoff = now_ns - self.window_ns
+        items = self.items
+        while items and items[0][0] < cutoff:
+            items.popleft()
+
+    def values(self):
+        return [value for _, value in self.items]
+
+    def __len__(self):
+        return len(self.items)
+
+class LiveDashboard:
+    # Prints a status line every `interval` seconds with the loss rate, latency
+    # percentiles and per-port line rate over the last `window` seconds, and
+    # every `plot_every` intervals re-renders a chart of the last `history`
+    # status lines in the background. Each update only touches the window and
+    # the bounded history, so its cost stays flat over a multi-hour soak test.
+
+    def __init__(self, window=60.0, interval=1.0, plot_every=10, history=3600, filename=None):
+        self.window = window
+        self.interval = interval
+        self.plot_every = plot_every
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.sent = RollingWindow(window)
+        self.received = RollingWindow(window)
+        self.lost = RollingWindow(window)
+        self.latencies = RollingWindow(window)
+        self.lines = {}  # port -> RollingWindow
+        self.history = collections.deque(maxlen=history)
+        self.start_ns = time.perf_counter_ns()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def record_sent(self, now_ns=None):
+        with self.lock:
+            self.sent.add(1, now_ns)
+
+    def record_received(self, latency_ms=None, now_ns=None):
+        with self.lock:
+            self.received.add(1, now_ns)
+            if latency_ms is not None:
+                self.latencies.add(latency_ms, now_ns)
+
+    def record_lost(self, now_ns=None):
+        with self.lock:
+            self.lost.add(1, now_ns)
+
+    def line_callback(self, event):
+        # For EventRouter.subscribe(..., callback=dashboard.line_callback)
+        port, timestamp, _ = event
+        with self.lock:
+            window = self.lines.get(port)
+            if window is None:
+                window = self.lines[port] = RollingWindow(self.window)
+            window.add(1, timestamp)
+
+    def snapshot(self, now_ns=None):
+        now_ns = now_ns if now_ns is not None else time.perf_counter_ns()
+        with self.lock:
+            for window in (self.sent, self.received, self.lost, self.latencies, *self.lines.values()):
+                window.trim(now_ns)
+            latencies = self.latencies.values()
+            sent, received, lost = len(self.sent), len(self.received), len(self.lost)
+            line_counts = {port: len(window) for port, window in self.lines.items()}
+
+        # Rates are over the part of the window the run has actually covered
+        span = min(self.window, (now_ns - self.start_ns) / 1_000_000_000) or self.interval
+        resolved = received + lost
+        stats = summarize(latencies)
+        return {
+            'elapsed': (now_ns - self.start_ns) / 1_000_000_000,
+            'sent': sent,
+            'received': received,
+            'lost': lost,
+            'loss_rate': lost / resolved * 100 if resolved else 0.0,
+            'p50': stats['p50'] if stats else None,
+            'p90': stats['p90'] if stats else None,
+            'p99': stats['p99'] if stats else None,
+            'line_rates': {port: count / span for port, count in line_counts.items()},
+        }
+
+    def format(self, snapshot):
+        latency = ('n/a' if snapshot['p50'] is None else
+                   f"p50 {snapshot['p50']:.1f} / p90 {snapshot['p90']:.1f} / p99 {snapshot['p99']:.1f} ms")
+        rates = ', '.join(f"{port} {rate:.1f}/s" for port, rate in sorted(snapshot['line_rates'].items()))
+        return (f"[{current_milli_time()}] [last {self.window:g} s] loss {snapshot['loss_rate']:.1f}% "
+                f"({snapshot['lost']}/{snapshot['received'] + snapshot['lost']}), latency {latency}, lines {rates or 'n/a'}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        updates = 0
+        while not self.stop_event.wait(self.interval):
+            snapshot = self.snapshot()
+            self.history.append(snapshot)
+            print(self.format(snapshot))
+            updates += 1
+            if self.filename and self.plot_every and updates % self.plot_every == 0:
+                plotting.submit(plotting.dashboard, self.filename, list(self.history), self.window)
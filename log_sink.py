@@ -0,0 +1,188 @@
+import collections
+import gzip
+import os
+import sys
+import threading
+import time
+from serial_reader import format_timestamp, WALL_CLOCK_OFFSET_NS
+
+# Verbosity levels: each includes everything below it
+SUMMARY = 0   # Test-level results only (quiet)
+COMMANDS = 1  # Plus every command sent
+LINES = 2     # Plus every line received
+
+class LogSink:
+    # Takes log records from any thread without blocking it and hands them to
+    # one writer thread, which formats them, prints those within `verbosity`
+    # to the console at no more than `console_rate` lines per second, and
+    # writes every record to a gzip log that rotates every `max_bytes` of text.
+    #
+    # Producers only append a tuple to a bounded deque (append and popleft are
+    # atomic, so no lock is taken); timestamps are formatted by the writer. When
+    # the buffer is full new records are dropped and counted rather than
+    # making the reader thread wait.
+
+    def __init__(self, path=None, verbosity=LINES, capacity=65536, console_rate=200,
+                 max_bytes=64 * 1024 * 1024, backups=20, flush_interval=0.05, stream=None):
+        self.path = path  # Log file prefix; segments are <path>.000.log.gz, <path>.001.log.gz, ...
+        self.verbosity = verbosity
+        self.capacity = capacity
+        self.console_rate = console_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.stream = stream or sys.stdout
+        self.records = collections.deque()
+        self.dropped = 0
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = None
+        self.file = None
+        self.segment = -1
+        self.segment_bytes = 0
+        self.suppressed = 0
+        self.clock_second = None
+        self.clock_text = ''
+        self.tokens = float(console_rate)
+        self.refilled = time.perf_counter()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def __bool__(self):
+        # Passed as read_from_port's echo, a sink counts as echo on
+        return True
+
+    # Producers
+
+    def line(self, port, timestamp, text):
+        self._put((LINES, timestamp, port, 'IN', text))
+
+    def command(self, port, command):
+        self._put((COMMANDS, time.perf_counter_ns(), port, 'OUT', command.strip()))
+
+    def message(self, text, level=SUMMARY):
+        self._put((level, time.perf_counter_ns(), None, None, text))
+
+    def _put(self, record):
+        if len(self.records) >= self.capacity:
+            self.dropped += 1
+            return
+        self.records.append(record)
+        if len(self.records) == self.capacity // 2:
+            self.wake.set()
+
+    # Writer
+
+    def start(self):
+        if self.path:
+            # A resumed run continues after the segments already on disk
+            while os.path.exists(f"{self.path}.{self.segment + 1:03d}.log.gz"):
+                self.segment += 1
+            self._rotate()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            stopping = self.stopping
+            self._drain()
+            if stopping:
+                self._drain()
+                if self.suppressed:
+                    self.stream.write(f"... {self.suppressed} lines not shown (see log file)\n")
+                    self.stream.flush()
+                return
+
+    def _drain(self):
+        records = self.records
+        console = []
+        log = []
+        # Only what is there now; a producer outrunning the writer cannot keep it here
+        for _ in range(len(records)):
+            level, timestamp, port, direction, text = records.popleft()
+            # strftime once per second of records, not once per record
+            second, nanoseconds = divmod(timestamp + WALL_CLOCK_OFFSET_NS, 1_000_000_000)
+            if second != self.clock_second:
+                self.clock_second = second
+                self.clock_text = format_timestamp(timestamp)[:-4]
+            stamp = f"{self.clock_text}.{nanoseconds // 1_000_000:03d}"
+            if port is None:
+                formatted = f"[{stamp}] {text}"
+            else:
+                formatted = f"[{stamp}][{port} {direction}] {text}"
+            log.append(formatted)
+            if level <= self.verbosity:
+                console.append((level, formatted))
+
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            notice = f"[{format_timestamp(time.perf_counter_ns())}] Log buffer full, {dropped} records dropped"
+            log.append(notice)
+            console.append((SUMMARY, notice))
+
+        if console:
+            self._print(console)
+        if log and self.path:
+            self._write(log)
+
+    def _print(self, console):
+        now = time.perf_counter()
+        self.tokens = min(self.console_rate, self.tokens + (now - self.refilled) * self.console_rate)
+        self.refilled = now
+        out = []
+        for level, formatted in console:
+            # Summaries always get through; line echo gives way under load
+            if level == SUMMARY or self.tokens >= 1:
+                if self.suppressed:
+                    out.append(f"... {self.suppressed} lines not shown (see log file)")
+                    self.suppressed = 0
+                out.append(formatted)
+                if level != SUMMARY:
+                    self.tokens -= 1
+            else:
+                self.suppressed += 1
+        if out:
+            self.stream.write('\n'.join(out) + '\n')
+            self.stream.flush()
+
+    def _write(self, log):
+        data = ('\n'.join(log) + '\n').encode('utf-8')
+        self.file.write(data)
+        # A sync flush per batch keeps the log readable up to the last batch after a crash
+        self.file.flush()
+        self.segment_bytes += len(data)
+        if self.segment_bytes >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+        self.segment += 1
+        self.segment_bytes = 0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = gzip.open(f"{self.path}.{self.segment:03d}.log.gz", 'wb', compresslevel=1)
+        old = self.segment - self.backups
+        if old >= 0:
+            try:
+                os.remove(f"{self.path}.{old:03d}.log.gz")
+            except OSError:
+                pass
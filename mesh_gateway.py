@@ -0,0 +1,545 @@
+import asyncio
+import collections
+import json
+import random
+import time
+from direct_tcp import PAINLESSMESH_PORT, FrameSplitter, decode_frame
+from mesh_tap import MeshTap, tree_edges, TIME_DELAY, TIME_SYNC, NODE_SYNC_REQUEST, NODE_SYNC_REPLY, BROADCAST, SINGLE
+from sequence_tracker import SequenceTracker
+from serial_reader import current_milli_time, format_timestamp
+from stats import summarize, format_stats
+
+# Joins the mesh as a painlessMesh node of its own over TCP, so tests can send
+# and receive mesh messages directly instead of through a node's 115200-baud
+# serial console. A node's AP listens on MESH_PORT at 10.<id bits 15-8>.<id
+# bits 7-0>.1 (mesh_ip); associate the host's WiFi with the MESH_PREFIX
+# network first, then connect() there. StandInNode is the other end for
+# running without hardware.
+
+MESH_PORT = PAINLESSMESH_PORT
+
+# The "msg" types inside TIME_SYNC and TIME_DELAY packages
+TIME_SYNC_REQUEST = 0
+TIME_REQUEST = 1
+TIME_REPLY = 2
+TIME_SYNC_ACCURACY = 5000  # us; a larger correction is followed by another round, as painlessMesh does
+
+def mesh_ip(node_id):
+    return f"10.{(node_id >> 8) & 0xFF}.{node_id & 0xFF}.1"
+
+def to_json(document):
+    return json.dumps(document, separators=(',', ':'))
+
+def random_payload(length):
+    # generateRandomPayload: printable ASCII
+    return ''.join(chr(random.randint(32, 126)) for _ in range(length))
+
+def wrap32(value):
+    # Signed difference of two uint32 microsecond clocks
+    value &= 0xFFFFFFFF
+    return value - 0x100000000 if value >= 0x80000000 else value
+
+class MeshConnection:
+    def __init__(self, reader, writer, station):
+        self.reader = reader
+        self.writer = writer
+        self.station = station  # We connected to its AP; the station side starts time sync
+        self.peer = '%s:%d' % writer.get_extra_info('peername')[:2]
+        self.node_id = None     # Known after the first node sync
+        self.subs = []
+        self.root = False
+        self.reachable = set()  # Every node on its side of the link
+        self.synced = asyncio.Event()
+        self.tasks = []
+
+    def subtree(self):
+        tree = {'nodeId': self.node_id, 'subs': self.subs}
+        if self.root:
+            tree['root'] = True
+        return tree
+
+class MeshNode:
+    # The painlessMesh protocol: node sync on every link, time sync from the
+    # station side, SINGLE routed to the link whose subtree holds the
+    # destination, BROADCAST flooded to every other link. Messages for this
+    # node reach listeners, expect() waiters, per-sender SequenceTrackers and
+    # received(), in that order. Every package received is added to `tap`.
+
+    def __init__(self, node_id=None, echo=True, tap=None, sync_interval=10.0, root=False):
+        self.node_id = node_id if node_id is not None else random.randint(1, 0xFFFFFFFF)
+        self.echo = echo
+        self.tap = tap if tap is not None else MeshTap()
+        self.sync_interval = sync_interval
+        self.root = root
+        self.connections = []
+        self.servers = []
+        self.time_offset = 0  # us added to the host clock to get mesh time
+        self.time_synced = asyncio.Event()
+        self.waiters = []     # [(predicate, future)]
+        self.listeners = []   # callbacks receiving every (sender, timestamp_ns, msg) addressed here
+        self.trackers = {}    # sender -> SequenceTracker fed with its message numbers
+        self.delay_waiters = {}  # node -> future for a TIME_DELAY reply
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def node_time(self, timestamp=None):
+        # painlessMesh's getNodeTime(): uint32 microseconds shared across the mesh
+        timestamp = time.perf_counter_ns() if timestamp is None else timestamp
+        return (timestamp // 1000 + self.time_offset) & 0xFFFFFFFF
+
+    # Connections
+
+    async def connect(self, host, port=MESH_PORT, timeout=10.0):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        connection = self._open(reader, writer, station=True)
+        self._send_node_sync(connection, NODE_SYNC_REQUEST)
+        try:
+            await asyncio.wait_for(connection.synced.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._drop(connection)
+            raise ConnectionError(f"No node sync from {host}:{port} within {timeout} s")
+        return connection
+
+    async def listen(self, port=MESH_PORT, host=''):
+        # Accept stations, as a node's AP does
+        server = await asyncio.start_server(lambda reader, writer: self._open(reader, writer, station=False),
+                                            host or None, port, reuse_address=True)
+        self.servers.append(server)
+        return server
+
+    async def close(self):
+        for server in self.servers:
+            server.close()
+        for connection in list(self.connections):
+            self._drop(connection)
+        for server in self.servers:
+            await server.wait_closed()
+        self.servers = []
+        for _, future in self.waiters:
+            if not future.done():
+                future.cancel()
+        self.waiters.clear()
+
+    async def drain(self):
+        for connection in list(self.connections):
+            await connection.writer.drain()
+
+    def _open(self, reader, writer, station):
+        connection = MeshConnection(reader, writer, station)
+        self.connections.append(connection)
+        self._note(connection.peer, 'Connected' if station else 'Accepted station')
+        connection.tasks.append(asyncio.ensure_future(self._read(connection)))
+        if station:
+            connection.tasks.append(asyncio.ensure_future(self._sync_periodically(connection)))
+        return connection
+
+    def _drop(self, connection):
+        if connection not in self.connections:
+            return
+        self.connections.remove(connection)
+        for task in connection.tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        connection.writer.close()
+        self._note(connection.peer, 'Connection closed')
+        if connection.node_id is not None:
+            self.tap.topology.remove_node(connection.node_id)
+            for other in self.connections:
+                if other.node_id is not None:
+                    self._send_node_sync(other, NODE_SYNC_REQUEST)
+
+    async def _read(self, connection):
+        splitter = FrameSplitter()
+        try:
+            while True:
+                data = await connection.reader.read(65536)
+                if not data:
+                    break
+                timestamp = time.perf_counter_ns()
+                for frame in splitter.feed(data):
+                    if self.echo is True:
+                        print(f"[{format_timestamp(timestamp)}][{connection.peer} IN] {frame.decode(errors='replace')}")
+                    elif self.echo:
+                        self.echo.line(connection.peer, timestamp, frame.decode(errors='replace'))
+                    message = decode_frame(frame)
+                    if isinstance(message, dict):
+                        self._on_message(connection, timestamp, message)
+        except (ConnectionError, ValueError) as e:
+            self._note(connection.peer, f"Connection dropped: {e}")
+        finally:
+            self._drop(connection)
+
+    async def _sync_periodically(self, connection):
+        # painlessMesh drops a link it has not heard from in a while; the station keeps it alive
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            self._send_node_sync(connection, NODE_SYNC_REQUEST)
+
+    def _write(self, connection, message):
+        text = to_json(message)
+        if self.echo is True:
+            print(f"[{current_milli_time()}][{connection.peer} OUT] {text}")
+        elif self.echo:
+            self.echo.command(connection.peer, text)
+        connection.writer.write(text.encode() + b'\0')
+
+    def _note(self, peer, text):
+        if self.echo is True:
+            print(f"[{current_milli_time()}][{peer}] {text}")
+        elif self.echo:
+            self.echo.message(f"[{peer}] {text}")
+
+    # Protocol
+
+    def _on_message(self, connection, timestamp, message):
+        self.tap.add(connection.peer, timestamp, message)
+        message_type = message.get('type')
+        if message_type in (NODE_SYNC_REQUEST, NODE_SYNC_REPLY):
+            self._on_node_sync(connection, message)
+        elif message_type == TIME_SYNC:
+            self._on_time(connection, message, timestamp)
+        elif message_type == BROADCAST:
+            self._forward(connection, message)
+            self._deliver(message, timestamp)
+        elif message.get('dest') == self.node_id:
+            if message_type == TIME_DELAY:
+                self._on_time(connection, message, timestamp)
+            elif message_type == SINGLE:
+                self._deliver(message, timestamp)
+        else:
+            self._forward(connection, message)
+
+    def _tree(self, exclude=None):
+        tree = {'nodeId': self.node_id,
+                'subs': [other.subtree() for other in self.connections
+                         if other is not exclude and other.node_id is not None]}
+        if self.root:
+            tree['root'] = True
+        return tree
+
+    def _send_node_sync(self, connection, message_type):
+        message = {'dest': connection.node_id or 0, 'from': self.node_id, 'type': message_type}
+        message.update(self._tree(exclude=connection))
+        self._write(connection, message)
+
+    def _on_node_sync(self, connection, message):
+        sender = message.get('from')
+        nodes, _ = tree_edges({'nodeId': sender, 'subs': message.get('subs') or []})
+        if sender == self.node_id or self.node_id in nodes:
+            # The same ID twice, or a loop back to us: painlessMesh closes such a link
+            self._note(connection.peer, f"Node {sender} reaches node {self.node_id} already; closing")
+            self._drop(connection)
+            return
+        first = connection.node_id is None
+        subs = message.get('subs') or []
+        root = bool(message.get('root'))
+        changed = first or subs != connection.subs or root != connection.root
+        connection.node_id = sender
+        connection.subs = subs
+        connection.root = root
+        connection.reachable = nodes
+        if message['type'] == NODE_SYNC_REQUEST:
+            self._send_node_sync(connection, NODE_SYNC_REPLY)
+        if first:
+            connection.synced.set()
+            if connection.station:
+                self._start_time_sync(connection)
+        if changed:
+            # What the other links see behind us has changed with it
+            for other in self.connections:
+                if other is not connection and other.node_id is not None:
+                    self._send_node_sync(other, NODE_SYNC_REQUEST)
+
+    def _time_message(self, message_type, destination, msg):
+        return {'dest': destination, 'from': self.node_id, 'type': message_type, 'msg': msg}
+
+    def _start_time_sync(self, connection):
+        # The smaller side adopts the larger side's time; a gateway on its own always does
+        ours = 1 + sum(len(other.reachable) for other in self.connections if other is not connection)
+        if ours <= len(connection.reachable):
+            msg = {'type': TIME_REQUEST, 't0': self.node_time()}
+        else:
+            msg = {'type': TIME_SYNC_REQUEST}
+        self._write(connection, self._time_message(TIME_SYNC, connection.node_id, msg))
+
+    def _on_time(self, connection, message, timestamp):
+        msg = message.get('msg') or {}
+        kind = msg.get('type')
+        sender = message.get('from')
+        if kind == TIME_SYNC_REQUEST:
+            self._write(connection, self._time_message(TIME_SYNC, sender, {'type': TIME_REQUEST, 't0': self.node_time()}))
+        elif kind == TIME_REQUEST:
+            reply = {'type': TIME_REPLY, 't0': msg.get('t0'), 't1': self.node_time(timestamp), 't2': self.node_time()}
+            target = connection if message['type'] == TIME_SYNC else self._route(sender)
+            if target is not None:
+                self._write(target, self._time_message(message['type'], sender, reply))
+        elif kind == TIME_REPLY:
+            t0, t1, t2, t3 = msg.get('t0'), msg.get('t1'), msg.get('t2'), self.node_time(timestamp)
+            if None in (t0, t1, t2):
+                return
+            if message['type'] == TIME_DELAY:
+                future = self.delay_waiters.pop(sender, None)
+                if future is not None and not future.done():
+                    future.set_result((wrap32(t3 - t0) - wrap32(t2 - t1)) / 2)
+                return
+            offset = (wrap32(t1 - t0) + wrap32(t2 - t3)) // 2
+            self.time_offset += offset
+            if abs(offset) > TIME_SYNC_ACCURACY:
+                self._write(connection, self._time_message(TIME_SYNC, sender, {'type': TIME_REQUEST, 't0': self.node_time()}))
+            else:
+                self._note(connection.peer, f"Time synced to node {sender} (last correction {offset} us)")
+                self.time_synced.set()
+
+    def _route(self, destination):
+        for connection in self.connections:
+            if destination in connection.reachable:
+                return connection
+        return None
+
+    def _forward(self, came_from, message):
+        if message.get('type') == BROADCAST:
+            for connection in self.connections:
+                if connection is not came_from and connection.node_id is not None:
+                    self._write(connection, message)
+            return
+        connection = self._route(message.get('dest'))
+        if connection is not None and connection is not came_from:
+            self._write(connection, message)
+
+    def _deliver(self, message, timestamp):
+        sender = message.get('from')
+        msg = message.get('msg')
+        if not isinstance(msg, str):
+            msg = to_json(msg)
+        for callback in self.listeners:
+            callback(sender, timestamp, msg)
+        if self.waiters:
+            remaining = []
+            for predicate, future in self.waiters:
+                if future.done():
+                    continue
+                if predicate(sender, msg):
+                    future.set_result((sender, timestamp, msg))
+                else:
+                    remaining.append((predicate, future))
+            self.waiters[:] = remaining
+        tracker = self.trackers.get(sender)
+        if tracker is not None:
+            tracker.record_text(msg, timestamp)
+        self.received(sender, timestamp, msg)
+
+    def received(self, sender, timestamp, msg):
+        # receivedCallback: nothing by default
+        pass
+
+    # Application
+
+    def nodes(self):
+        return set().union(*(connection.reachable for connection in self.connections))
+
+    def send_single(self, destination, msg):
+        # mesh.sendSingle(): False when no link leads to destination
+        connection = self._route(destination)
+        if connection is None:
+            return False
+        self._write(connection, {'dest': destination, 'from': self.node_id, 'type': SINGLE,
+                                 'msg': msg if isinstance(msg, str) else to_json(msg)})
+        return True
+
+    def send_broadcast(self, msg):
+        message = {'dest': 0, 'from': self.node_id, 'type': BROADCAST,
+                   'msg': msg if isinstance(msg, str) else to_json(msg)}
+        connections = [connection for connection in self.connections if connection.node_id is not None]
+        for connection in connections:
+            self._write(connection, message)
+        return bool(connections)
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    def expect(self, predicate, timeout=None):
+        # predicate(sender, msg); armed when expect() is called, like SerialEngine.expect
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((predicate, future))
+        return self._wait(future, timeout)
+
+    async def _wait(self, future, timeout):
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def track(self, sender, expected=None, interval=None):
+        # Sequence accounting for the message numbers sender sends us (e.g. a node's -t task aimed here)
+        tracker = SequenceTracker(expected, interval)
+        self.trackers[sender] = tracker
+        return tracker
+
+    async def node_delay(self, node, timeout=5.0):
+        # One-way trip time in us from painlessMesh's own TIME_DELAY exchange;
+        # no application code on the node is involved
+        connection = self._route(node)
+        if connection is None:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self.delay_waiters[node] = future
+        self._write(connection, self._time_message(TIME_DELAY, node, {'type': TIME_REQUEST, 't0': self.node_time()}))
+        try:
+            return await self._wait(future, timeout)
+        finally:
+            self.delay_waiters.pop(node, None)
+
+    async def latency_test(self, recipient, payload_length, timeout=5.0):
+        # performLatencyTest from the host: round-trip us to the node's
+        # latencyTestReflection, timed at the socket; None on timeout
+        if self._route(recipient) is None:
+            return None
+        payload = random_payload(payload_length)
+
+        def reflection(sender, msg):
+            if sender != recipient or 'latencyTestReflection' not in msg:
+                return False
+            try:
+                document = json.loads(msg)
+            except ValueError:
+                return False
+            return document.get('type') == 'latencyTestReflection' and document.get('payload') == payload
+
+        reply = self.expect(reflection, timeout)
+        start = time.perf_counter_ns()
+        self.send_single(recipient, {'type': 'latencyTest', 'payload': payload})
+        result = await reply
+        if result is None:
+            return None
+        return (result[1] - start) / 1000
+
+    async def throughput_test(self, recipient, payload, frequency, iterations, message_type='throughputTest'):
+        # throughputTestTask's open-loop schedule: message i is due (i - 1) /
+        # frequency s after the start and late ones go out back to back; only
+        # the socket's send buffer (drain) can hold it back. message_type=None
+        # sends the task's own untyped {"message_number", "payload"} documents.
+        connection = self._route(recipient)
+        if connection is None:
+            return None
+        start = time.perf_counter()
+        sent = 0
+        while sent < iterations:
+            due = min(iterations, int((time.perf_counter() - start) * frequency) + 1)
+            while sent < due:
+                sent += 1
+                document = {'message_number': sent, 'payload': payload}
+                if message_type is not None:
+                    document = {'type': message_type, **document}
+                self.send_single(recipient, document)
+            await connection.writer.drain()
+            await asyncio.sleep(max(0.0, start + sent / frequency - time.perf_counter()))
+        duration = time.perf_counter() - start
+        return {'sent': sent, 'duration': duration * 1000, 'frequency': sent / duration}
+
+class StandInNode(MeshNode):
+    # A flashed node as seen from the TCP side: accepts stations and answers
+    # latencyTest/throughputTest the way receivedCallback does, with
+    # processing_delay s before each reflection for the radio and the ESP32.
+    # Throughput test messages are accounted per sender in `throughput`.
+
+    def __init__(self, node_id=None, echo=False, processing_delay=0.0, **kwargs):
+        super().__init__(node_id, echo, **kwargs)
+        self.processing_delay = processing_delay
+        self.throughput = collections.defaultdict(SequenceTracker)
+
+    def received(self, sender, timestamp, msg):
+        try:
+            document = json.loads(msg)
+        except ValueError:
+            return
+        if not isinstance(document, dict):
+            return
+        message_type = document.get('type')
+        if message_type == 'latencyTest':
+            document['type'] = 'latencyTestReflection'
+            if self.processing_delay:
+                asyncio.get_running_loop().call_later(self.processing_delay, self.send_single, sender, document)
+            else:
+                self.send_single(sender, document)
+        elif message_type == 'throughputTest':
+            self.throughput[sender].record(document.get('message_number'), timestamp)
+
+async def run(host, port, targets, payload_length, latency_tests, frequency, iterations, timeout, stand_in, echo):
+    stand_ins = []
+    if stand_in:
+        # One stand-in AP with the other targets as further stand-ins behind it
+        for index, target in enumerate(targets):
+            node = StandInNode(target, processing_delay=0.002)
+            if index == 0:
+                await node.listen(port, host)
+            else:
+                await node.connect(host, port)
+            stand_ins.append(node)
+
+    gateway = MeshNode(echo=echo)
+    results = {}
+    try:
+        await gateway.connect(host, port, timeout)
+        await asyncio.sleep(0.5)  # Let node syncs settle
+        print(f"[{current_milli_time()}] Gateway {gateway.node_id} joined; mesh nodes: {sorted(gateway.nodes())}")
+        for target in targets:
+            delay = await gateway.node_delay(target, timeout)
+            latencies = []
+            for _ in range(latency_tests):
+                latency = await gateway.latency_test(target, payload_length, timeout)
+                if latency is not None:
+                    latencies.append(latency)
+            print(f"[{current_milli_time()}] Node {target}: TIME_DELAY "
+                  + (f"{delay:.0f} us" if delay is not None else "timed out")
+                  + f", {len(latencies)}/{latency_tests} latency tests answered")
+            if latencies:
+                print(f"  Round trip: {format_stats(summarize(latencies), 'us', 0)}")
+
+            payload = random_payload(payload_length)
+            sent = await gateway.throughput_test(target, payload, frequency, iterations)
+            if sent is None:
+                print(f"  No route to node {target}")
+                continue
+            print(f"  Sent {sent['sent']} throughput test messages in {sent['duration']:.0f} ms "
+                  f"({sent['frequency']:.1f} Hz)")
+            stand_in_node = next((node for node in stand_ins if node.node_id == target), None)
+            if stand_in_node is not None:
+                await asyncio.sleep(1.0)
+                summary = stand_in_node.throughput[gateway.node_id].summary()
+                print(f"  Stand-in received {summary['received']}, lost {summary['lost']} ({summary['loss_rate']:.2f}%)")
+            else:
+                print(f"  Receipt shows on node {target}'s serial console as 'Received throughput test message N'")
+            results[target] = {'node_delay': delay, 'latency': summarize(latencies), 'throughput': sent}
+    finally:
+        await gateway.close()
+        for node in stand_ins:
+            await node.close()
+    return results
+
+def main():
+    stand_in = True  # Run against local StandInNodes instead of a real mesh
+    targets = [480652657, 2385360021]
+    # With a real mesh: the AP of the node the host's WiFi is associated with
+    host = '127.0.0.1' if stand_in else mesh_ip(targets[0])
+    port = MESH_PORT
+    payload_length = 50
+    latency_tests = 20
+    frequency = 1000  # Hz; well past what the serial console can carry
+    iterations = 5000
+    timeout = 5.0
+    echo = False  # True prints every package in and out
+
+    try:
+        asyncio.run(run(host, port, targets, payload_length, latency_tests, frequency, iterations, timeout, stand_in, echo))
+    except KeyboardInterrupt:
+        print("Stopped by user.")
+
+if __name__ == "__main__":
+    main()
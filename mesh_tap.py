@@ -0,0 +1,256 @@
+import collections
+import json
+
+# painlessMesh package types
+TIME_DELAY = 3
+TIME_SYNC = 4
+NODE_SYNC_REQUEST = 5
+NODE_SYNC_REPLY = 6
+CONTROL = 7
+BROADCAST = 8
+SINGLE = 9
+
+def tree_edges(tree):
+    # {"nodeId":X,"subs":[{"nodeId":Y,"subs":[...]}, ...]} -> {(min, max), ...}
+    edges = set()
+    nodes = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        node_id = node.get('nodeId')
+        if node_id is None:
+            continue
+        nodes.add(node_id)
+        for sub in node.get('subs') or ():
+            sub_id = sub.get('nodeId')
+            if sub_id is not None:
+                edges.add((min(node_id, sub_id), max(node_id, sub_id)))
+                stack.append(sub)
+    return nodes, edges
+
+class TopologyGraph:
+    # The mesh as an adjacency map, folded together from subConnectionJson()
+    # trees as they arrive. Each source's latest tree is kept as an edge set
+    # and edges are reference-counted across sources, so an update costs the
+    # edges that changed, not the size of the mesh. `version` goes up only when
+    # the graph actually changes; hop distances are BFS'd once per source node
+    # per version and then looked up.
+
+    def __init__(self, on_change=None):
+        self.adjacency = collections.defaultdict(set)
+        self.edge_counts = collections.Counter()
+        self.sources = {}  # source -> edge set it last reported
+        self.roots = set()
+        self.version = 0
+        self.on_change = on_change
+        self.distance_cache = {}
+
+    def update(self, tree, source=None, complete=False):
+        # tree: parsed subConnectionJson(); source: who reported it (defaults to
+        # the tree's root); complete: the tree is the whole mesh, so edges only
+        # other sources reported are dropped. Returns True if the graph changed.
+        if isinstance(tree, str):
+            tree = json.loads(tree)
+        if isinstance(tree, list):
+            tree = {'nodeId': source, 'subs': tree}  # A node sync's subs list, seen from source
+        source = source if source is not None else tree.get('nodeId')
+        nodes, edges = tree_edges(tree)
+        self._find_roots(tree)
+        if complete:
+            for other in [other for other in self.sources if other != source]:
+                self._replace(other, set())
+                del self.sources[other]
+        changed = self._replace(source, edges)
+        for node in nodes:
+            if node not in self.adjacency:
+                self.adjacency[node]  # A lone node with no links is still in the mesh
+                changed = True
+        if complete:
+            for stale in [node for node in self.adjacency if node not in nodes and not self.adjacency[node]]:
+                del self.adjacency[stale]
+                changed = True
+        if changed:
+            self.version += 1
+            self.distance_cache = {}
+            if self.on_change is not None:
+                self.on_change(self)
+        return changed
+
+    def _find_roots(self, tree):
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if node.get('root'):
+                self.roots.add(node.get('nodeId'))
+            stack.extend(node.get('subs') or ())
+
+    def _replace(self, source, edges):
+        old = self.sources.get(source, set())
+        self.sources[source] = edges
+        changed = False
+        for a, b in edges - old:
+            self.edge_counts[(a, b)] += 1
+            if self.edge_counts[(a, b)] == 1:
+                self.adjacency[a].add(b)
+                self.adjacency[b].add(a)
+                changed = True
+        for a, b in old - edges:
+            self.edge_counts[(a, b)] -= 1
+            if self.edge_counts[(a, b)] == 0:
+                del self.edge_counts[(a, b)]
+                self.adjacency[a].discard(b)
+                self.adjacency[b].discard(a)
+                changed = True
+        return changed
+
+    def remove_node(self, node):
+        # A node dropped off (e.g. its connection closed): forget what it reported and its links
+        changed = self._replace(node, set()) if node in self.sources else False
+        self.sources.pop(node, None)
+        for source, edges in self.sources.items():
+            gone = {edge for edge in edges if node in edge}
+            if gone:
+                changed = self._replace(source, edges - gone) or changed
+        if node in self.adjacency:
+            del self.adjacency[node]
+            changed = True
+        if changed:
+            self.version += 1
+            self.distance_cache = {}
+            if self.on_change is not None:
+                self.on_change(self)
+        return changed
+
+    def nodes(self):
+        return set(self.adjacency)
+
+    def neighbours(self, node):
+        return self.adjacency.get(node, set())
+
+    def distances(self, node):
+        # {other: hops} for every node reachable from node, cached per version
+        cached = self.distance_cache.get(node)
+        if cached is not None:
+            return cached
+        distances = {node: 0}
+        frontier = [node]
+        while frontier:
+            next_frontier = []
+            for current in frontier:
+                hops = distances[current] + 1
+                for neighbour in self.adjacency.get(current, ()):
+                    if neighbour not in distances:
+                        distances[neighbour] = hops
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        self.distance_cache[node] = distances
+        return distances
+
+    def hops(self, a, b):
+        # None when b is not reachable from a
+        return self.distances(a).get(b)
+
+class TapSubscription:
+    def __init__(self, tap, nodes, senders, recipients, types, callback):
+        self.tap = tap
+        self.nodes = tuple(nodes)
+        self.senders = tuple(senders)
+        self.recipients = tuple(recipients)
+        self.types = tuple(types)
+        self.callback = callback
+
+    def close(self):
+        self.tap.unsubscribe(self)
+
+class MeshTap:
+    # Indexes tapped painlessMesh messages by their from/dest/type fields.
+    # Subscriptions are tables keyed on those values (like EventRouter's
+    # prefix tables), so routing a message is five dict lookups however many
+    # filters there are, and never looks inside the payload. The last
+    # `history` messages per node and per type are kept for lookups; node sync
+    # packages are folded into `topology` as they pass.
+
+    def __init__(self, history=1000, topology=None):
+        self.history = history
+        self.topology = topology if topology is not None else TopologyGraph()
+        self.by_node = collections.defaultdict(lambda: collections.deque(maxlen=history))
+        self.by_type = collections.defaultdict(lambda: collections.deque(maxlen=history))
+        self.counts = collections.Counter()  # (from, dest, type) -> messages seen
+        self.subscriptions = []
+        self.routes = ({}, {}, {}, {}, ())  # by node, by from, by dest, by type, match-all
+
+    def subscribe(self, callback, nodes=(), senders=(), recipients=(), types=()):
+        # callback(peer, timestamp, message) for messages from or to any of
+        # `nodes`, from any of `senders`, to any of `recipients`, or of any of
+        # `types`; with no filters, for every message
+        subscription = TapSubscription(self, nodes, senders, recipients, types, callback)
+        self.subscriptions.append(subscription)
+        self._rebuild()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+            self._rebuild()
+
+    def _rebuild(self):
+        tables = ({}, {}, {}, {})
+        everything = []
+        for subscription in self.subscriptions:
+            keys = (subscription.nodes, subscription.senders, subscription.recipients, subscription.types)
+            if not any(keys):
+                everything.append(subscription)
+            for table, values in zip(tables, keys):
+                for value in values:
+                    table.setdefault(value, []).append(subscription)
+        # Swapped in whole, so add() never sees a half-built table
+        self.routes = tuple({key: tuple(subscriptions) for key, subscriptions in table.items()}
+                            for table in tables) + (tuple(everything),)
+
+    def add(self, peer, timestamp, message):
+        if not isinstance(message, dict):
+            return
+        sender = message.get('from')
+        recipient = message.get('dest')
+        message_type = message.get('type')
+        event = (peer, timestamp, message)
+        self.counts[(sender, recipient, message_type)] += 1
+        if sender is not None:
+            self.by_node[sender].append(event)
+        if recipient is not None and recipient != sender:
+            self.by_node[recipient].append(event)
+        self.by_type[message_type].append(event)
+
+        if message_type in (NODE_SYNC_REQUEST, NODE_SYNC_REPLY) and sender is not None:
+            # The sender's view of the mesh behind it, rooted at the sender.
+            # Node syncs only travel over direct links, so sender and dest are neighbours.
+            subs = list(message.get('subs') or [])
+            if recipient:
+                subs.append({'nodeId': recipient, 'subs': []})
+            self.topology.update({'nodeId': sender, 'root': message.get('root', False), 'subs': subs}, source=sender)
+
+        by_node, by_from, by_dest, by_type, everything = self.routes
+        matched = everything
+        for table, key in ((by_node, sender), (by_node, recipient), (by_from, sender),
+                           (by_dest, recipient), (by_type, message_type)):
+            subscriptions = table.get(key)
+            if subscriptions:
+                matched = matched + subscriptions
+        if len(matched) > 1:
+            matched = dict.fromkeys(matched)  # Once each, even if several filters match
+        for subscription in matched:
+            subscription.callback(peer, timestamp, message)
+
+    def messages(self, node=None, message_type=None):
+        # Recent messages from or to node and/or of a type, oldest first
+        if node is not None:
+            events = self.by_node.get(node, ())
+            if message_type is not None:
+                return [event for event in events if event[2].get('type') == message_type]
+            return list(events)
+        if message_type is not None:
+            return list(self.by_type.get(message_type, ()))
+        return []
+
+    def hops(self, a, b):
+        return self.topology.hops(a, b)
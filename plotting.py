@@ -0,0 +1,389 @@
+import atexit
+import multiprocessing
+import numpy as np
+
+# Rendering cost grows with artists, not data: above these sizes series are
+# binned and per-cell labels are dropped
+MAX_BARS = 1000
+MAX_POINTS = 5000
+MAX_ANNOTATED_CELLS = 200
+DPI = 150
+
+_worker = None
+_jobs = None
+
+def submit(plot, *args):
+    # Queues plot(*args) for a background render process, started on first use,
+    # so the caller never waits on matplotlib. The process is spawned rather
+    # than forked: it inherits no serial ports or reader threads and behaves the
+    # same on Windows and POSIX.
+    global _worker, _jobs
+    if _worker is None:
+        context = multiprocessing.get_context('spawn')
+        _jobs = context.Queue()
+        _worker = context.Process(target=_serve, args=(_jobs,))
+        _worker.start()
+        atexit.register(wait)
+    _jobs.put((plot.__name__, args))
+
+def wait():
+    # Blocks until every submitted plot has been written
+    global _worker
+    if _worker is None:
+        return
+    _jobs.put(None)
+    _worker.join()
+    _worker = None
+
+def _serve(jobs):
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        name, args = job
+        try:
+            globals()[name](*args)
+        except Exception as e:
+            print(f"Error while rendering {name}: {e}")
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def _save(plt, path):
+    plt.savefig(path, dpi=DPI, bbox_inches='tight')
+    plt.close('all')
+    print(f"Plot saved as '{path}'")
+
+def bin_series(values, max_points):
+    # Averages consecutive values into at most max_points bins; returns the
+    # bin centres (in original index units) and the binned values
+    values = np.asarray(values, dtype=np.float64)
+    if values.size <= max_points:
+        return np.arange(values.size, dtype=np.float64), values
+    edges = np.linspace(0, values.size, max_points + 1).astype(np.int64)
+    sums = np.add.reduceat(values, edges[:-1])
+    counts = np.diff(edges)
+    return (edges[:-1] + edges[1:] - 1) / 2, sums / counts
+
+def decimate_xy(x, y, max_points):
+    # Keeps every n-th point of a long line, always including the last one
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if x.size <= max_points:
+        return x, y
+    index = np.unique(np.r_[np.linspace(0, x.size - 1, max_points).astype(np.int64), x.size - 1])
+    return x[index], y[index]
+
+def _length_ticks(counts):
+    # Centre of each length's run of bars, from cumulative counts
+    counts = np.asarray(counts)
+    starts = np.cumsum(counts) - counts
+    return starts + (counts - 1) / 2, starts
+
+def text_summary(path, summary, lines=None):
+    plt = _pyplot()
+    plt.figure(figsize=(10, max(2, (lines or summary.count('\n')) * 0.18)))
+    plt.text(0.05, 0.95, summary, verticalalignment='top', horizontalalignment='left',
+             transform=plt.gca().transAxes, fontsize=10, family='monospace')
+    plt.axis('off')
+    plt.tight_layout()
+    _save(plt, path)
+
+def latency_statistics(path, lengths, latencies, stats):
+    # latencies: per length list of one-way latencies; stats: per length summarize() output
+    plt = _pyplot()
+    plt.figure(figsize=(20, 10))
+    counts = [len(values) for values in latencies]
+    colors = ['b', 'g', 'r', 'c', 'm']
+    labels = ['Individual Tests', 'Min', 'Median', 'Avg', 'Max']
+
+    positions, heights = bin_series(np.concatenate([np.asarray(values, dtype=np.float64) for values in latencies]), MAX_BARS)
+    binned = len(heights) < sum(counts)
+    plt.bar(positions, heights, 0.8 * sum(counts) / len(heights), color=colors[0], alpha=0.6,
+            label=f'{labels[0]} (binned)' if binned else labels[0])
+
+    # Per-length statistics as steps spanning that length's bars
+    tick_positions, starts = _length_ticks(counts)
+    edges = np.r_[starts, sum(counts)] - 0.5
+    for i, stat in enumerate(['min', 'p50', 'mean', 'max']):
+        values = [stats[length][stat] for length in lengths]
+        plt.stairs(values, edges, color=colors[i + 1], linewidth=2, label=f'{labels[i + 1]} Latency')
+
+    plt.ylabel('Time (ms)')
+    plt.title('One-way Latency, Incremental Payload Length')
+    plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    plt.grid(True)
+    step = max(1, len(lengths) // 20)
+    plt.xticks(tick_positions[::step], list(lengths)[::step])
+    plt.xlabel('Payload Length (bytes)')
+    _save(plt, path)
+
+def latency_components(path, lengths, components, averages):
+    # components: {component: per length list of values}; averages: {component or 'total_latency': per length average}
+    plt = _pyplot()
+    plt.figure(figsize=(20, 10))
+    names = ['encryption_time', 'air_time', 'decryption_time']
+    colors = ['r', 'g', 'b']
+    labels = ['Encryption', 'Transmission', 'Decryption']
+    counts = [len(values) for values in components[names[0]]]
+    total_bars = sum(counts)
+
+    bottom = None
+    for i, name in enumerate(names):
+        heights = np.concatenate([np.asarray(values, dtype=np.float64) for values in components[name]])
+        positions, heights = bin_series(heights, MAX_BARS)
+        if bottom is None:
+            bottom = np.zeros(len(heights))
+        width = 0.8 * total_bars / len(heights)
+        plt.bar(positions, heights, width, bottom=bottom, color=colors[i], alpha=0.6, label=labels[i])
+        bottom = bottom + heights
+
+    tick_positions, starts = _length_ticks(counts)
+    edges = np.r_[starts, total_bars] - 0.5
+    for i, name in enumerate(names):
+        plt.stairs(averages[name], edges, color=colors[i], linewidth=2, label=f'Avg {labels[i]}')
+    plt.stairs(averages['total_latency'], edges, color='k', linewidth=2, label='Avg Total Latency')
+
+    plt.ylabel('Time (ms)')
+    plt.title('Latency Components for All Experiments')
+    plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    plt.grid(True)
+    step = max(1, len(lengths) // 30)
+    plt.xticks(tick_positions[::step], list(lengths)[::step])
+    plt.xlabel('Message Length')
+
+    # Experiment numbers on a second axis, thinned to a readable number of ticks
+    ax2 = plt.twiny()
+    ax2.set_xlim(plt.gca().get_xlim())
+    experiment_ticks = np.arange(0, total_bars, max(1, total_bars // 40))
+    ax2.set_xticks(experiment_ticks)
+    ax2.set_xticklabels(experiment_ticks + 1)
+    ax2.set_xlabel('Experiment Number')
+    _save(plt, path)
+
+def latency_series(path, payload_length, encryption_times, air_times, decryption_times, avg_total_latency, summary):
+    plt = _pyplot()
+    plt.figure(figsize=(12, 6))
+    iteration_count = len(encryption_times)
+    x, encryption = bin_series(encryption_times, MAX_BARS)
+    _, air = bin_series(air_times, MAX_BARS)
+    _, decryption = bin_series(decryption_times, MAX_BARS)
+    x = x + 1
+    width = 0.8 * iteration_count / max(1, len(x))
+    plt.bar(x, encryption, width, label='Encryption', color='r', alpha=0.7)
+    plt.bar(x, air, width, bottom=encryption, label='Transmission time', color='g', alpha=0.7)
+    plt.bar(x, decryption, width, bottom=encryption + air, label='Decryption', color='b', alpha=0.7)
+
+    plt.title('Latency Components, message length = ' + str(payload_length))
+    plt.xlabel('Iteration')
+    plt.ylabel('Time (ms)')
+    plt.legend()
+    plt.grid(True)
+    plt.axhline(y=avg_total_latency, color='k', linestyle='--', label=f'Avg Total: {avg_total_latency:.2f} ms')
+    plt.annotate(summary, xy=(-0.1, 1.1), xycoords='axes fraction',
+                 verticalalignment='top', horizontalalignment='left',
+                 bbox=dict(boxstyle='round', facecolor='white', alpha=0.8))
+    _save(plt, path)
+
+def encryption_times(path, lengths, encryption, decryption, stats):
+    # encryption/decryption: per length lists of times; stats: {'encryption': {length: ...}, 'decryption': ...}
+    plt = _pyplot()
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
+    colors = ['lightblue', 'lightgreen']
+    y_max = max(max(max(values) for values in encryption), max(max(values) for values in decryption)) * 1.1
+    counts = [len(values) for values in encryption]
+    tick_positions, starts = _length_ticks(counts)
+
+    for idx, (ax, operation, times) in enumerate([(ax1, 'encryption', encryption), (ax2, 'decryption', decryption)]):
+        positions, heights = bin_series(np.concatenate([np.asarray(values, dtype=np.float64) for values in times]), MAX_BARS)
+        ax.bar(positions, heights, 0.35 * sum(counts) / len(heights), color=colors[idx], alpha=1)
+
+        for start in starts[1:]:
+            ax.axvline(x=start - 0.5, color='gray', linestyle='--', alpha=0.5)
+
+        medians = [stats[operation][length]['p50'] for length in lengths]
+        averages = [stats[operation][length]['mean'] for length in lengths]
+        median_line, = ax.plot(tick_positions, medians, 'ro-', linewidth=2, label='Median')
+        avg_line, = ax.plot(tick_positions, averages, 'go-', linewidth=2, label='Average')
+
+        if len(lengths) <= MAX_ANNOTATED_CELLS // 4:
+            for x, y_med, y_avg in zip(tick_positions, medians, averages):
+                ax.annotate(f'{y_med:.2f}', (x, y_med), xytext=(5, 5), textcoords='offset points',
+                            ha='left', va='center', color=median_line.get_color())
+                ax.annotate(f'{y_avg:.2f}', (x, y_avg), xytext=(-5, -5), textcoords='offset points',
+                            ha='right', va='center', color=avg_line.get_color())
+
+        ax.set_xlabel('Plaintext Length (bytes)')
+        ax.set_ylabel('Time (ms)')
+        ax.set_title(f'{operation.capitalize()} Test versus Plaintext Length')
+        ax.legend()
+        ax.set_xticks(tick_positions)
+        ax.set_xticklabels(lengths)
+        ax.set_ylim(0, y_max)
+
+    plt.tight_layout()
+    _save(plt, path)
+
+def throughput(path, frequencies, values, stats, payload_length):
+    plt = _pyplot()
+    plt.figure(figsize=(12, 8))
+    plt.plot(frequencies, values, 'bo-', label='Throughput')
+    plt.xlabel('Frequency (messages/second)')
+    plt.ylabel('Throughput (messages/second)')
+    plt.title(f'Throughput vs Frequency (Message Length: {payload_length} bytes)')
+    plt.grid(True)
+    for stat, value in stats.items():
+        plt.axhline(y=value, color='blue', linestyle='--', alpha=0.5)
+        plt.text(frequencies[-1] * 1.02, value, f'{stat.capitalize()}: {value:.2f}',
+                 color='blue', verticalalignment='center')
+    plt.tight_layout()
+    _save(plt, path)
+
+def throughput_heatmap(path, frequencies, payload_lengths, data, measured=None, frontier=None):
+    # data: frequencies x payload_lengths array of throughput, NaN where a cell was not run.
+    # measured: optional boolean mask of the cells actually run when the rest
+    # were interpolated; frontier: per payload length, the row index of the
+    # first saturated frequency
+    plt = _pyplot()
+    data = np.asarray(data, dtype=np.float64)
+    plt.figure(figsize=(20, 12))
+    im = plt.imshow(data, cmap='viridis', aspect='auto', origin='lower')
+    plt.colorbar(im, label='Throughput (messages/second)')
+
+    if data.size <= MAX_ANNOTATED_CELLS:
+        threshold = np.nanmean(data)
+        for i, j in zip(*np.nonzero(~np.isnan(data))):
+            value = data[i, j]
+            color = 'white' if value < threshold else 'black'
+            style = 'normal' if measured is None or measured[i, j] else 'italic'
+            plt.text(j, i, f'{value:.2f}', ha='center', va='center', color=color, fontsize=8, style=style)
+
+    title = 'Mesh Network Throughput'
+    if measured is not None:
+        rows, columns = np.nonzero(measured)
+        plt.scatter(columns, rows - 0.35, s=6, c='red', marker='^', label='Measured')
+        title += f' ({int(measured.sum())} of {measured.size} cells measured, rest interpolated)'
+    if frontier is not None:
+        plt.stairs(np.asarray(frontier, dtype=np.float64) - 0.5, np.arange(len(frontier) + 1) - 0.5,
+                   baseline=None, color='red', linewidth=2, label='Saturation frontier')
+    if measured is not None or frontier is not None:
+        plt.legend(loc='upper left', bbox_to_anchor=(1.15, 1))
+
+    plt.xlabel('Message Length (bytes)')
+    plt.ylabel('Frequency (messages/second)')
+    plt.title(title)
+    plt.xticks(range(len(payload_lengths)), payload_lengths)
+    step = max(1, len(frequencies) // 20)
+    plt.yticks(range(0, len(frequencies), step), frequencies[::step])
+    _save(plt, path)
+
+def packet_loss(path, packets_sent, loss_rates):
+    plt = _pyplot()
+    packets_sent, loss_rates = decimate_xy(packets_sent, loss_rates, MAX_POINTS)
+    plt.figure(figsize=(12, 6))
+    plt.plot(packets_sent, loss_rates)
+    plt.xlabel('Packets Sent')
+    plt.ylabel('Packet Loss Rate (%)')
+    plt.title('Packet Loss Rate Over Time')
+    plt.grid(True)
+    _save(plt, path)
+
+def dashboard(path, history, window):
+    # history: LiveDashboard snapshots, oldest first; redrawn whole each time,
+    # which stays cheap because the history is bounded
+    plt = _pyplot()
+    elapsed = np.array([snapshot['elapsed'] for snapshot in history])
+    fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(12, 10), sharex=True)
+
+    ax1.plot(elapsed, [snapshot['loss_rate'] for snapshot in history], 'r-')
+    ax1.set_ylabel('Packet Loss Rate (%)')
+    ax1.set_title(f'Rolling {window:g} s Window')
+    ax1.grid(True)
+
+    for name, color in (('p50', 'g'), ('p90', 'b'), ('p99', 'm')):
+        values = [np.nan if snapshot[name] is None else snapshot[name] for snapshot in history]
+        ax2.plot(elapsed, values, color=color, label=name)
+    ax2.set_ylabel('Latency (ms)')
+    ax2.legend(loc='upper left')
+    ax2.grid(True)
+
+    ports = sorted({port for snapshot in history for port in snapshot['line_rates']})
+    for port in ports:
+        ax3.plot(elapsed, [snapshot['line_rates'].get(port, 0.0) for snapshot in history], label=port)
+    ax3.set_ylabel('Lines per Second')
+    ax3.set_xlabel('Elapsed Time (s)')
+    if ports:
+        ax3.legend(loc='upper left')
+    ax3.grid(True)
+
+    plt.tight_layout()
+    _save(plt, path)
+
+def load_curve(path, offered, goodput, loss, p50, p99, knee=None):
+    # One point per ramp step; knee is the offered rate to mark, if one was found
+    plt = _pyplot()
+    fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(12, 12), sharex=True)
+
+    ax1.plot(offered, goodput, 'bo-', label='Goodput')
+    ax1.plot(offered, offered, 'k--', alpha=0.5, label='Offered')
+    ax1.set_ylabel('Messages per Second')
+    ax1.set_title('Goodput, Loss and Latency vs Offered Load')
+    ax1.legend(loc='upper left')
+    ax1.grid(True)
+
+    ax2.plot(offered, loss, 'ro-')
+    ax2.set_ylabel('Packet Loss Rate (%)')
+    ax2.grid(True)
+
+    for values, color, label in ((p50, 'g', 'p50'), (p99, 'm', 'p99')):
+        ax3.plot(offered, [np.nan if value is None else value for value in values], f'{color}o-', label=label)
+    ax3.set_ylabel('One-way Latency (ms)')
+    ax3.set_xlabel('Offered Load (messages/second)')
+    ax3.legend(loc='upper left')
+    ax3.grid(True)
+
+    if knee is not None:
+        for ax in (ax1, ax2, ax3):
+            ax.axvline(knee, color='orange', linestyle=':', label='Knee')
+        ax1.text(knee, ax1.get_ylim()[1], f' Knee: {knee:.2f}', color='orange', va='top')
+
+    plt.tight_layout()
+    _save(plt, path)
+
+def latency_by_hops(path, hops, latencies, loss):
+    # latencies: per hop count list of one-way latencies; loss: per hop count loss rate in %
+    plt = _pyplot()
+    fig, ax1 = plt.subplots(figsize=(12, 8))
+    measured = [i for i, values in enumerate(latencies) if len(values)]
+    ax1.boxplot([latencies[i] for i in measured], positions=[hops[i] for i in measured], widths=0.5)
+    ax1.set_xlabel('Hops')
+    ax1.set_ylabel('One-way Latency (ms)')
+    ax1.set_title('Latency and Loss by Hop Distance')
+    ax1.grid(True)
+
+    ax2 = ax1.twinx()
+    ax2.plot(hops, loss, 'ro--', label='Packet Loss')
+    ax2.set_ylabel('Packet Loss Rate (%)')
+    ax2.set_ylim(bottom=0)
+    ax2.legend(loc='upper left')
+    ax1.set_xticks(hops)
+    ax1.set_xticklabels([str(h) for h in hops])
+
+    plt.tight_layout()
+    _save(plt, path)
+
+def board_comparison(path, lengths, means):
+    # means: {board: per length mean time}, one line per board
+    plt = _pyplot()
+    plt.figure(figsize=(12, 8))
+    for board, values in sorted(means.items()):
+        plt.plot(lengths, values, 'o-', label=board)
+    plt.xlabel('Plaintext Length (bytes)')
+    plt.ylabel('Mean Encryption Time (ms)')
+    plt.title('Encryption Time by Board')
+    plt.legend()
+    plt.grid(True)
+    _save(plt, path)
@@ -2,95 +2,82 @@ import serial
 import time
 import random
 import string
-import matplotlib.pyplot as plt
+import plotting
 import threading
-import queue
-from datetime import datetime, timedelta
-
-def current_milli_time():
-    return datetime.now().strftime('%H:%M:%S.%f')[:-3]
+from datetime import datetime
+from serial_reader import current_milli_time, format_timestamp, read_from_port
+from event_router import Deadline, EventRouter
+from firmware_events import RECEIVED
+from inflight import DUPLICATE, LATE, MATCHED, InFlightTracker
+from live_dashboard import LiveDashboard
 
 def generate_payload(length):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
-def read_from_port(ser, message_queue, stop_event):
-    while not stop_event.is_set():
-        if ser.in_waiting:
-            response = ser.readline().decode().strip()
-            timestamp = current_milli_time()
-            if "msg=" in response:
-                print(f"[{timestamp}][{ser.port} IN] {response}")
-                message_queue.put((ser.port, timestamp, response))
-            elif ser.port in response:  # This will catch the outgoing messages
-                print(f"[{timestamp}][{ser.port} OUT] {response}")
-
 def send_packet(sender, receiver, payload):
     command = f"hirg -r {receiver['node_id']} -p {payload}\n"
     timestamp = current_milli_time()
     print(f"[{timestamp}][{sender['port']} OUT] {command.strip()}")
     sender['serial'].write(command.encode())
 
-def packet_loss_test(sender, receiver, message_queue, results, stop_event):
+def packet_loss_test(sender, receiver, router, results, stop_event, send_rate=1.0, response_timeout=5.0, dashboard=None):
     payload_length = 20
-    packets_sent = 0
-    packets_received = 0
-    sent_payloads = []
-    send_interval = 1.0  # 1 second between sends
+    send_interval = 1.0 / send_rate
+    tracker = InFlightTracker(response_timeout)
+    subscription = router.subscribe(receiver['port'], kinds=RECEIVED)
 
+    next_send_time = time.perf_counter()
     while not stop_event.is_set():
         payload = generate_payload(payload_length)
         send_packet(sender, receiver, payload)
-        sent_payloads.append(payload)
-        packets_sent += 1
+        tracker.add(payload)
+        if dashboard is not None:
+            dashboard.record_sent()
         print(f"[{current_milli_time()}] Packet sent: {payload}")
 
-        start_time = time.time()
-        while time.time() - start_time < send_interval:
-            try:
-                port, timestamp, message = message_queue.get(timeout=0.1)
-                if port == receiver['port'] and "msg=" in message:
-                    received_payload = message.split("msg=")[1].strip()
-                    if received_payload in sent_payloads:
-                        packets_received += 1
-                        sent_payloads.remove(received_payload)
-                        print(f"[{timestamp}] Packet received successfully: {received_payload}")
-                    else:
-                        print(f"[{timestamp}] Received unexpected payload: {received_payload}")
-            except queue.Empty:
-                continue
-
-        # Check for lost packets
-        while len(sent_payloads) > 5:  # Allow for some delay, but not too much
-            lost_payload = sent_payloads.pop(0)
+        # Match replies until the next send is due
+        next_send_time += send_interval
+        for event in subscription.until(Deadline(next_send_time - time.perf_counter())):
+            status, latency = tracker.match(event.payload, event.timestamp)
+            timestamp = format_timestamp(event.timestamp)
+            if dashboard is not None and status == MATCHED:
+                dashboard.record_received(latency / 1_000_000, event.timestamp)
+            if status == MATCHED:
+                print(f"[{timestamp}] Packet received successfully after {latency / 1_000_000:.2f} ms: {event.payload}")
+            elif status == LATE:
+                print(f"[{timestamp}] Packet received after being declared lost ({latency / 1_000_000:.2f} ms): {event.payload}")
+            elif status == DUPLICATE:
+                print(f"[{timestamp}] Duplicate packet received: {event.payload}")
+            else:
+                print(f"[{timestamp}] Received unexpected payload: {event.payload}")
+
+        for lost_payload in tracker.expire():
             print(f"[{current_milli_time()}] Packet lost: {lost_payload}")
+            if dashboard is not None:
+                dashboard.record_lost()
 
-        loss_rate = (packets_sent - packets_received) / packets_sent * 100
-        results.append((packets_sent, loss_rate))
+        results.append((tracker.sent, tracker.loss_rate()))
 
-        # Wait for the remainder of the send interval
-        time.sleep(max(0, send_interval - (time.time() - start_time)))
+    subscription.close()
+    print(f"Sent: {tracker.sent}, Received: {tracker.received}, Lost: {tracker.lost}, "
+          f"Late: {tracker.late}, Duplicates: {tracker.duplicates}, Unexpected: {tracker.unexpected}, "
+          f"In flight: {len(tracker)}")
 
 def plot_results(results):
     packets_sent, loss_rates = zip(*results)
 
-    plt.figure(figsize=(12, 6))
-    plt.plot(packets_sent, loss_rates)
-    plt.xlabel('Packets Sent')
-    plt.ylabel('Packet Loss Rate (%)')
-    plt.title('Packet Loss Rate Over Time')
-    plt.grid(True)
-
     filename = datetime.now().strftime('%Y%m%d_%H%M%S_packet_loss.png')
-    plt.savefig(filename, dpi=300, bbox_inches='tight')
-    plt.show()
-
-    print(f"Plot saved as '{filename}'")
+    plotting.submit(plotting.packet_loss, filename, packets_sent, loss_rates)
+    print(f"Rendering '{filename}' in the background")
 
 def main():
     nodes = [
         {'port': 'COM5', 'node_id': 480652657},
         {'port': 'COM13', 'node_id': 853210837}
     ]
+    send_rate = 1.0  # Packets per second
+    response_timeout = 5.0  # Seconds before an unanswered packet counts as lost
+    dashboard_window = 60.0  # Seconds of history behind the live loss/latency/line rate figures
 
     for node in nodes:
         node['serial'] = serial.Serial(node['port'], 115200, timeout=1)
@@ -100,17 +87,22 @@ def main():
     for node in nodes:
         print(f"[{timestamp}] Port: {node['port']}, Node ID: {node['node_id']}")
 
-    message_queue = queue.Queue()
+    router = EventRouter()
     stop_event = threading.Event()
 
     threads = []
     for node in nodes:
-        thread = threading.Thread(target=read_from_port, args=(node['serial'], message_queue, stop_event))
+        thread = threading.Thread(target=read_from_port, args=(node['serial'], router, stop_event))
         thread.start()
         threads.append(thread)
 
+    dashboard = LiveDashboard(dashboard_window, filename=datetime.now().strftime('%Y%m%d_%H%M%S_packet_loss_live.png'))
+    # Every line, so the line rate is each port's whole serial load; the test itself subscribes to RECEIVED only
+    router.subscribe([node['port'] for node in nodes], callback=dashboard.line_callback)
+    dashboard.start()
+
     results = []
-    test_thread = threading.Thread(target=packet_loss_test, args=(nodes[0], nodes[1], message_queue, results, stop_event))
+    test_thread = threading.Thread(target=packet_loss_test, args=(nodes[0], nodes[1], router, results, stop_event, send_rate, response_timeout, dashboard))
     test_thread.start()
 
     print("Press Enter to stop the test and plot results...")
@@ -120,6 +112,7 @@ def main():
     for thread in threads:
         thread.join()
     test_thread.join()
+    dashboard.stop()
 
     for node in nodes:
         node['serial'].close()
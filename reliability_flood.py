@@ -1,107 +1,272 @@
 import serial
 import time
+import random
+import string
 import threading
-import queue
 from datetime import datetime
-import matplotlib.pyplot as plt
+from serial_reader import current_milli_time, read_from_port
+from log_sink import LogSink, LINES
+from event_router import Deadline, EventRouter
+from firmware_events import ROUND_TRIP, RECEIVED, THROUGHPUT_SENT, THROUGHPUT_DONE, THROUGHPUT_FREQUENCY
+from live_dashboard import LiveDashboard
+from stats import summarize
+from sequence_tracker import message_number
+import plotting
 import keyboard
 
-def current_milli_time():
-    return datetime.now().strftime('%H:%M:%S.%f')[:-3]
-
-def read_from_port(ser, message_queue, stop_event):
-    while not stop_event.is_set():
-        if ser.in_waiting:
-            response = ser.readline().decode().strip()
-            timestamp = current_milli_time()
-            print(f"[{timestamp}][{ser.port} IN] {response}")
-            message_queue.put((ser.port, timestamp, response))
-
-def send_packet(ser, node_id, length):
+def send_packet(ser, node_id, length, log=None):
     command = f"hirg -r {node_id} -l {length}\n"
     timestamp = current_milli_time()
-    print(f"[{timestamp}][{ser.port} OUT] {command.strip()}")
+    if log is not None:
+        log.command(ser.port, command)
+    else:
+        print(f"[{timestamp}][{ser.port} OUT] {command.strip()}")
     ser.write(command.encode())
 
-def packet_loss_test(ser, node_id, length, message_queue, results, stop_event):
+def packet_loss_test(ser, node_id, length, router, results, stop_event, dashboard=None, log=None):
+    subscription = router.subscribe(ser.port, kinds=ROUND_TRIP)
     packets_sent = 0
     packets_received = 0
 
     while not stop_event.is_set():
-        send_packet(ser, node_id, length)
+        send_packet(ser, node_id, length, log)
         packets_sent += 1
+        if dashboard is not None:
+            dashboard.record_sent()
 
-        start_time = time.time()
+        start_time = time.perf_counter()
         response_found = False
 
-        while time.time() - start_time < 0.1:  # 100ms timeout
-            try:
-                _, _, message = message_queue.get(timeout=0.01)
-                if "Round-trip latency /us:" in message:
-                    packets_received += 1
-                    response_found = True
-                    break
-            except queue.Empty:
-                continue
+        for event in subscription.until(Deadline(0.1)):  # 100ms timeout
+            if event.kind == ROUND_TRIP:
+                packets_received += 1
+                response_found = True
+                if dashboard is not None:
+                    dashboard.record_received(event.value / 1000, event.timestamp)  # Round trip in ms
+                break
+        if not response_found and dashboard is not None:
+            dashboard.record_lost()
 
         loss_rate = (packets_sent - packets_received) / packets_sent * 100
         results.append((packets_sent, loss_rate))
 
-        time.sleep(max(0, 0.1 - (time.time() - start_time)))  # Ensure 10Hz sending rate
+        time.sleep(max(0, 0.1 - (time.perf_counter() - start_time)))  # Ensure 10Hz sending rate
+
+    subscription.close()
+
+def ramp_rates(start_rate, max_rate, rate_step, geometric=False):
+    # Offered rates in whole Hz, as the throughput task takes them; a
+    # geometric ramp multiplies by rate_step, a linear one adds it
+    rates = []
+    rate = start_rate
+    while rate <= max_rate:
+        if not rates or round(rate) > rates[-1]:
+            rates.append(round(rate))
+        rate = rate * rate_step if geometric else rate + rate_step
+    return rates
+
+def flood_step(sender, receiver, payload, rate, duration, router, drain=2.0, timeout=30, dashboard=None, log=None):
+    # One open-loop step: the sender's throughput task sends on its own clock
+    # (next_send_time += 1000 / rate ms) whatever comes back, so the offered
+    # load does not back off when the mesh slows down the way a probe-and-wait
+    # loop does. The host only watches both serial ports.
+    iterations = max(1, round(rate * duration))
+    command = f"hirg -r {receiver['node_id']} -p {payload} -t {rate} -i {iterations}\n"
+    if log is not None:
+        log.command(sender['port'], command)
+    else:
+        print(f"[{current_milli_time()}][{sender['port']} OUT] {command.strip()}")
+
+    sent_at = {}      # message_number -> when the sender reported it sent
+    received_at = {}  # message_number -> when the receiver printed it
+    test_ms = None
+
+    def record_received(event):
+        number = message_number(event.payload)
+        if number is not None and number not in received_at:
+            received_at[number] = event.timestamp
+
+    actual_frequency = None
+    with router.subscribe([sender['port'], receiver['port']],
+                          kinds=(THROUGHPUT_SENT, THROUGHPUT_DONE, THROUGHPUT_FREQUENCY, RECEIVED)) as subscription:
+        sender['serial'].write(command.encode())
+        deadline = Deadline(iterations / rate * 2 + timeout)
+        for event in subscription.until(deadline):
+            if event.port == sender['port']:
+                if event.kind == THROUGHPUT_SENT:
+                    sent_at[event.number] = event.timestamp
+                    if dashboard is not None:
+                        dashboard.record_sent(event.timestamp)
+                elif event.kind == THROUGHPUT_DONE:
+                    test_ms = event.value
+                elif event.kind == THROUGHPUT_FREQUENCY:
+                    actual_frequency = event.value
+                    # Sending is over; stragglers get `drain` more seconds
+                    deadline = Deadline(drain)
+                    break
+            elif event.kind == RECEIVED:
+                record_received(event)
+        for event in subscription.until(deadline):
+            if event.port == receiver['port'] and event.kind == RECEIVED:
+                record_received(event)
+
+    # Both ends are stamped by the host clock, so this is the one-way delay as
+    # seen over serial, including each board's print delay
+    latencies = [(received_at[number] - sent_at[number]) / 1_000_000 for number in received_at if number in sent_at]
+    if dashboard is not None:
+        for number, timestamp in received_at.items():
+            latency = (timestamp - sent_at[number]) / 1_000_000 if number in sent_at else None
+            dashboard.record_received(latency, timestamp)
+        for _ in range(max(0, iterations - len(received_at))):
+            dashboard.record_lost()
+
+    seconds = test_ms / 1000 if test_ms else iterations / rate
+    offered = actual_frequency if actual_frequency is not None else len(sent_at) / seconds
+    return {
+        'rate': rate,
+        'offered': offered,
+        'sent': iterations,
+        'received': len(received_at),
+        'goodput': len(received_at) / seconds,
+        'loss': (iterations - len(received_at)) / iterations * 100,
+        'latency': summarize(latencies),
+    }
+
+def find_knee(steps, efficiency=0.9):
+    # The knee is the last step before goodput drops below `efficiency` of the
+    # offered load for good; a single noisy step that recovers does not count.
+    # Returns (knee step or None, first saturated step or None).
+    for index, step in enumerate(steps):
+        if all(later['goodput'] < efficiency * later['offered'] for later in steps[index:]):
+            return (steps[index - 1] if index else None), step
+    return (steps[-1] if steps else None), None
+
+def flood_ramp(sender, receiver, payload_length, rates, step_duration, router, steps, stop_event,
+               efficiency=0.9, saturated_steps=2, dashboard=None, log=None):
+    saturated = 0
+    for rate in rates:
+        if stop_event.is_set():
+            break
+        payload = ''.join(random.choices(string.ascii_letters + string.digits, k=payload_length))
+        step = flood_step(sender, receiver, payload, rate, step_duration, router, dashboard=dashboard, log=log)
+        steps.append(step)
+        latency = step['latency']
+        print(f"[{current_milli_time()}] Offered {step['offered']:.2f} msg/s -> goodput {step['goodput']:.2f} msg/s, "
+              f"loss {step['loss']:.1f}%, "
+              + (f"latency p50 {latency['p50']:.1f} / p99 {latency['p99']:.1f} ms" if latency else "no latency"))
+        # Past the knee every step only confirms it; stop after a few
+        saturated = saturated + 1 if step['goodput'] < efficiency * step['offered'] else 0
+        if saturated >= saturated_steps:
+            break
+
+def report_ramp(steps, efficiency=0.9):
+    knee, saturation = find_knee(steps, efficiency)
+    print("\nOpen-loop ramp:")
+    print(f"  {'Offered':>10} {'Goodput':>10} {'Loss %':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for step in steps:
+        latency = step['latency']
+        p50, p99 = (f"{latency['p50']:.1f}", f"{latency['p99']:.1f}") if latency else ('n/a', 'n/a')
+        print(f"  {step['offered']:>10.2f} {step['goodput']:>10.2f} {step['loss']:>7.1f} {p50:>8} {p99:>8}")
+    if saturation is None:
+        print(f"No knee: goodput kept within {efficiency:.0%} of the offered load up to {steps[-1]['offered']:.2f} msg/s")
+    elif knee is None:
+        print(f"Saturated from the first step ({saturation['offered']:.2f} msg/s); start the ramp lower")
+    else:
+        print(f"Knee at {knee['offered']:.2f} msg/s offered ({knee['goodput']:.2f} msg/s goodput); "
+              f"goodput stops tracking the offered load from {saturation['offered']:.2f} msg/s")
+
+    filename = datetime.now().strftime('%Y%m%d_%H%M%S_flood_ramp.png')
+    plotting.submit(plotting.load_curve, filename,
+                    [step['offered'] for step in steps], [step['goodput'] for step in steps],
+                    [step['loss'] for step in steps],
+                    [step['latency']['p50'] if step['latency'] else None for step in steps],
+                    [step['latency']['p99'] if step['latency'] else None for step in steps],
+                    knee['offered'] if knee else None)
+    print(f"Rendering '{filename}' in the background")
+    return knee
 
 def plot_results(results):
     packets_sent, loss_rates = zip(*results)
 
-    plt.figure(figsize=(12, 6))
-    plt.plot(packets_sent, loss_rates)
-    plt.xlabel('Packets Sent')
-    plt.ylabel('Packet Loss Rate (%)')
-    plt.title('Packet Loss Rate Over Time')
-    plt.grid(True)
-
     filename = datetime.now().strftime('%Y%m%d_%H%M%S_packet_loss.png')
-    plt.savefig(filename, dpi=300, bbox_inches='tight')
-    plt.show()
-
-    print(f"Plot saved as '{filename}'")
+    plotting.submit(plotting.packet_loss, filename, packets_sent, loss_rates)
+    print(f"Rendering '{filename}' in the background")
 
 def main():
+    mode = 'probe'  # 'probe': 10 Hz latency probes until 'q'; 'ramp': open-loop rate ramp up to the saturation knee
     node = {'port': 'COM5', 'node_id': 853210837}
+    receiver = {'port': 'COM13', 'node_id': 480652657}  # Only used by the ramp
     packet_length = 50  # You can adjust this value
+    dashboard_window = 60.0  # Seconds of history behind the live loss/latency/line rate figures
+    verbosity = LINES  # SUMMARY prints only the dashboard and results, COMMANDS adds the commands sent; the log file gets everything
 
-    try:
-        node['serial'] = serial.Serial(node['port'], 115200, timeout=1)
-    except serial.SerialException as e:
-        print(f"Error opening serial port {node['port']}: {e}")
-        return
+    # Ramp configuration
+    start_rate = 1  # Messages per second
+    max_rate = 200
+    rate_step = 1.5  # Multiplied in (geometric) or added (linear) per step
+    geometric = True
+    step_duration = 10  # Seconds of sending at each rate
+    efficiency = 0.9  # Goodput below this share of the offered load counts as saturated
 
-    message_queue = queue.Queue()
+    nodes = [node] if mode == 'probe' else [node, receiver]
+    for board in nodes:
+        try:
+            board['serial'] = serial.Serial(board['port'], 115200, timeout=1)
+        except serial.SerialException as e:
+            print(f"Error opening serial port {board['port']}: {e}")
+            return
+
+    router = EventRouter()
     stop_event = threading.Event()
+    # Echoed lines are printed and logged from the sink's own thread, not the readers
+    log = LogSink(datetime.now().strftime('%Y%m%d_%H%M%S') + '_serial', verbosity).start()
+
+    read_threads = []
+    for board in nodes:
+        thread = threading.Thread(target=read_from_port, args=(board['serial'], router, stop_event, None, log))
+        thread.start()
+        read_threads.append(thread)
 
-    read_thread = threading.Thread(target=read_from_port, args=(node['serial'], message_queue, stop_event))
-    read_thread.start()
+    dashboard = LiveDashboard(dashboard_window, filename=datetime.now().strftime('%Y%m%d_%H%M%S_packet_loss_live.png'))
+    router.subscribe([board['port'] for board in nodes], callback=dashboard.line_callback)
+    dashboard.start()
 
     results = []
-    test_thread = threading.Thread(target=packet_loss_test, args=(node['serial'], node['node_id'], packet_length, message_queue, results, stop_event))
-    test_thread.start()
+    if mode == 'ramp':
+        rates = ramp_rates(start_rate, max_rate, rate_step, geometric)
+        test_thread = threading.Thread(target=flood_ramp, args=(node, receiver, packet_length, rates, step_duration, router, results, stop_event, efficiency),
+                                       kwargs={'dashboard': dashboard, 'log': log})
+        test_thread.start()
+        keyboard.add_hotkey('q', stop_event.set)
+        print(f"Ramping over {rates} msg/s; press 'q' to stop after the current step...")
+        test_thread.join()
+    else:
+        test_thread = threading.Thread(target=packet_loss_test, args=(node['serial'], node['node_id'], packet_length, router, results, stop_event, dashboard, log))
+        test_thread.start()
 
-    print("Press 'q' to stop the test and plot results...")
-    keyboard.wait('q')
+        print("Press 'q' to stop the test and plot results...")
+        keyboard.wait('q')
 
     stop_event.set()
-    read_thread.join()
+    for thread in read_threads:
+        thread.join()
     test_thread.join()
+    dashboard.stop()
+    log.stop()
 
-    try:
-        node['serial'].close()
-    except:
-        pass
-    print("\nSerial port closed")
+    for board in nodes:
+        try:
+            board['serial'].close()
+        except:
+            pass
+    print("\nSerial ports closed")
 
-    if results:
-        plot_results(results)
-    else:
+    if not results:
         print("No results to plot.")
+    elif mode == 'ramp':
+        report_ramp(results, efficiency)
+    else:
+        plot_results(results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
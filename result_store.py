@@ -0,0 +1,250 @@
+import collections
+import json
+import os
+import threading
+import numpy as np
+
+def numeric_column(table, column, values, dtype=None):
+    # Columns are raw numbers only. None is stored as NaN in float columns; strings,
+    # None in an integer column and floats in an integer column are refused
+    # rather than coerced
+    dtype = np.dtype(dtype) if dtype is not None else None
+    values = list(values)
+    if any(value is None for value in values):
+        if dtype is not None and dtype.kind != 'f':
+            raise ValueError(f"{table}: column {column!r} is {dtype.name} and cannot hold None")
+        values = [np.nan if value is None else value for value in values]
+    data = np.asarray(values)
+    if data.dtype.kind not in 'biuf':
+        raise ValueError(f"{table}: column {column!r} got non-numeric value {values[0]!r}; only numbers can be stored")
+    if dtype is not None and not np.can_cast(data.dtype, dtype, 'same_kind'):
+        raise ValueError(f"{table}: column {column!r} is {dtype.name} and cannot hold {data.dtype.name} values")
+    return data
+
+class ColumnTable:
+    # An append-only table kept as one raw binary file per column
+    # (<name>.<column>.bin, dtypes in <name>.schema.json). Each append or
+    # extend writes and flushes every column, so a crash loses at most the rows
+    # being written; on reopen all columns are cut back to the shortest one, which
+    # drops a torn last row. read() memory-maps the columns without copying.
+    # Every row must have exactly the columns of the schema, which is taken
+    # from the first rows written; anything else raises ValueError.
+
+    def __init__(self, directory, name, schema=None):
+        self.directory = directory
+        self.name = name
+        self.lock = threading.Lock()
+        self.files = {}
+        os.makedirs(directory, exist_ok=True)
+        schema_path = os.path.join(directory, f'{name}.schema.json')
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                self.schema = json.load(f)
+        else:
+            self.schema = None
+        if self.schema is None and schema is not None:
+            self._create(schema)
+        if self.schema is not None:
+            self._open()
+
+    def _create(self, schema):
+        self.schema = {column: np.dtype(dtype).str for column, dtype in schema.items()}
+        with open(os.path.join(self.directory, f'{self.name}.schema.json'), 'w') as f:
+            json.dump(self.schema, f)
+
+    def _path(self, column):
+        return os.path.join(self.directory, f'{self.name}.{column}.bin')
+
+    def _open(self):
+        rows = None
+        for column, dtype in self.schema.items():
+            path = self._path(column)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            count = size // np.dtype(dtype).itemsize
+            rows = count if rows is None else min(rows, count)
+        for column, dtype in self.schema.items():
+            f = open(self._path(column), 'ab')
+            f.truncate(rows * np.dtype(dtype).itemsize)
+            self.files[column] = f
+        self.rows = rows
+
+    def __len__(self):
+        return self.rows if self.schema is not None else 0
+
+    def append(self, row):
+        self.extend({column: [value] for column, value in row.items()})
+
+    def extend(self, columns):
+        with self.lock:
+            if self.schema is not None:
+                unknown = sorted(set(columns) - set(self.schema))
+                if unknown:
+                    raise ValueError(f"{self.name}: no column {unknown[0]!r} (columns are {', '.join(self.schema)})")
+                missing = [column for column in self.schema if column not in columns]
+                if missing:
+                    raise ValueError(f"{self.name}: missing a value for column {missing[0]!r}")
+            # Converted in full before anything is written, so a bad value cannot leave the columns uneven
+            arrays = {column: numeric_column(self.name, column, values,
+                                             self.schema[column] if self.schema is not None else None)
+                      for column, values in columns.items()}
+            if len({len(data) for data in arrays.values()}) > 1:
+                raise ValueError(f"{self.name}: columns have different lengths")
+            if self.schema is None:
+                # Infer the schema from the first rows: integers stay int64, everything else float64
+                self._create({column: data.dtype if data.dtype.kind in 'iu' else np.float64
+                              for column, data in arrays.items()})
+                self._open()
+            count = None
+            for column, dtype in self.schema.items():
+                data = arrays[column].astype(dtype, copy=False)
+                count = len(data)
+                self.files[column].write(data.tobytes())
+            for f in self.files.values():
+                f.flush()
+            self.rows += count
+
+    def read(self):
+        if self.schema is None:
+            return {}
+        with self.lock:
+            rows = self.rows
+        return {column: np.memmap(self._path(column), dtype=dtype, mode='r', shape=(rows,)) if rows else
+                np.empty(0, dtype=dtype) for column, dtype in self.schema.items()}
+
+    def rows_as_dicts(self):
+        columns = self.read()
+        return [{column: values[index].item() for column, values in columns.items()} for index in range(len(self))]
+
+    def close(self):
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+class EventLog:
+    # Every raw (port, timestamp_ns, line) as it arrives: fixed-width columns for
+    # the port index, timestamp and byte offset, and the line text appended to a
+    # separate UTF-8 blob. Passed to EventRouter.subscribe as a callback.
+    #
+    # The callback runs on the serial reader thread, so it only appends to a
+    # deque (atomic, no lock); a writer thread takes whatever has queued every
+    # flush_interval, or sooner once batch_size lines are waiting, and writes it
+    # as one block per file. The blob is flushed before the columns, and a
+    # reopen cuts both back to the last complete row, so a crash loses at most
+    # the batch in flight.
+
+    def __init__(self, directory, batch_size=4096, flush_interval=0.2):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.table = ColumnTable(directory, 'events', {'timestamp': np.int64, 'port': np.int16,
+                                                       'offset': np.int64, 'length': np.int32})
+        self.ports_path = os.path.join(directory, 'events.ports.json')
+        self.ports = []
+        if os.path.exists(self.ports_path):
+            with open(self.ports_path) as f:
+                self.ports = json.load(f)
+        self.port_index = {port: index for index, port in enumerate(self.ports)}
+        self.lines = open(os.path.join(directory, 'events.lines.bin'), 'ab')
+        # A torn write can leave text past the last complete row; drop it
+        columns = self.table.read()
+        end = int(columns['offset'][-1] + columns['length'][-1]) if len(self.table) else 0
+        self.lines.truncate(end)
+        self.offset = end
+        self.events = collections.deque()
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __call__(self, event):
+        self.events.append(event)
+        if len(self.events) == self.batch_size:
+            self.wake.set()
+
+    def _run(self):
+        while not self.stopping:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        # Writes everything queued so far; also called by read() and close()
+        with self.lock:
+            if self.lines.closed:
+                return
+            events = self.events
+            new_ports = False
+            blob = []
+            columns = {'timestamp': [], 'port': [], 'offset': [], 'length': []}
+            # Only what is there now; a reader outrunning the writer cannot keep it here
+            for _ in range(len(events)):
+                port, timestamp, line = events.popleft()
+                data = line.encode('utf-8')
+                index = self.port_index.get(port)
+                if index is None:
+                    index = self.port_index[port] = len(self.ports)
+                    self.ports.append(port)
+                    new_ports = True
+                blob.append(data)
+                columns['timestamp'].append(timestamp)
+                columns['port'].append(index)
+                columns['offset'].append(self.offset)
+                columns['length'].append(len(data))
+                self.offset += len(data)
+            if not blob:
+                return
+            if new_ports:
+                with open(self.ports_path, 'w') as f:
+                    json.dump(self.ports, f)
+            self.lines.write(b''.join(blob))
+            self.lines.flush()
+            self.table.extend(columns)
+
+    def read(self):
+        self.flush()
+        columns = self.table.read()
+        with open(os.path.join(self.directory, 'events.lines.bin'), 'rb') as f:
+            blob = f.read()
+        for port, timestamp, offset, length in zip(columns['port'], columns['timestamp'],
+                                                   columns['offset'], columns['length']):
+            yield self.ports[port], int(timestamp), blob[offset:offset + length].decode('utf-8')
+
+    def close(self):
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+        self.flush()
+        with self.lock:
+            self.lines.close()
+            self.table.close()
+
+class ResultStore:
+    # One directory per sweep: the raw event log plus a results table with one
+    # row per completed test. Reopening the same directory resumes it.
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.events = EventLog(directory)
+        self.results = ColumnTable(directory, 'results')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, result):
+        self.results.append(result)
+
+    def completed(self, *keys):
+        # Set of key tuples (e.g. ('frequency', 'payload_length')) already stored
+        columns = self.results.read()
+        if not columns:
+            return set()
+        return set(zip(*(columns[key].tolist() for key in keys)))
+
+    def close(self):
+        self.events.close()
+        self.results.close()
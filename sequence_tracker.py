@@ -0,0 +1,116 @@
+import re
+import numpy as np
+
+# The throughput task serializes {"message_number":N,"payload":...} with
+# message_number first, so one anchored search finds it without decoding the
+# JSON (or the payload, which can be long)
+MESSAGE_NUMBER_RE = re.compile(r'"message_number":(-?\d+)')
+
+def message_number(text):
+    match = MESSAGE_NUMBER_RE.search(text)
+    return int(match.group(1)) if match else None
+
+class SequenceTracker:
+    # Per-run accounting of the sequence numbers a receiver printed: one bit
+    # per number seen (a 100k message run is 12.5 KB), with duplicates,
+    # reordering and inter-arrival timing updated as each one arrives, so a
+    # summary is available at any point without rescanning.
+    #
+    # interval: the sender's nominal gap in seconds (1 / frequency); when set,
+    # jitter is the RFC 3550 running estimate of how far arrivals stray from
+    # that schedule.
+
+    def __init__(self, expected=None, interval=None):
+        self.expected = expected
+        self.interval_ns = interval * 1_000_000_000 if interval else None
+        self.bitmap = bytearray((expected + 8) // 8 if expected else 64)
+        self.received = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.highest = None
+        self.reordered = 0
+        self.max_reorder_depth = 0
+        self.first_arrival = None
+        self.last_arrival = None
+        self.last_number = None
+        self.jitter_ns = 0.0
+        # Welford running mean/variance of the gaps between arrivals
+        self.gap_count = 0
+        self.gap_mean = 0.0
+        self.gap_m2 = 0.0
+
+    def record(self, number, timestamp):
+        # Returns False for a duplicate or unusable number
+        if number is None or number < 0:
+            self.invalid += 1
+            return False
+        byte, bit = number >> 3, 1 << (number & 7)
+        if byte >= len(self.bitmap):
+            self.bitmap.extend(bytes(max(byte + 1 - len(self.bitmap), len(self.bitmap))))
+        if self.bitmap[byte] & bit:
+            self.duplicates += 1
+            return False
+        self.bitmap[byte] |= bit
+        self.received += 1
+
+        if self.highest is None or number > self.highest:
+            self.highest = number
+        else:
+            # Arrived after a later number: how far back it belongs
+            self.reordered += 1
+            self.max_reorder_depth = max(self.max_reorder_depth, self.highest - number)
+
+        if self.last_arrival is None:
+            self.first_arrival = timestamp
+        else:
+            gap = timestamp - self.last_arrival
+            self.gap_count += 1
+            delta = gap - self.gap_mean
+            self.gap_mean += delta / self.gap_count
+            self.gap_m2 += delta * (gap - self.gap_mean)
+            if self.interval_ns:
+                transit_change = gap - (number - self.last_number) * self.interval_ns
+                self.jitter_ns += (abs(transit_change) - self.jitter_ns) / 16
+        self.last_arrival = timestamp
+        self.last_number = number
+        return True
+
+    def record_text(self, text, timestamp):
+        return self.record(message_number(text), timestamp)
+
+    def seen(self):
+        # Boolean array indexed by sequence number
+        return np.unpackbits(np.frombuffer(bytes(self.bitmap), dtype=np.uint8), bitorder='little').astype(bool)
+
+    def gaps(self, first=1):
+        # (start, end) inclusive runs of missing numbers from first to the
+        # expected count (or the highest seen)
+        last = self.expected if self.expected else self.highest
+        if last is None or last < first:
+            return []
+        seen = self.seen()
+        window = np.zeros(last - first + 1, dtype=bool)
+        available = seen[first:last + 1]
+        window[:available.size] = available
+        missing = np.r_[False, ~window, False].astype(np.int8)
+        edges = np.flatnonzero(np.diff(missing))
+        return [(int(start) + first, int(end) + first - 1) for start, end in zip(edges[::2], edges[1::2])]
+
+    def summary(self, first=1):
+        expected = self.expected if self.expected else (self.highest - first + 1 if self.highest is not None else 0)
+        in_range = int(self.seen()[first:first + expected].sum()) if expected else 0
+        lost = expected - in_range
+        gaps = self.gaps(first)
+        return {
+            'received': self.received,
+            'lost': lost,
+            'loss_rate': lost / expected * 100 if expected else 0.0,
+            'duplicates': self.duplicates,
+            'reordered': self.reordered,
+            'max_reorder_depth': self.max_reorder_depth,
+            'gaps': len(gaps),
+            'longest_gap': max((end - start + 1 for start, end in gaps), default=0),
+            'interarrival_mean': self.gap_mean / 1_000_000 if self.gap_count else None,
+            'interarrival_std': (self.gap_m2 / self.gap_count) ** 0.5 / 1_000_000 if self.gap_count else None,
+            'jitter': self.jitter_ns / 1_000_000 if self.interval_ns and self.gap_count else None,
+        }
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import re
+import threading
+import time
+import serial
+from serial_reader import LineSplitter, current_milli_time, format_timestamp
+from event_router import EventRouter
+
+class SerialEngine:
+    def __init__(self, nodes, baudrate=115200, echo=True):
+        self.nodes = nodes
+        self.baudrate = baudrate
+        self.echo = echo
+        self.loop = None
+        self.waiters = {}     # port -> [(regex, future)]
+        self.listeners = []   # callbacks receiving every (port, timestamp_ns, line)
+        self.router = EventRouter()  # per-port, per-prefix subscriptions, delivered on the loop thread
+        self.threads = []
+        self.stop_event = threading.Event()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        for node in self.nodes:
+            if 'serial' not in node:
+                node['serial'] = serial.Serial(node['port'], self.baudrate, timeout=0)
+            self.waiters[node['port']] = []
+            self._start_reader(node['serial'])
+
+    async def close(self):
+        self.stop_event.set()
+        for node in self.nodes:
+            ser = node.get('serial')
+            if ser is None:
+                continue
+            if os.name == 'posix':
+                self.loop.remove_reader(ser.fileno())
+        for thread in self.threads:
+            await self.loop.run_in_executor(None, thread.join)
+        for node in self.nodes:
+            try:
+                node['serial'].close()
+            except Exception:
+                pass
+        for waiters in self.waiters.values():
+            for _, future in waiters:
+                if not future.done():
+                    future.cancel()
+            waiters.clear()
+
+    def _start_reader(self, ser):
+        splitter = LineSplitter()
+        if os.name == 'posix':
+            # One event loop watches every port's file descriptor; no thread per port
+            ser.timeout = 0
+            self.loop.add_reader(ser.fileno(), self._on_readable, ser, splitter)
+            return
+
+        # Windows COM ports cannot be registered with the event loop, so each port
+        # gets a blocking reader that hands whole chunks over to the loop
+        def blocking_reader():
+            ser.timeout = 1
+            while not self.stop_event.is_set():
+                try:
+                    data = ser.read(1)
+                    if not data:
+                        continue
+                    waiting = ser.in_waiting
+                    if waiting:
+                        data += ser.read(waiting)
+                except serial.SerialException as e:
+                    print(f"[{current_milli_time()}][{ser.port}] Serial read failed: {e}")
+                    break
+                self.loop.call_soon_threadsafe(self._on_data, ser.port, splitter, data)
+
+        thread = threading.Thread(target=blocking_reader, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _on_readable(self, ser, splitter):
+        try:
+            data = ser.read(ser.in_waiting or 1)
+        except serial.SerialException as e:
+            print(f"[{current_milli_time()}][{ser.port}] Serial read failed: {e}")
+            self.loop.remove_reader(ser.fileno())
+            return
+        if data:
+            self._on_data(ser.port, splitter, data)
+
+    def _on_data(self, port, splitter, data):
+        timestamp = time.perf_counter_ns()
+        for line in splitter.feed(data):
+            if self.echo is True:
+                print(f"[{format_timestamp(timestamp)}][{port} IN] {line}")
+            elif self.echo:
+                self.echo.line(port, timestamp, line)
+            self.dispatch(port, timestamp, line)
+
+    def dispatch(self, port, timestamp, line):
+        for callback in self.listeners:
+            callback(port, timestamp, line)
+        self.router.put((port, timestamp, line))
+
+        waiters = self.waiters.get(port)
+        if not waiters:
+            return
+        remaining = []
+        for regex, future in waiters:
+            if future.done():
+                continue
+            if regex.search(line):
+                future.set_result((port, timestamp, line))
+            else:
+                remaining.append((regex, future))
+        waiters[:] = remaining
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    async def send(self, node, command):
+        if not command.endswith('\n'):
+            command += '\n'
+        timestamp = current_milli_time()
+        if self.echo is True:
+            print(f"[{timestamp}][{node['port']} OUT] {command.strip()}")
+        elif self.echo:
+            self.echo.command(node['port'], command)
+        # Commands are a few dozen bytes; the OS buffer absorbs them without blocking the loop
+        node['serial'].write(command.encode())
+
+    def expect(self, node, pattern):
+        # The waiter is registered when expect() is called, not when it is awaited,
+        # so callers can arm it before send() and never miss a fast reply. Returns
+        # the future; await it through wait(), or cancel() it if the reply will
+        # never be asked for, which also drops it from the port's waiters.
+        regex = re.compile(pattern) if isinstance(pattern, str) else pattern
+        future = self.loop.create_future()
+        waiters = self.waiters[node['port']]
+        waiter = (regex, future)
+        waiters.append(waiter)
+
+        def forget(future):
+            # Timed out or cancelled: no reason to keep matching lines against it
+            if future.cancelled() and waiter in waiters:
+                waiters.remove(waiter)
+
+        future.add_done_callback(forget)
+        return future
+
+    async def request(self, node, command, pattern, timeout=None):
+        reply = self.expect(node, pattern)
+        try:
+            await self.send(node, command)
+        except BaseException:
+            reply.cancel()
+            raise
+        return await self.wait(reply, timeout)
+
+    async def wait(self, future, timeout=None):
+        # (port, timestamp_ns, line) of the match, or None on timeout
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
@@ -0,0 +1,67 @@
+import time
+import serial
+
+# Lines longer than this without a newline are flushed as-is so a board
+# spewing garbage cannot grow the buffer without bound.
+MAX_LINE_LENGTH = 4096
+
+# perf_counter_ns() has an arbitrary origin; anchor it to the wall clock once so
+# monotonic stamps can still be shown as time of day
+WALL_CLOCK_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+def format_timestamp(timestamp_ns):
+    seconds, nanoseconds = divmod(timestamp_ns + WALL_CLOCK_OFFSET_NS, 1_000_000_000)
+    return time.strftime('%H:%M:%S', time.localtime(seconds)) + f'.{nanoseconds // 1_000_000:03d}'
+
+def current_milli_time():
+    return format_timestamp(time.perf_counter_ns())
+
+class LineSplitter:
+    def __init__(self, max_line_length=MAX_LINE_LENGTH):
+        self.buffer = bytearray()
+        self.max_line_length = max_line_length
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        end = buffer.rfind(b'\n')
+        if end < 0:
+            if len(buffer) <= self.max_line_length:
+                return []
+            end = len(buffer)
+
+        lines = []
+        for raw in bytes(buffer[:end]).split(b'\n'):
+            # Undecodable bytes (boot noise, baud glitches) are replaced instead of raising
+            line = raw.decode('utf-8', errors='replace').strip()
+            if line:
+                lines.append(line)
+        del buffer[:end + 1]
+        return lines
+
+def read_from_port(ser, message_queue, stop_event, line_filter=None, echo=True):
+    splitter = LineSplitter()
+    while not stop_event.is_set():
+        try:
+            # Block for the first byte (bounded by the port timeout), then take everything pending
+            data = ser.read(1)
+            if not data:
+                continue
+            waiting = ser.in_waiting
+            if waiting:
+                data += ser.read(waiting)
+        except serial.SerialException as e:
+            print(f"[{current_milli_time()}][{ser.port}] Serial read failed: {e}")
+            break
+
+        # Stamp when the bytes arrived, as integer nanoseconds; format only for display
+        timestamp = time.perf_counter_ns()
+        for response in splitter.feed(data):
+            if line_filter is not None and not line_filter(response):
+                continue
+            # echo may be a LogSink, which formats and prints on its own thread
+            if echo is True:
+                print(f"[{format_timestamp(timestamp)}][{ser.port} IN] {response}")
+            elif echo:
+                echo.line(ser.port, timestamp, response)
+            message_queue.put((ser.port, timestamp, response))
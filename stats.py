@@ -0,0 +1,159 @@
+import numpy as np
+
+PERCENTILES = (50, 90, 99, 99.9)
+STAT_NAMES = ('count', 'min', 'p50', 'p90', 'p99', 'p99.9', 'max', 'mean', 'std')
+
+def summarize(values):
+    # All statistics of one group from a single sorted copy of the data
+    data = np.sort(np.asarray(values, dtype=np.float64))
+    if data.size == 0:
+        return None
+    # Linear interpolation between order statistics, the same as np.percentile's default
+    positions = np.asarray(PERCENTILES) / 100 * (data.size - 1)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, data.size - 1)
+    quantiles = data[lower] + (data[upper] - data[lower]) * (positions - lower)
+    stats = {'count': int(data.size), 'min': float(data[0])}
+    for percentile, value in zip(PERCENTILES, quantiles):
+        stats[f'p{percentile:g}'] = float(value)
+    stats['max'] = float(data[-1])
+    stats['mean'] = float(data.mean())
+    stats['std'] = float(data.std())
+    return stats
+
+def summarize_groups(groups, value=None):
+    # {key: [results]} -> {key: stats}; value picks the number out of each result
+    if value is not None:
+        groups = {key: [value(result) for result in results] for key, results in groups.items()}
+    return {key: summarize(values) for key, values in groups.items() if len(values)}
+
+def summarize_columns(keys, values):
+    # Grouped statistics over two flat columns (e.g. from a ResultStore): one
+    # stable sort by key, then each group is a contiguous slice
+    keys = np.asarray(keys)
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], values[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], keys.size]
+    return {keys[start].item(): summarize(values[start:end]) for start, end in zip(starts, ends)}
+
+STAT_LABELS = {'min': 'Min', 'p50': 'Median', 'p90': 'P90', 'p99': 'P99', 'p99.9': 'P99.9',
+               'max': 'Max', 'mean': 'Avg', 'std': 'Std dev'}
+
+def format_stats(stats, unit='ms', precision=2):
+    return f"n: {stats['count']}, " + ', '.join(f"{name}: {stats[name]:.{precision}f} {unit}" for name in STAT_NAMES[1:])
+
+def format_stat_lines(stats, indent='  ', unit='ms', precision=2):
+    # One "Label: value unit" line per statistic, for the multi-line summaries
+    return ''.join(f"{indent}{STAT_LABELS[name]}: {stats[name]:.{precision}f} {unit}\n" for name in STAT_NAMES[1:])
+
+class LatencyHistogram:
+    # HDR-style log-linear histogram: values are recorded as integers of `unit`
+    # (default 1 us for millisecond inputs) into buckets that keep
+    # `significant_digits` of precision at every magnitude, so memory stays a
+    # few tens of KB however many samples go in. Histograms with the same
+    # settings merge by adding their counts, e.g. across boards or runs.
+
+    def __init__(self, unit=0.001, highest=3_600_000_000, significant_digits=3):
+        self.unit = unit
+        self.highest = highest
+        self.significant_digits = significant_digits
+        largest_single_unit = 2 * 10 ** significant_digits
+        self.sub_bucket_half_count_magnitude = max(int(np.ceil(np.log2(largest_single_unit))) - 1, 0)
+        self.sub_bucket_count = 1 << (self.sub_bucket_half_count_magnitude + 1)
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.sub_bucket_mask = self.sub_bucket_count - 1
+        bucket_count = 1
+        smallest_untrackable = self.sub_bucket_count
+        while smallest_untrackable <= highest:
+            smallest_untrackable <<= 1
+            bucket_count += 1
+        self.counts = np.zeros((bucket_count + 1) * self.sub_bucket_half_count, dtype=np.int64)
+        self.total = 0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.sum = 0.0
+
+    def _indices(self, units):
+        # bit_length via frexp is exact for integers below 2**53
+        pow2ceiling = np.frexp((units | self.sub_bucket_mask).astype(np.float64))[1]
+        bucket = pow2ceiling - (self.sub_bucket_half_count_magnitude + 1)
+        sub_bucket = units >> bucket
+        return ((bucket + 1) << self.sub_bucket_half_count_magnitude) + (sub_bucket - self.sub_bucket_half_count)
+
+    def _value_at(self, index):
+        bucket = (index >> self.sub_bucket_half_count_magnitude) - 1
+        sub_bucket = (index & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+        if bucket < 0:
+            sub_bucket -= self.sub_bucket_half_count
+            bucket = 0
+        lowest = sub_bucket << bucket
+        return lowest + (1 << bucket) - 1  # Highest value equivalent to this bucket
+
+    def record(self, values):
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        if values.size == 0:
+            return
+        units = np.clip(np.rint(values / self.unit), 0, self.highest).astype(np.int64)
+        self.counts += np.bincount(self._indices(units), minlength=self.counts.size)
+        self.total += int(values.size)
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self.sum += float(values.sum())
+
+    def merge(self, other):
+        if (other.unit, other.highest, other.significant_digits) != (self.unit, self.highest, self.significant_digits):
+            raise ValueError("Histograms with different settings cannot be merged")
+        self.counts += other.counts
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.sum += other.sum
+        return self
+
+    def percentile(self, percentile):
+        if self.total == 0:
+            return None
+        rank = max(1, int(np.ceil(percentile / 100 * self.total)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(max(self._value_at(index) * self.unit, self.minimum), self.maximum)
+
+    def summary(self):
+        if self.total == 0:
+            return None
+        stats = {'count': self.total, 'min': self.minimum}
+        for percentile in PERCENTILES:
+            stats[f'p{percentile:g}'] = self.percentile(percentile)
+        stats['max'] = self.maximum
+        stats['mean'] = self.sum / self.total
+        # Each bucket stands in for its values to within the histogram precision
+        occupied = np.flatnonzero(self.counts)
+        midpoints = np.array([self._value_at(index) for index in occupied]) * self.unit
+        weights = self.counts[occupied]
+        stats['std'] = float(np.sqrt(np.average((midpoints - stats['mean']) ** 2, weights=weights)))
+        return stats
+
+def variance_components(groups):
+    # One-way ANOVA over {group: [values]}, e.g. one group per board: how far
+    # apart the group means are and how much of the total variance lies
+    # between groups rather than within them. None with fewer than two groups.
+    groups = {key: np.asarray(values, dtype=np.float64) for key, values in groups.items() if len(values)}
+    if len(groups) < 2:
+        return None
+    values = np.concatenate(list(groups.values()))
+    grand_mean = values.mean()
+    means = {key: float(group.mean()) for key, group in groups.items()}
+    between = sum(group.size * (group.mean() - grand_mean) ** 2 for group in groups.values())
+    within = sum(((group - group.mean()) ** 2).sum() for group in groups.values())
+    k, n = len(groups), values.size
+    return {
+        'groups': k,
+        'count': int(n),
+        'means': means,
+        'spread': max(means.values()) - min(means.values()),
+        'between_std': float(np.std(list(means.values()), ddof=1)),
+        'within_std': float(np.sqrt(within / (n - k))) if n > k else None,
+        'eta_squared': float(between / (between + within)) if between + within else 0.0,
+        'f': float((between / (k - 1)) / (within / (n - k))) if n > k and within else None,
+    }
@@ -3,95 +3,88 @@ import time
 import json
 import random
 import string
-import matplotlib.pyplot as plt
 from statistics import mean
 import threading
-import queue
-from datetime import datetime, timedelta
-import numpy as np
-
-def current_milli_time():
-    return datetime.now().strftime('%H:%M:%S.%f')[:-3]
+from datetime import datetime
+from serial_reader import current_milli_time, read_from_port
+from log_sink import LogSink, LINES
+from event_router import Deadline, EventRouter
+from stats import summarize
+from sequence_tracker import SequenceTracker
+import plotting
 
 def generate_payload(length):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
-def read_from_port(ser, message_queue, stop_event):
-    while not stop_event.is_set():
-        if ser.in_waiting:
-            response = ser.readline().decode().strip()
-            timestamp = current_milli_time()
-            print(f"[{timestamp}][{ser.port} IN] {response}")
-            message_queue.put((ser.port, timestamp, response))
-
-def run_throughput_test(sender, receiver, payload, frequency, iterations, message_queue, encrypted=False, timeout=60):
+def run_throughput_test(sender, receiver, payload, frequency, iterations, router, encrypted=False, timeout=60, log=None):
     command = f"hirg -r {receiver['node_id']} -{('s' if encrypted else 'p')} {payload} -t {frequency} -i {iterations}\n"
     timestamp = current_milli_time()
-    print(f"[{timestamp}][{sender['port']} OUT] {command.strip()}")
+    if log is not None:
+        log.command(sender['port'], command)
+    else:
+        print(f"[{timestamp}][{sender['port']} OUT] {command.strip()}")
+    # Raw "Received from" lines: the sequence number is scanned out of the line
+    # directly, with no classify() or JSON decode per message
+    subscription = router.subscribe(receiver['port'], "Received from ")
     sender['serial'].write(command.encode())
 
-    received_messages = 0
-    start_time = datetime.now()
+    # The throughput task waits 1000 / frequency whole milliseconds between messages
+    tracker = SequenceTracker(iterations, (1000 // frequency if frequency > 0 else 1000) / 1000)
+    start_time = time.perf_counter()
     expected_duration = iterations / frequency
+    deadline = Deadline(max(expected_duration * 2, timeout))
 
-    while (datetime.now() - start_time).total_seconds() < max(expected_duration, timeout):
-        try:
-            port, timestamp, message = message_queue.get(timeout=0.1)
-            if port == receiver['port'] and "Received unencrypted message:" in message:
-                received_messages += 1
-                if received_messages == iterations:
-                    break
-        except queue.Empty:
-            continue
+    for port, timestamp, line in subscription.until(deadline):
+        tracker.record_text(line, timestamp)
+        if tracker.received >= iterations:
+            break
+    subscription.close()
 
-    end_time = datetime.now()
-    duration = (end_time - start_time).total_seconds()
-    throughput = received_messages / duration
+    actual_end_time = time.perf_counter()
+    duration = actual_end_time - start_time
+    sequence = tracker.summary()
+    received_messages = iterations - sequence['lost']
+    throughput = received_messages / duration if duration > 0 else 0
 
     return {
         'sent': iterations,
         'received': received_messages,
         'duration': duration,
-        'throughput': throughput
+        'throughput': throughput,
+        'packet_loss': sequence['loss_rate'],
+        'duplicates': sequence['duplicates'],
+        'reordered': sequence['reordered'],
+        'max_reorder_depth': sequence['max_reorder_depth'],
+        'gaps': sequence['gaps'],
+        'longest_gap': sequence['longest_gap'],
+        'jitter': sequence['jitter'],
     }
-import numpy as np
+
+def format_sequence(result):
+    # Stores from before sequence tracking have none of these columns, and store NaN for no jitter
+    if 'duplicates' not in result:
+        return "  Sequence: n/a"
+    jitter = 'n/a' if result['jitter'] is None or result['jitter'] != result['jitter'] else f"{result['jitter']:.2f} ms"
+    return (f"  Duplicates: {result['duplicates']}, Reordered: {result['reordered']} (max depth {result['max_reorder_depth']}), "
+            f"Gaps: {result['gaps']} (longest {result['longest_gap']}), Jitter: {jitter}")
 
 def plot_results(all_results, payload_length):
-    plt.figure(figsize=(12, 8))
-    
     frequencies = sorted(all_results.keys())
-    throughput = [r['throughput'] for r in all_results.values()]
-
-    # Function to add statistics
-    def add_stats(data, color):
-        stats = {
-            'max': max(data),
-            'min': min(data),
-            'avg': np.mean(data),
-            'median': np.median(data)
-        }
-
-        for stat, value in stats.items():
-            plt.axhline(y=value, color=color, linestyle='--', alpha=0.5)
-            plt.text(frequencies[-1] * 1.02, value, f'{stat.capitalize()}: {value:.2f}', 
-                     color=color, verticalalignment='center')
-
-        return stats
-
-    # Plot throughput
-    plt.plot(frequencies, throughput, 'bo-', label='Throughput')
-    plt.xlabel('Frequency (messages/second)')
-    plt.ylabel('Throughput (messages/second)')
-    plt.title(f'Throughput vs Frequency (Message Length: {payload_length} bytes)')
-    plt.grid(True)
-
-    # Add throughput statistics
-    throughput_stats = add_stats(throughput, 'blue')
-
-    plt.tight_layout()
+    throughput = [all_results[frequency]['throughput'] for frequency in frequencies]
+
+    summary = summarize(throughput)
+    throughput_stats = {
+        'max': summary['max'],
+        'min': summary['min'],
+        'avg': summary['mean'],
+        'median': summary['p50'],
+        'p90': summary['p90'],
+        'std': summary['std']
+    }
+
     filename = datetime.now().strftime('%Y%m%d_%H%M%S')
-    plt.savefig(f'{filename}_throughput_test.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    plotting.submit(plotting.throughput, f'{filename}_throughput_test.png', frequencies, throughput,
+                    throughput_stats, payload_length)
 
     # Print summary
     print("\nSummary:")
@@ -102,6 +95,7 @@ def plot_results(all_results, payload_length):
         print(f"  Packet Loss Rate: {(result['sent'] - result['received']) / result['sent'] * 100:.2f}%")
         print(f"  Duration: {result['duration']:.2f} s")
         print(f"  Throughput: {result['throughput']:.2f} msg/s")
+        print(format_sequence(result))
         print()
 
     print("Throughput Statistics:")
@@ -122,18 +116,21 @@ def main():
     frequency_step = 1
     iterations = 10
     encrypted = False
+    verbosity = LINES  # SUMMARY prints only test results, COMMANDS adds the commands sent; the log file gets everything
 
     # Open serial ports
     for node in nodes:
         node['serial'] = serial.Serial(node['port'], 115200, timeout=1)
 
-    message_queue = queue.Queue()
+    router = EventRouter()
     stop_event = threading.Event()
+    # Echoed lines are printed and logged from the sink's own thread, not the readers
+    log = LogSink(datetime.now().strftime('%Y%m%d_%H%M%S') + '_serial', verbosity).start()
 
     # Start reading threads
     threads = []
     for node in nodes:
-        thread = threading.Thread(target=read_from_port, args=(node['serial'], message_queue, stop_event))
+        thread = threading.Thread(target=read_from_port, args=(node['serial'], router, stop_event, None, log))
         thread.start()
         threads.append(thread)
 
@@ -143,9 +140,10 @@ def main():
         for frequency in range(min_frequency, max_frequency + 1, frequency_step):
             print(f"\n--- Testing {'encrypted' if encrypted else 'unencrypted'} throughput at {frequency} msg/s ---")
             payload = generate_payload(payload_length)
-            result = run_throughput_test(nodes[0], nodes[1], payload, frequency, iterations, message_queue, encrypted)
+            result = run_throughput_test(nodes[0], nodes[1], payload, frequency, iterations, router, encrypted, log=log)
             all_results[frequency] = result
             print(f"Throughput: {result['throughput']:.2f} msg/s")
+            print(format_sequence(result))
 
     finally:
         stop_event.set()
@@ -154,6 +152,7 @@ def main():
 
         for node in nodes:
             node['serial'].close()
+        log.stop()
         print("\nSerial ports closed")
 
     # Plotting
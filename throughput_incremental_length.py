@@ -1,169 +1,119 @@
+import os
 import serial
 import time
-import json
-import random
-import string
-import matplotlib.pyplot as plt
-from statistics import mean
 import threading
-import queue
-from datetime import datetime, timedelta
+from datetime import datetime
+from serial_reader import read_from_port
+from log_sink import LogSink, LINES
+from event_router import EventRouter
+from result_store import ResultStore
+from throughput import generate_payload, run_throughput_test, format_sequence
 import numpy as np
-
-def current_milli_time():
-    return datetime.now().strftime('%H:%M:%S.%f')[:-3]
-
-def generate_payload(length):
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
-
-def read_from_port(ser, message_queue, stop_event):
-    while not stop_event.is_set():
-        if ser.in_waiting:
-            response = ser.readline().decode().strip()
-            timestamp = current_milli_time()
-            print(f"[{timestamp}][{ser.port} IN] {response}")
-            message_queue.put((ser.port, timestamp, response))
-
-def run_throughput_test(sender, receiver, payload, frequency, iterations, message_queue, encrypted=False, timeout=10):
-    command = f"hirg -r {receiver['node_id']} -{('s' if encrypted else 'p')} {payload} -t {frequency} -i {iterations}\n"
-    timestamp = current_milli_time()
-    print(f"[{timestamp}][{sender['port']} OUT] {command.strip()}")
-    sender['serial'].write(command.encode())
-
-    received_messages = 0
-    start_time = datetime.now()
-    expected_duration = iterations / frequency
-    end_time = start_time + timedelta(seconds=max(expected_duration * 2, timeout))
-
-    received_message_numbers = set()
-
-    while datetime.now() < end_time and len(received_message_numbers) < iterations:
-        try:
-            port, timestamp, message = message_queue.get(timeout=0.1)
-            if port == receiver['port']:
-                if "Received from" in message and "msg=" in message:
-                    msg_content = message.split("msg=", 1)[1].strip()
-                    if msg_content.lower() == 'null':
-                        print(f"Received null message: {message}")
-                        continue
-                    try:
-                        message_data = json.loads(msg_content)
-                        if isinstance(message_data, dict):
-                            message_number = message_data.get('message_number')
-                            if message_number and message_number not in received_message_numbers:
-                                received_message_numbers.add(message_number)
-                                received_messages += 1
-                        else:
-                            print(f"Unexpected message format: {message_data}")
-                    except json.JSONDecodeError:
-                        print(f"Error decoding JSON from message: {message}")
-        except queue.Empty:
-            continue
-
-    actual_end_time = datetime.now()
-    duration = (actual_end_time - start_time).total_seconds()
-    throughput = received_messages / duration if duration > 0 else 0
-
-    return {
-        'sent': iterations,
-        'received': received_messages,
-        'duration': duration,
-        'throughput': throughput,
-        'packet_loss': (iterations - received_messages) / iterations * 100
-    }
-import numpy as np
-
-def plot_results(all_results, payload_length):
-    plt.figure(figsize=(12, 8))
-    
+import plotting
+
+def is_saturated(result, loss_threshold):
+    # A test that errored out is treated as one the link could not carry
+    return result is None or result['packet_loss'] > loss_threshold
+
+def frontier_index(count, saturated, hint=None):
+    # Index of the first saturated frequency (count if none), assuming loss
+    # only grows with frequency. saturated(index) runs or looks up that cell.
+    # Starting from hint (the neighbouring payload length's frontier), the
+    # search gallops outwards to bracket the frontier, then bisects.
+    low, high = 0, count  # Everything below low is unsaturated, everything from high on is saturated
+    if hint is not None and count:
+        index = min(max(hint, 0), count - 1)
+        step = 1
+        if saturated(index):
+            high = index
+            while index - step >= low:
+                if not saturated(index - step):
+                    low = index - step + 1
+                    break
+                high = index - step
+                step *= 2
+        else:
+            low = index + 1
+            while index + step < high:
+                if saturated(index + step):
+                    high = index + step
+                    break
+                low = index + step + 1
+                step *= 2
+    while low < high:
+        middle = (low + high) // 2
+        if saturated(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+def sweep_frontier(frequencies, payload_lengths, run_cell, loss_threshold, margin=1):
+    # Per payload length, search frequency for the saturation frontier, then
+    # fill in `margin` cells either side of it. run_cell(frequency, length)
+    # returns the result, re-using any cell already measured.
+    frontier = {}
+    hint = None
+    for payload_length in payload_lengths:
+        index = frontier_index(len(frequencies),
+                               lambda i: is_saturated(run_cell(frequencies[i], payload_length), loss_threshold), hint)
+        for near in range(max(0, index - margin), min(len(frequencies), index + margin)):
+            run_cell(frequencies[near], payload_length)
+        frontier[payload_length] = frequencies[index] if index < len(frequencies) else None
+        hint = index
+    return frontier
+
+def interpolate_columns(data, frequencies, payload_lengths, frontier):
+    # data: frequencies x payload_lengths with NaN for cells not run
+    data = data.copy()
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    for j, length in enumerate(payload_lengths):
+        edge = frontier.get(length)
+        boundary = np.searchsorted(frequencies, edge) if edge is not None else len(frequencies)
+        # Below the frontier throughput follows the offered rate, so it is the
+        # ratio to frequency that is interpolated; above it throughput sits at
+        # the link's capacity and is interpolated as is
+        for rows, relative in ((slice(0, boundary), True), (slice(boundary, len(frequencies)), False)):
+            column = data[rows, j]
+            known = ~np.isnan(column)
+            if not known.any():
+                continue
+            scale = frequencies[rows] if relative else np.ones(column.size)
+            column[~known] = np.interp(frequencies[rows][~known], frequencies[rows][known],
+                                       column[known] / scale[known]) * scale[~known]
+    return data
+
+def plot_heatmap_results(all_results, frontier=None):
     frequencies = sorted(all_results.keys())
-    throughput = [r['throughput'] for r in all_results.values()]
-
-    # Function to add statistics
-    def add_stats(data, color):
-        stats = {
-            'max': max(data),
-            'min': min(data),
-            'avg': np.mean(data),
-            'median': np.median(data)
-        }
-
-        for stat, value in stats.items():
-            plt.axhline(y=value, color=color, linestyle='--', alpha=0.5)
-            plt.text(frequencies[-1] * 1.02, value, f'{stat.capitalize()}: {value:.2f}', 
-                     color=color, verticalalignment='center')
-
-        return stats
-
-    # Plot throughput
-    plt.plot(frequencies, throughput, 'bo-', label='Throughput')
-    plt.xlabel('Frequency (messages/second)')
-    plt.ylabel('Throughput (messages/second)')
-    plt.title(f'Throughput vs Frequency (Message Length: {payload_length} bytes)')
-    plt.grid(True)
-
-    # Add throughput statistics
-    throughput_stats = add_stats(throughput, 'blue')
-
-    plt.tight_layout()
-    filename = datetime.now().strftime('%Y%m%d_%H%M%S')
-    plt.savefig(f'{filename}_throughput_test.png', dpi=300, bbox_inches='tight')
-    plt.show()
-
-    # Print summary
-    print("\nSummary:")
-    for freq, result in all_results.items():
-        print(f"Frequency: {freq} msg/s")
-        print(f"  Sent: {result['sent']}")
-        print(f"  Received: {result['received']}")
-        print(f"  Packet Loss Rate: {(result['sent'] - result['received']) / result['sent'] * 100:.2f}%")
-        print(f"  Duration: {result['duration']:.2f} s")
-        print(f"  Throughput: {result['throughput']:.2f} msg/s")
-        print()
-
-    print("Throughput Statistics:")
-    for stat, value in throughput_stats.items():
-        print(f"  {stat.capitalize()}: {value:.2f} msg/s")
-
-    return throughput_stats
-
-def plot_heatmap_results(all_results):
-    plt.figure(figsize=(20, 12))  # Increased width to accommodate more frequency labels
+    payload_lengths = sorted({length for results in all_results.values() for length in results})
     
-    frequencies = sorted(list(all_results.keys()))
-    payload_lengths = sorted(list(all_results[frequencies[0]].keys()))
-    
-    data = np.zeros((len(frequencies), len(payload_lengths)))
+    # Cells that were never run (interrupted or skipped sweeps) stay NaN and render blank
+    data = np.full((len(frequencies), len(payload_lengths)), np.nan)
     
     for i, freq in enumerate(frequencies):
         for j, length in enumerate(payload_lengths):
-            data[i, j] = all_results[freq][length]['throughput']
-    
-    # Create the heatmap
-    im = plt.imshow(data, cmap='viridis', aspect='auto', origin='lower')
-    plt.colorbar(im, label='Throughput (messages/second)')
-    
-    # Add text annotations
-    for i in range(len(frequencies)):
-        for j in range(len(payload_lengths)):
-            value = data[i, j]
-            color = 'white' if value < np.mean(data) else 'black'
-            plt.text(j, i, f'{value:.2f}', ha='center', va='center', color=color, fontsize=8)
-    
-    plt.xlabel('Message Length (bytes)')
-    plt.ylabel('Frequency (messages/second)')
-    plt.title('Mesh Network Throughput')
-    plt.xticks(range(len(payload_lengths)), payload_lengths)
-    plt.yticks(range(0, len(frequencies), 10), frequencies[::10])  # Show every 10th frequency label
-    
+            if length in all_results[freq]:
+                data[i, j] = all_results[freq][length]['throughput']
+    measured = ~np.isnan(data)
+
+    frontier_rows = None
+    if frontier is not None:
+        # An adaptive sweep only measured cells near the frontier; the rest of
+        # each column is interpolated along frequency on its side of it
+        data = interpolate_columns(data, frequencies, payload_lengths, frontier)
+        frontier_rows = [frequencies.index(frontier[length]) if frontier.get(length) in frequencies else len(frequencies)
+                         for length in payload_lengths]
+
     filename = datetime.now().strftime('%Y%m%d_%H%M%S')
-    plt.savefig(f'{filename}_throughput_heatmap.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    plotting.submit(plotting.throughput_heatmap, f'{filename}_throughput_heatmap.png', frequencies, payload_lengths, data,
+                    measured if frontier is not None else None, frontier_rows)
 
     # Print summary
     print("\nSummary:")
     for freq in frequencies:
         for length in payload_lengths:
+            if length not in all_results[freq]:
+                continue
             result = all_results[freq][length]
             print(f"Frequency: {freq} msg/s, Length: {length} bytes")
             print(f"  Sent: {result['sent']}")
@@ -171,8 +121,14 @@ def plot_heatmap_results(all_results):
             print(f"  Packet Loss Rate: {(result['sent'] - result['received']) / result['sent'] * 100:.2f}%")
             print(f"  Duration: {result['duration']:.2f} s")
             print(f"  Throughput: {result['throughput']:.2f} msg/s")
+            print(format_sequence(result))
             print()
-            
+    if frontier is not None:
+        print("Saturation frontier:")
+        for length in payload_lengths:
+            if length in frontier:
+                saturates = frontier[length]
+                print(f"  {length} bytes: " + (f"saturates from {saturates} msg/s" if saturates is not None else "no saturation in range"))
 def main():
     # Configuration
     nodes = [
@@ -186,50 +142,85 @@ def main():
     max_frequency = 100
     frequency_step = 5
     iterations = 10
+    timeout = 10  # Minimum seconds to wait for a test's messages (at least twice the run's nominal length)
     encrypted = False
     delay_between_tests = 1  # Add a small delay (in seconds) between tests if needed
+    resume = None  # Directory of an interrupted run's store to continue; completed cells are skipped
+    adaptive = False  # True searches each payload length for the saturation frontier instead of running every cell
+    loss_threshold = 10.0  # Packet loss (%) above which a cell counts as saturated
+    frontier_margin = 1  # Cells measured on each side of the frontier
+    verbosity = LINES  # SUMMARY prints only test results, COMMANDS adds the commands sent; the log file gets everything
 
     # Open serial ports
     for node in nodes:
         node['serial'] = serial.Serial(node['port'], 115200, timeout=1)
 
-    message_queue = queue.Queue()
+    router = EventRouter()
     stop_event = threading.Event()
 
+    # Every raw line and every finished test is appended to disk as it happens
+    store = ResultStore(resume or datetime.now().strftime('%Y%m%d_%H%M%S') + '_throughput_store')
+    router.subscribe([node['port'] for node in nodes], callback=store.events)
+    completed = store.completed('frequency', 'payload_length')
+    print(f"Storing results in {store.directory}" + (f", {len(completed)} tests already done" if completed else ""))
+    # Echoed lines are printed and logged from the sink's own thread, not the readers
+    log = LogSink(os.path.join(store.directory, 'serial'), verbosity).start()
+
     # Start reading threads
     threads = []
     for node in nodes:
-        thread = threading.Thread(target=read_from_port, args=(node['serial'], message_queue, stop_event))
+        thread = threading.Thread(target=read_from_port, args=(node['serial'], router, stop_event, None, log))
         thread.start()
         threads.append(thread)
 
     all_results = {}
+    for row in store.results.rows_as_dicts():
+        all_results.setdefault(row.pop('frequency'), {})[row.pop('payload_length')] = row
+
+    frequencies = list(range(min_frequency, max_frequency + 1, frequency_step))
+    payload_lengths = list(range(min_payload_length, max_payload_length + 1, payload_length_step))
+    for frequency in frequencies:
+        all_results.setdefault(frequency, {})
+    failed = set()
+
+    def run_cell(frequency, payload_length):
+        # Runs one test, or returns the stored result if this cell was already done
+        if payload_length in all_results[frequency]:
+            return all_results[frequency][payload_length]
+        if (frequency, payload_length) in failed:
+            return None
+        print(f"\n--- Testing {'encrypted' if encrypted else 'unencrypted'} throughput at {frequency} msg/s with payload length {payload_length} bytes ---")
+        payload = generate_payload(payload_length)
+        result = None
 
+        try:
+            result = run_throughput_test(nodes[0], nodes[1], payload, frequency, iterations, router, encrypted, timeout, log=log)
+            all_results[frequency][payload_length] = result
+            store.record({'frequency': frequency, 'payload_length': payload_length, **result})
+            print(f"Sent: {result['sent']} messages")
+            print(f"Received: {result['received']} messages")
+            print(f"Throughput: {result['throughput']:.2f} msg/s")
+            print(f"Packet Loss: {result['packet_loss']:.2f}%")
+            print(f"Duration: {result['duration']:.2f} s")
+            print(format_sequence(result).strip())
+        except Exception as e:
+            print(f"Error during test: {e}")
+            print(f"Skipping test for frequency {frequency} and payload length {payload_length}")
+            failed.add((frequency, payload_length))
+
+        # Add a small delay between tests
+        time.sleep(delay_between_tests)
+        return result
+
+    frontier = None
+    start_time = time.perf_counter()
     try:
-        for frequency in range(min_frequency, max_frequency + 1, frequency_step):
-            all_results[frequency] = {}
-            for payload_length in range(min_payload_length, max_payload_length + 1, payload_length_step):
-                print(f"\n--- Testing {'encrypted' if encrypted else 'unencrypted'} throughput at {frequency} msg/s with payload length {payload_length} bytes ---")
-                payload = generate_payload(payload_length)
-                
-                # Clear the message queue before each test
-                while not message_queue.empty():
-                    message_queue.get_nowait()
-                
-                try:
-                    result = run_throughput_test(nodes[0], nodes[1], payload, frequency, iterations, message_queue, encrypted)
-                    all_results[frequency][payload_length] = result
-                    print(f"Sent: {result['sent']} messages")
-                    print(f"Received: {result['received']} messages")
-                    print(f"Throughput: {result['throughput']:.2f} msg/s")
-                    print(f"Packet Loss: {result['packet_loss']:.2f}%")
-                    print(f"Duration: {result['duration']:.2f} s")
-                except Exception as e:
-                    print(f"Error during test: {e}")
-                    print(f"Skipping test for frequency {frequency} and payload length {payload_length}")
-                
-                # Add a small delay between tests
-                time.sleep(1)
+        if adaptive:
+            frontier = sweep_frontier(frequencies, payload_lengths, run_cell, loss_threshold, frontier_margin)
+        else:
+            for frequency in frequencies:
+                for payload_length in payload_lengths:
+                    run_cell(frequency, payload_length)
 
     except KeyboardInterrupt:
         print("\nTest interrupted by user.")
@@ -240,8 +231,13 @@ def main():
 
         for node in nodes:
             node['serial'].close()
+        log.stop()
         print("\nSerial ports closed")
-    plot_heatmap_results(all_results)
+        store.close()
+        print(f"Results stored in {store.directory}")
+    measured = sum(len(results) for results in all_results.values())
+    print(f"{measured} of {len(frequencies) * len(payload_lengths)} cells measured in {time.perf_counter() - start_time:.0f} s")
+    plot_heatmap_results(all_results, frontier)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
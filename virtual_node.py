@@ -0,0 +1,594 @@
+import heapq
+import itertools
+import json
+import os
+import pty
+import random
+import selectors
+import threading
+import time
+import tty
+import firmware_crypto
+from collections import deque
+
+# Mirrors the serial behaviour of Hieroglossa_1_2_simple.ino closely enough for
+# the test scripts to run unchanged against it: same commands, same printed
+# lines in the same order. Local encryption tests use the firmware's own
+# scheme (firmware_crypto), so their ciphertexts verify; secure messages carry
+# random bytes of the right length and the plaintext travels alongside them.
+
+USAGE = "hirg -r <nodeid> [-s <payload> | -p <payload> [-t <frequency> -i <iterations>] | -l <random payload length>]"
+LATENCY_TEST_TIMEOUT = 5.0  # performLatencyTest waits 5 s for the reflection
+
+def to_json(document):
+    # ArduinoJson's serializeJson: compact, keys in insertion order
+    return json.dumps(document, separators=(',', ':'))
+
+def random_payload(length):
+    return ''.join(chr(random.randint(32, 126)) for _ in range(length))
+
+def random_hex(length, upper=False):
+    text = os.urandom(length).hex()
+    return text.upper() if upper else text
+
+class VirtualNode:
+    def __init__(self, mesh, node_id, baudrate=115200, encryption_us=(250, 60), command_char_delay=0.0):
+        self.mesh = mesh
+        self.node_id = node_id
+        self.baudrate = baudrate
+        self.encryption_us = encryption_us  # (fixed cost, cost per 16-byte block) in microseconds
+        self.command_char_delay = command_char_delay
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.keys = set()        # nodes an ECDH key has been exchanged with
+        self.input = bytearray()
+        self.commands = deque()
+        self.busy = False        # SerialReadLine is blocked in a latency or encryption test
+        self.latency_test = None
+        self.output = bytearray()
+        self.tx_free_at = 0.0
+        self.scheduled_until = 0.0  # Lines queued behind the baud limit must not be overtaken
+
+    def config(self):
+        return {'port': self.port, 'node_id': self.node_id}
+
+    # Serial output
+
+    def println(self, line=''):
+        self.write(line + '\r\n')
+
+    def print(self, text):
+        self.write(text)
+
+    def write(self, text):
+        data = text.encode('utf-8', errors='replace')
+        if not self.baudrate:
+            self._emit(data)
+            return
+        # A UART sends 10 bits per byte; the host sees a line once its last byte is out
+        now = time.perf_counter()
+        self.tx_free_at = max(now, self.tx_free_at) + len(data) * 10 / self.baudrate
+        if self.tx_free_at - now < 0.0005 and now >= self.scheduled_until:
+            self._emit(data)
+        else:
+            self.scheduled_until = self.tx_free_at
+            self.mesh.schedule(self.tx_free_at - now, self._emit, data)
+
+    def _emit(self, data):
+        self.output += data
+        self.flush()
+
+    def flush(self):
+        if not self.output:
+            return
+        try:
+            written = os.write(self.master, self.output)
+            del self.output[:written]
+        except BlockingIOError:
+            pass
+        self.mesh.watch_output(self, bool(self.output))
+
+    # Serial input
+
+    def on_readable(self):
+        try:
+            data = os.read(self.master, 4096)
+        except OSError:
+            return
+        for byte in data:
+            if byte == 0x0A:
+                if self.input:
+                    self.commands.append(self.input.decode('utf-8', errors='replace'))
+                    self.input = bytearray()
+            else:
+                self.input.append(byte)
+        self.run_commands()
+
+    def run_commands(self):
+        while self.commands and not self.busy:
+            command = self.commands.popleft()
+            if self.command_char_delay:
+                # SerialReadLine takes one character per vTaskDelay(10 ms)
+                self.busy = True
+                self.mesh.schedule(len(command) * self.command_char_delay, self._parse_later, command)
+                return
+            self.parse(command)
+
+    def _parse_later(self, command):
+        self.busy = False
+        self.parse(command)
+        self.run_commands()
+
+    def parse(self, line):
+        # Same index arithmetic as SerialReadLine
+        if not line.startswith("hirg "):
+            self.println(f"Unknown command. Use: {USAGE}")
+            return
+        args = line[5:]
+        recipient_index = args.find("-r ")
+        secure_index = args.find("-s ")
+        plaintext_index = args.find("-p ")
+        throughput_index = args.find("-t ")
+        iterations_index = args.find("-i ")
+        latency_index = args.find("-l ")
+        encrypt_test_index = args.find("-e ")
+
+        if encrypt_test_index != -1:
+            plaintext = args[encrypt_test_index + 3:].strip()
+            self.println("Starting local encryption test")
+            self.local_encryption_test(plaintext)
+        elif recipient_index != -1:
+            recipient_text = args[recipient_index + 3:]
+            next_flag = recipient_text.find('-')
+            if next_flag != -1:
+                recipient_text = recipient_text[:next_flag]
+            recipient = to_uint32(recipient_text.strip())
+
+            if latency_index != -1:
+                length = to_int(args[latency_index + 3:].strip())
+                self.println("Starting latency test")
+                self.latency_test_start(recipient, length)
+            elif plaintext_index != -1:
+                payload_end = throughput_index if throughput_index != -1 else len(args)
+                payload = args[plaintext_index + 3:payload_end].strip()
+                if throughput_index != -1 and iterations_index != -1:
+                    frequency = to_int(args[throughput_index + 3:iterations_index].strip())
+                    iterations = to_int(args[iterations_index + 3:].strip())
+                    self.println("Starting throughput test task")
+                    self.throughput_test(recipient, payload, frequency, iterations)
+                else:
+                    self.println("OUTBOUND")
+                    self.println("Sending plaintext message")
+                    self.mesh.send(self, recipient, payload)
+            elif secure_index != -1:
+                payload = args[secure_index + 3:].strip()
+                self.println("OUTBOUND")
+                self.println("Sending secure message")
+                self.send_secure(recipient, payload)
+            else:
+                self.println(f"Invalid command format. Use: {USAGE}")
+        else:
+            self.println("Invalid command format. Recipient (-r) is required.")
+
+    # Commands
+
+    def latency_test_start(self, recipient, length):
+        payload = random_payload(length)
+        message = to_json({'type': 'latencyTest', 'payload': payload})
+        start = time.perf_counter()
+        if not self.mesh.send(self, recipient, message):
+            self.println(f"Failed to send latency test message to node {recipient}")
+            return
+        self.println(f"Latency test message sent to node {recipient}")
+        self.busy = True
+        timeout = self.mesh.schedule(LATENCY_TEST_TIMEOUT, self.latency_test_timeout)
+        self.latency_test = (payload, start, timeout)
+
+    def latency_test_timeout(self):
+        self.latency_test = None
+        self.println("Latency test timed out")
+        self.busy = False
+        self.run_commands()
+
+    def latency_test_reflection(self, document):
+        if self.latency_test is None or document.get('payload') != self.latency_test[0]:
+            return
+        _, start, timeout = self.latency_test
+        self.mesh.cancel(timeout)
+        self.latency_test = None
+        self.println(f"Round-trip latency /us: {int((time.perf_counter() - start) * 1_000_000)}")
+        self.busy = False
+        self.run_commands()
+
+    def throughput_test(self, recipient, payload, frequency, iterations):
+        self.println("Throughput test task created")
+        recipient = recipient - (1 << 32) if recipient >= 1 << 31 else recipient  # Stored in an int
+        self.println(f"Starting throughput test: recipient={recipient}, payload='{payload}', "
+                     f"freq={frequency} Hz, iterations={iterations}")
+        delay = (1000 // frequency if frequency > 0 else 1000) / 1000
+        start = time.perf_counter()
+
+        def send(number):
+            message = to_json({'message_number': number, 'payload': payload})
+            self.mesh.send(self, recipient & 0xFFFFFFFF, message)
+            self.println(f"Sent message {number} at {int((time.perf_counter() - start) * 1000)} ms: {message}")
+            self.mesh.schedule(start + number * delay - time.perf_counter(), waited, number)
+
+        def waited(number):
+            if number % 10 == 0:
+                self.println(f"Completed {number} iterations at {int((time.perf_counter() - start) * 1000)} ms")
+            if number < iterations:
+                send(number + 1)
+            else:
+                finish()
+
+        def finish():
+            total_ms = int((time.perf_counter() - start) * 1000)
+            actual = iterations / (total_ms / 1000) if total_ms else float('inf')
+            self.println(f"Throughput test completed in {total_ms} ms")
+            self.println(f"Actual frequency: {actual:.2f} Hz")
+
+        if iterations >= 1:
+            send(1)
+        else:
+            finish()
+
+    def encrypt(self, plaintext, key=None):
+        # Prints what encrypt() prints and returns (seconds spent, iv+ciphertext hex)
+        iv = random_hex(16, upper=True)
+        self.println(f"Initialization Vector shuffled: {iv}")
+        raw = plaintext.strip()
+        self.println(raw)
+        blocks = len(raw.encode()) // 16 + 1  # PKCS7 always adds a block's worth at most
+        if key is not None:
+            content = firmware_crypto.encrypt(raw, key, iv)
+            while content is None:
+                # A 0 byte would be dropped from the ciphertext String; the firmware draws another IV
+                self.println("Error: Ciphertext length mismatch detected, retry.")
+                iv = random_hex(16, upper=True)
+                self.println(f"Initialization Vector shuffled: {iv}")
+                content = firmware_crypto.encrypt(raw, key, iv)
+            ciphertext = content[32:]
+        else:
+            # The firmware retries until no ciphertext byte is 0, so no byte here is 0 either
+            ciphertext = bytes(random.randint(1, 255) for _ in range(blocks * 16)).hex().upper()
+        elapsed_us = self.encryption_us[0] + self.encryption_us[1] * blocks
+        self.println(f"Plaintext Length: {len(raw)}")
+        self.println(f"Ciphertext Length: {blocks * 16}")
+        self.println(f"Encryption time /us: {elapsed_us}")
+        self.println(ciphertext)
+        return elapsed_us / 1_000_000, iv + ciphertext
+
+    def decrypt(self, content, plaintext):
+        iv, ciphertext = content[:32], content[32:]
+        self.println(f"IV: {iv.lower()}")
+        self.println(f"Cipher: {ciphertext}")
+        self.println(f"Ciphertext Length: {len(ciphertext) // 2}")
+        self.println(f"Decryption result: {plaintext}")
+        elapsed_us = self.encryption_us[0] + self.encryption_us[1] * (len(ciphertext) // 32)
+        self.println(f"Decryption time /us: {elapsed_us}")
+        return plaintext
+
+    def local_encryption_test(self, plaintext):
+        self.println()
+        self.println("Starting AES Test *********************")
+        key = random_hex(16)
+        self.println(f"Test Key: {key}")
+        elapsed, encrypted = self.encrypt(plaintext, key)
+        self.println(f"Encrypted: {encrypted}")
+        decrypted = self.decrypt(encrypted, plaintext.strip())
+        self.println(f"Decrypted: {decrypted}")
+        if decrypted == plaintext:
+            self.println("Encryption/Decryption successful")
+        else:
+            self.println("Error: Decrypted text does not match original plaintext.")
+
+    def send_secure(self, recipient, payload):
+        if recipient not in self.keys:
+            self.println(f"Error: No key found for node {recipient}")
+            return
+        plaintext = to_json({'type': 'secureMessage', 'sender': self.node_id, 'payload': payload})
+        elapsed, content = self.encrypt(plaintext)
+        message = to_json({'type': 'encryptedMessage', 'content': content})
+
+        def send():
+            if self.mesh.send(self, recipient, message, plaintext=plaintext):
+                self.println(f"Secure message sent to node {recipient}")
+            else:
+                self.println(f"Failed to send secure message to node {recipient}")
+
+        self.mesh.schedule(elapsed, send)
+
+    # Mesh callbacks
+
+    def receive(self, sender, message, plaintext=None):
+        # receivedCallback
+        self.println(f"Received from {sender} msg={message}")
+        try:
+            document = json.loads(message)
+        except ValueError:
+            self.println("Failed to parse received message")
+            return
+
+        if isinstance(document, dict) and 'type' in document:
+            message_type = document['type']
+            if message_type == 'latencyTest':
+                self.println("Received latency test message")
+                document['type'] = 'latencyTestReflection'
+                self.println("OUTBOUND")
+                self.println("Reflecting latency test message")
+                self.mesh.send(self, sender, to_json(document))
+            elif message_type == 'latencyTestReflection':
+                self.println("Received latency test reflection")
+                self.latency_test_reflection(document)
+            elif message_type == 'keyExchange':
+                self.keys.add(sender)
+            elif message_type == 'encryptedMessage':
+                if sender in self.keys and plaintext is not None:
+                    decrypted = self.decrypt(document.get('content', ''), plaintext)
+                    try:
+                        payload = json.loads(decrypted).get('payload')
+                        self.println(f"Decrypted message from {sender}: {payload}")
+                    except (ValueError, AttributeError):
+                        self.println("Failed to parse decrypted message")
+                else:
+                    self.println(f"No shared key found for node {sender}")
+            elif message_type == 'throughputTest':
+                self.println(f"Received throughput test message {document.get('message_number', 0)}: {document.get('payload')}")
+            else:
+                self.println(f"Unknown message type: {message_type}")
+        else:
+            self.println(f"Received message without type: {message}")
+
+        self.println("INBOUND")
+        self.println(message)
+
+    def boot(self):
+        self.println("Hieroglossa Development Project v.1.2")
+        self.println("Configuring Mesh")
+        self.println(f"Node ID: {self.node_id}")
+        self.println("Configuring FreeRTOS")
+        self.println("Generating ECDH keys")
+        self.println("ECDH keys generated")
+        self.println(f"Public Key: {random_hex(42)}")
+        self.println(f"Private Key: {random_hex(21)}")
+        self.println("Finished Setup.")
+
+    def connected(self, other):
+        # ECDH_NewConnectionCallback
+        self.println(f"New connection, nodeId = {other.node_id}")
+        self.println("Changed connections")
+        self.println("Current mesh topology:")
+        self.println(to_json(self.mesh.topology(self)))
+        self.mesh.send(self, other.node_id, to_json({'type': 'keyExchange', 'publicKey': random_hex(42)}))
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+def to_int(text):
+    # String.toInt(): leading integer, 0 when there is none
+    digits = ''
+    for index, char in enumerate(text):
+        if char.isdigit() or (index == 0 and char in '+-'):
+            digits += char
+        else:
+            break
+    try:
+        return int(digits)
+    except ValueError:
+        return 0
+
+def to_uint32(text):
+    # strtoul(..., 10) into a uint32_t
+    return to_int(text.lstrip('+')) & 0xFFFFFFFF
+
+class VirtualMesh:
+    # A set of virtual nodes, each behind its own pty, joined by simulated mesh
+    # links with per-hop latency, jitter and loss. One thread runs every node:
+    # it waits on the pty masters and a timer heap, so hundreds of nodes cost
+    # one thread. nodes() returns [{'port', 'node_id'}] dicts for the scripts.
+
+    def __init__(self, count=2, latency=0.010, jitter=0.002, loss=0.0, baudrate=115200,
+                 links=None, bandwidth=None, boot=True, seed=None, **node_options):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.bandwidth = bandwidth  # bytes per second per hop, None for unlimited
+        self.random = random.Random(seed)
+        self.selector = selectors.DefaultSelector()
+        self.timers = []
+        self.sequence = itertools.count()
+        self.cancelled = set()
+        self.lock = threading.Lock()
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_write, False)
+        self.selector.register(self.wake_read, selectors.EVENT_READ, None)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.by_id = {}
+        ids = set()
+        while len(ids) < count:
+            ids.add(self.random.randint(1, 0xFFFFFFFF))
+        for node_id in ids:
+            node = VirtualNode(self, node_id, baudrate, **node_options)
+            self.by_id[node_id] = node
+            self.selector.register(node.master, selectors.EVENT_READ, node)
+        self.node_list = list(self.by_id.values())
+        # links: list of (index, index) pairs; default is everyone in range of everyone
+        if links is None:
+            links = [(a, b) for a in range(count) for b in range(a + 1, count)]
+        self.neighbours = {node.node_id: set() for node in self.node_list}
+        for a, b in links:
+            self.neighbours[self.node_list[a].node_id].add(self.node_list[b].node_id)
+            self.neighbours[self.node_list[b].node_id].add(self.node_list[a].node_id)
+        self.boot = boot
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def nodes(self):
+        return [node.config() for node in self.node_list]
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        if self.boot:
+            self.call(self._boot)
+        else:
+            for node in self.node_list:
+                node.keys.update(self.neighbours[node.node_id])
+        return self
+
+    def _boot(self):
+        for node in self.node_list:
+            node.boot()
+        for node in self.node_list:
+            for other_id in sorted(self.neighbours[node.node_id]):
+                node.connected(self.by_id[other_id])
+
+    def stop(self):
+        self.stop_event.set()
+        self._wake()
+        if self.thread is not None:
+            self.thread.join()
+        for node in self.node_list:
+            node.close()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+
+    # Scheduling
+
+    def schedule(self, delay, callback, *args):
+        entry = (time.perf_counter() + max(0.0, delay), next(self.sequence), callback, args)
+        with self.lock:
+            heapq.heappush(self.timers, entry)
+        return entry[1]
+
+    def cancel(self, handle):
+        self.cancelled.add(handle)
+
+    def call(self, callback, *args):
+        # Runs callback on the mesh thread as soon as possible; safe from any thread
+        self.schedule(0, callback, *args)
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self.wake_write, b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def watch_output(self, node, pending):
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+        if self.selector.get_key(node.master).events != events:
+            self.selector.modify(node.master, events, node)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            with self.lock:
+                timeout = max(0.0, self.timers[0][0] - time.perf_counter()) if self.timers else None
+            for key, events in self.selector.select(timeout):
+                if key.data is None:
+                    os.read(self.wake_read, 4096)
+                    continue
+                if events & selectors.EVENT_WRITE:
+                    key.data.flush()
+                if events & selectors.EVENT_READ:
+                    key.data.on_readable()
+            now = time.perf_counter()
+            while True:
+                with self.lock:
+                    if not self.timers or self.timers[0][0] > now:
+                        break
+                    _, handle, callback, args = heapq.heappop(self.timers)
+                if handle in self.cancelled:
+                    self.cancelled.discard(handle)
+                    continue
+                callback(*args)
+
+    # Mesh
+
+    def route(self, source, destination):
+        # Hop count of the shortest path, or None when unreachable
+        if source == destination:
+            return None
+        seen = {source}
+        frontier = [source]
+        hops = 0
+        while frontier:
+            hops += 1
+            next_frontier = []
+            for node_id in frontier:
+                for neighbour in self.neighbours[node_id]:
+                    if neighbour == destination:
+                        return hops
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        return None
+
+    def send(self, sender, recipient, message, plaintext=None):
+        # mesh.sendSingle: False without a route, otherwise True even if a hop drops it
+        hops = self.route(sender.node_id, recipient)
+        if hops is None:
+            return False
+        delay = 0.0
+        for _ in range(hops):
+            if self.loss and self.random.random() < self.loss:
+                return True
+            delay += max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            if self.bandwidth:
+                delay += len(message) / self.bandwidth
+        self.schedule(delay, self.by_id[recipient].receive, sender.node_id, message, plaintext)
+        return True
+
+    def topology(self, root):
+        # subConnectionJson: spanning tree of the mesh as seen from root
+        seen = {root.node_id}
+
+        def subtree(node_id):
+            children = []
+            for neighbour in sorted(self.neighbours[node_id]):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    children.append(neighbour)
+            return {'nodeId': node_id, 'subs': [subtree(child) for child in children]}
+
+        return subtree(root.node_id)
+
+def main():
+    node_count = 2
+    latency = 0.010  # Seconds per hop
+    jitter = 0.002  # +/- seconds per hop
+    loss = 0.0  # Probability a hop drops a message
+    baudrate = 115200  # Serial output limit, None for unlimited
+    links = None  # [(index, index), ...]; None connects every pair
+
+    mesh = VirtualMesh(node_count, latency, jitter, loss, baudrate, links)
+    mesh.start()
+    print("Virtual nodes:")
+    for node in mesh.nodes():
+        print(f"  {{'port': '{node['port']}', 'node_id': {node['node_id']}}}")
+    print("Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mesh.stop()
+        print("\nVirtual nodes stopped")
+
+if __name__ == "__main__":
+    main()